@@ -0,0 +1,73 @@
+#===============================================================================
+
+import json
+
+#===============================================================================
+
+# the file is read in chunks of this many characters
+CHUNK_SIZE = 64*1024
+
+# the fields of an annotation record that are kept
+ANNOTATION_FIELDS = ['group', 'region', 'model']
+
+WHITESPACE = ' \t\n\r'
+
+#===============================================================================
+
+def _iter_array_items(fp, chunk_size):
+    # the values of a top-level JSON array, decoded one at a time
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+
+    def read_more():
+        nonlocal buffer, position
+        chunk = fp.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return len(chunk) > 0
+
+    def next_character(skip):
+        # the next character not in ``skip``, or None at the end of the file
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in skip:
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not read_more():
+                return None
+
+    if next_character(WHITESPACE) != '[':
+        raise ValueError('Annotation file is not a JSON array')
+    position += 1
+    while (character := next_character(WHITESPACE + ',')) != ']':
+        if character is None:
+            raise ValueError('Annotation file ends before its JSON array is closed')
+        while True:
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+                break
+            except json.JSONDecodeError:
+                # the item may continue past the end of the buffer
+                if not read_more():
+                    raise
+        yield item
+
+def iter_annotations(path, chunk_size=CHUNK_SIZE):
+    """
+    Incrementally parse a man-in-box annotation file, a JSON array of annotation
+    records, yielding a dictionary for each record with just its ``group``,
+    ``region`` and ``model`` fields (those present) and, as ``coordinates``, the
+    coordinates of its point.
+
+    Only the current record and a chunk of the file are held in memory.
+    """
+    with open(path, 'r') as fp:
+        for record in _iter_array_items(fp, chunk_size):
+            annotation = {field: record[field] for field in ANNOTATION_FIELDS if field in record}
+            if (coordinates := record.get('feature', {}).get('geometry', {}).get('coordinates')):
+                annotation['coordinates'] = coordinates[0]
+            yield annotation
+
+#===============================================================================
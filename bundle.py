@@ -0,0 +1,438 @@
+#===============================================================================
+
+from abc import ABC, abstractmethod
+from collections.abc import Mapping
+import hashlib
+import json
+import logging as log
+import mmap
+from multiprocessing.shared_memory import SharedMemory
+from types import MappingProxyType
+import struct
+import zlib
+
+import numpy as np
+
+#===============================================================================
+
+# a bundle is laid out as:
+#   MAGIC, version and header length (``HEADER_FORMAT``)
+#   a JSON header with the hashes of the source files and the
+#   dtype, shape and offset of each array section
+#   the array sections, each aligned to SECTION_ALIGNMENT bytes
+
+BUNDLE_MAGIC = b'NERVEBDL'
+BUNDLE_VERSION = 2
+
+HEADER_FORMAT = '<8sII'
+SECTION_ALIGNMENT = 8
+
+# strings are stored NUL separated in a single section, with the offset of
+# each string in another, and referred to by index
+STRING_SEPARATOR = '\0'
+NO_STRING = -1
+
+# keys are found through open addressing hash tables of row numbers, hashed
+# with CRC-32 so that every process finds them in the same slots
+EMPTY_SLOT = -1
+
+def file_hash(path):
+    with open(path, 'rb') as fp:
+        return hashlib.file_digest(fp, 'sha256').hexdigest()
+
+def aligned(offset):
+    return (offset + SECTION_ALIGNMENT - 1)//SECTION_ALIGNMENT*SECTION_ALIGNMENT
+
+#===============================================================================
+
+class StringTable:
+    def __init__(self):
+        self.__strings = []
+        self.__index = {}
+
+    def add(self, string):
+        if string is None:
+            return NO_STRING
+        if (index := self.__index.get(string)) is None:
+            index = self.__index[string] = len(self.__strings)
+            self.__strings.append(string)
+        return index
+
+    def encoded(self):
+        return np.frombuffer(STRING_SEPARATOR.join(self.__strings).encode(), dtype=np.uint8)
+
+    def offsets(self):
+        offsets = np.zeros(len(self.__strings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(string.encode()) + 1 for string in self.__strings])
+        return offsets
+
+def packed_lists(lists, strings):
+    # lists of strings, as offsets into one array of string indices
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.array([strings.add(value) for values in lists for value in values], dtype=np.int32)
+    return offsets, values
+
+def key_hash(key):
+    return zlib.crc32(key.encode())
+
+def hash_table(keys):
+    # the row of each key, in the slot its hash gives or the next empty one
+    slots = 1 << max(2*len(keys) - 1, 1).bit_length()
+    table = np.full(slots, EMPTY_SLOT, dtype=np.int32)
+    for row, key in enumerate(keys):
+        slot = key_hash(key) & (slots - 1)
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = row
+    return table
+
+#===============================================================================
+
+def bundle_bytes(nerve_pathways, nerves):
+    """
+    The nerve tables of a ``NervePathways`` and ``Nerves`` as a bundle, along
+    with the hashes of the files they were loaded from.
+    """
+    strings = StringTable()
+    sections = {}
+
+    # nerve pathways, in table order
+    pathways = list(nerve_pathways.nerves.values())
+    sections['pathway_id'] = np.array([strings.add(nerve['id'][0]) for nerve in pathways], dtype=np.int32)
+    sections['pathway_id_hash'] = hash_table([nerve['id'][0] for nerve in pathways])
+    sections['pathway_name'] = np.array([strings.add(nerve['name']) for nerve in pathways], dtype=np.int32)
+    sections['pathway_in_3d_map'] = np.array([nerve['in_3d_map'] for nerve in pathways], dtype=np.uint8)
+    sections['pathway_bilateral'] = np.array([strings.add(nerve['bilaterals'][0]) if 'bilaterals' in nerve else NO_STRING
+                                                for nerve in pathways], dtype=np.int32)
+    for key in ['origins', 'destinations', 'landmarks']:
+        sections[f'pathway_{key}_offsets'], sections[f'pathway_{key}'] = packed_lists(
+            [nerve[key] for nerve in pathways], strings)
+    sections['pathway_laterals_offsets'], sections['pathway_laterals'] = packed_lists(
+        [[lateral[0] for lateral in nerve.get('laterals', [])] for nerve in pathways], strings)
+    # the left and right leaf nerves that ``get_laterals`` finds for each nerve
+    for side in ['left', 'right']:
+        sections[f'pathway_{side}_offsets'], sections[f'pathway_{side}'] = packed_lists(
+            [nerve_pathways.get_laterals(nerve['id'])[side] for nerve in pathways], strings)
+
+    # man-in-box nerves and their points, with points in the order they were annotated
+    maninbox = list(nerves.nerves.values())
+    nerve_indices = {nerve['id']: n for n, nerve in enumerate(maninbox)}
+    sections['maninbox_id'] = np.array([strings.add(nerve['id']) for nerve in maninbox], dtype=np.int32)
+    sections['maninbox_id_hash'] = hash_table([nerve['id'] for nerve in maninbox])
+    sections['maninbox_label'] = np.array([strings.add(nerve['label']) for nerve in maninbox], dtype=np.int32)
+    sections['maninbox_point_offsets'] = np.zeros(len(maninbox) + 1, dtype=np.int32)
+    sections['maninbox_point_offsets'][1:] = np.cumsum([len(nerve['points']) for nerve in maninbox])
+    points = [(ordinal, point) for nerve in maninbox for ordinal, point in nerve['points'].items()]
+    sections['point_ordinal'] = np.array([ordinal for ordinal, _ in points], dtype=np.int32)
+    sections['point_group'] = np.array([strings.add(point['group']) for _, point in points], dtype=np.int32)
+    sections['point_row'] = np.array([point['index'] for _, point in points], dtype=np.int32)
+    sections['coordinates'] = np.ascontiguousarray(nerves.coordinates, dtype=np.float64)
+    sections['id_map_key'] = np.array([strings.add(key) for key in nerves.id_map], dtype=np.int32)
+    sections['id_map_key_hash'] = hash_table(list(nerves.id_map))
+    sections['id_map_nerve'] = np.array([nerve_indices[nerve_id] for nerve_id in nerves.id_map.values()], dtype=np.int32)
+
+    sections['strings'] = strings.encoded()
+    sections['string_offsets'] = strings.offsets()
+
+    header = {
+        'sources': {
+            'pathways': nerve_pathways.source_hash,
+            'points': nerves.source_hash,
+        },
+        'sections': {},
+    }
+    offset = 0
+    for name, array in sections.items():
+        header['sections'][name] = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset,
+        }
+        offset = aligned(offset + array.nbytes)
+    header_bytes = json.dumps(header).encode()
+    data_start = aligned(struct.calcsize(HEADER_FORMAT) + len(header_bytes))
+
+    data = bytearray(data_start + offset)
+    struct.pack_into(HEADER_FORMAT, data, 0, BUNDLE_MAGIC, BUNDLE_VERSION, len(header_bytes))
+    data[struct.calcsize(HEADER_FORMAT):struct.calcsize(HEADER_FORMAT)+len(header_bytes)] = header_bytes
+    for name, array in sections.items():
+        start = data_start + header['sections'][name]['offset']
+        data[start:start+array.nbytes] = array.tobytes()
+    return data
+
+def write_bundle(path, nerve_pathways, nerves):
+    """
+    Write the nerve tables of a ``NervePathways`` and ``Nerves`` to a bundle
+    file, along with the hashes of the files they were loaded from.
+    """
+    with open(path, 'wb') as fp:
+        fp.write(bundle_bytes(nerve_pathways, nerves))
+
+def share_bundle(nerve_pathways, nerves):
+    """
+    A bundle of the nerve tables in a new block of shared memory, which other
+    processes open by name with ``attach_bundle``. The caller closes and unlinks
+    the block when it is no longer needed.
+    """
+    data = bundle_bytes(nerve_pathways, nerves)
+    shared_memory = SharedMemory(create=True, size=len(data))
+    shared_memory.buf[:len(data)] = data
+    return shared_memory
+
+class AttachedMemory(SharedMemory):
+    # arrays of an attached bundle may be in use until the process exits, so
+    # the block is left mapped rather than closed when no longer referenced
+    def __del__(self):
+        pass
+
+def attach_bundle(name):
+    return NerveBundle(name, AttachedMemory(name=name))
+
+#===============================================================================
+
+class NerveBundle:
+    """
+    A compiled bundle of the nerve pathway and man-in-box tables, opened by
+    memory-mapping, or in a block of shared memory. Arrays are read-only views
+    of the mapped file or block. A bundle of another version has no source
+    hashes, so it is out of date for every source and they are loaded instead.
+    """
+    def __init__(self, path, shared_memory:SharedMemory=None):
+        self.__path = path
+        self.__shared_memory = shared_memory
+        if shared_memory is not None:
+            self.__buffer = shared_memory.buf.toreadonly()
+        else:
+            with open(path, 'rb') as fp:
+                self.__buffer = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, header_length = struct.unpack_from(HEADER_FORMAT, self.__buffer)
+        if magic != BUNDLE_MAGIC:
+            raise ValueError(f'{path} is not a nerve bundle')
+        header_start = struct.calcsize(HEADER_FORMAT)
+        if version != BUNDLE_VERSION:
+            log.warning(f'{path} is a version {version} bundle, version {BUNDLE_VERSION} is needed, '
+                         'recompile it with nerve-compile.py')
+            self.__header = {'sources': {}, 'sections': {}}
+        else:
+            self.__header = json.loads(bytes(self.__buffer[header_start:header_start+header_length]))
+        self.__data_start = aligned(header_start + header_length)
+        self.__arrays = {}
+
+    @property
+    def path(self):
+        return self.__path
+
+    def source_hash(self, source):
+        return self.__header['sources'].get(source)
+
+    def array(self, name):
+        if (array := self.__arrays.get(name)) is None:
+            section = self.__header['sections'][name]
+            dtype = np.dtype(section['dtype'])
+            count = int(np.prod(section['shape']))
+            array = self.__arrays[name] = np.frombuffer(self.__buffer, dtype=dtype, count=count,
+                                                        offset=self.__data_start + section['offset']
+                                                       ).reshape(section['shape'])
+        return array
+
+    def string(self, index):
+        if index == NO_STRING:
+            return None
+        offsets = self.array('string_offsets')
+        return self.array('strings')[offsets[index]:offsets[index+1]-1].tobytes().decode()
+
+    def string_list(self, name, row):
+        offsets = self.array(f'{name}_offsets')
+        return [self.string(index) for index in self.array(name)[offsets[row]:offsets[row+1]].tolist()]
+
+    def find(self, name, key):
+        """
+        The row of ``key`` in the ``name`` section of string indices, or ``None``.
+        """
+        table = self.array(f'{name}_hash')
+        keys = self.array(name)
+        slot = key_hash(key) & (len(table) - 1)
+        while (row := int(table[slot])) != EMPTY_SLOT:
+            if self.string(keys[row]) == key:
+                return row
+            slot = (slot + 1) & (len(table) - 1)
+        return None
+
+    def __string_lists(self, name):
+        offsets = self.array(f'{name}_offsets').tolist()
+        strings = bytes(self.array('strings')).decode().split(STRING_SEPARATOR)
+        values = [strings[index] for index in self.array(name).tolist()]
+        return [values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+    def nerve_pathways(self):
+        """
+        The nerve table of a ``NervePathways``.
+        """
+        nerves = {}
+        terms = {key: self.__string_lists(f'pathway_{key}') for key in ['origins', 'destinations', 'landmarks', 'laterals']}
+        for n, (id, name, in_3d_map, bilateral) in enumerate(zip(self.array('pathway_id').tolist(),
+                                                                 self.array('pathway_name').tolist(),
+                                                                 self.array('pathway_in_3d_map').tolist(),
+                                                                 self.array('pathway_bilateral').tolist())):
+            id = (self.string(id), )
+            nerve = nerves[id] = {
+                'id': id,
+                'name': self.string(name),
+                'in_3d_map': bool(in_3d_map),
+            }
+            if bilateral != NO_STRING:
+                nerve['bilaterals'] = (self.string(bilateral), )
+            for key in ['origins', 'destinations', 'landmarks']:
+                nerve[key] = terms[key][n]
+            if len(laterals := terms['laterals'][n]):
+                nerve['laterals'] = [(lateral, ) for lateral in laterals]
+        return nerves
+
+    def nerves(self):
+        """
+        The nerve table, id map and coordinates array of a ``Nerves``.
+        """
+        nerves = {}
+        ordinals = self.array('point_ordinal').tolist()
+        groups = self.array('point_group').tolist()
+        rows = self.array('point_row').tolist()
+        offsets = self.array('maninbox_point_offsets').tolist()
+        nerve_ids = [self.string(id) for id in self.array('maninbox_id').tolist()]
+        for n, (nerve_id, label) in enumerate(zip(nerve_ids, self.array('maninbox_label').tolist())):
+            nerves[nerve_id] = {
+                'id': nerve_id,
+                'label': self.string(label),
+                'points': {
+                    ordinals[p]: {
+                        'group': self.string(groups[p]),
+                        'index': rows[p]
+                    } for p in range(offsets[n], offsets[n+1])
+                }
+            }
+        id_map = {self.string(key): nerve_ids[n]
+                    for key, n in zip(self.array('id_map_key').tolist(), self.array('id_map_nerve').tolist())}
+        return (nerves, id_map, self.array('coordinates'))
+
+#===============================================================================
+
+# read-only views of a bundle's tables, which look up and decode rows as they are
+# needed rather than holding them in Python objects, so that processes sharing the
+# bundle don't each have a copy of the tables
+
+class FrozenTable(Mapping, ABC):
+    def __init__(self, bundle:NerveBundle, name):
+        self._bundle = bundle
+        self.__name = name
+
+    def _key(self, row):
+        return self._bundle.string(self._bundle.array(self.__name)[row])
+
+    def _row(self, key):
+        return self._bundle.find(self.__name, key) if isinstance(key, str) else None
+
+    @abstractmethod
+    def _value(self, row):
+        pass
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __getitem__(self, key):
+        if (row := self._row(key)) is None:
+            raise KeyError(key)
+        return self._value(row)
+
+    def __iter__(self):
+        return (self._key(row) for row in range(len(self)))
+
+    def __len__(self):
+        return len(self._bundle.array(self.__name))
+
+class FrozenNervePathways(FrozenTable):
+    """
+    A ``NervePathways`` nerve table, keyed by ``(id, )``.
+    """
+    def __init__(self, bundle:NerveBundle):
+        super().__init__(bundle, 'pathway_id')
+
+    def _key(self, row):
+        return (super()._key(row), )
+
+    def _row(self, key):
+        return super()._row(key[0]) if isinstance(key, tuple) and len(key) == 1 else None
+
+    def _value(self, row):
+        bundle = self._bundle
+        id = self._key(row)
+        nerve = {
+            'id': id,
+            'name': bundle.string(bundle.array('pathway_name')[row]),
+            'in_3d_map': bool(bundle.array('pathway_in_3d_map')[row]),
+        }
+        if (bilateral := bundle.array('pathway_bilateral')[row]) != NO_STRING:
+            nerve['bilaterals'] = (bundle.string(bilateral), )
+        for key in ['origins', 'destinations', 'landmarks']:
+            nerve[key] = bundle.string_list(f'pathway_{key}', row)
+        if len(laterals := bundle.string_list('pathway_laterals', row)):
+            nerve['laterals'] = [(lateral, ) for lateral in laterals]
+        return nerve
+
+class FrozenLaterals(FrozenNervePathways):
+    """
+    The left and right leaf nerves of the nerves that have them, keyed by ``(id, )``.
+    """
+    def _row(self, key):
+        if (row := super()._row(key)) is not None and self.__has_laterals(row):
+            return row
+
+    def __has_laterals(self, row):
+        return any(self._bundle.array(f'pathway_{side}_offsets')[row]
+                    < self._bundle.array(f'pathway_{side}_offsets')[row+1] for side in ['left', 'right'])
+
+    def _value(self, row):
+        return MappingProxyType({side: tuple(self._bundle.string_list(f'pathway_{side}', row))
+                                    for side in ['right', 'left']})
+
+    def __iter__(self):
+        return (self._key(row) for row in range(super().__len__()) if self.__has_laterals(row))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+class FrozenManinbox(FrozenTable):
+    """
+    A ``Nerves`` nerve table, keyed by nerve ID.
+    """
+    def __init__(self, bundle:NerveBundle):
+        super().__init__(bundle, 'maninbox_id')
+
+    def _value(self, row):
+        bundle = self._bundle
+        offsets = bundle.array('maninbox_point_offsets')
+        ordinals = bundle.array('point_ordinal')
+        groups = bundle.array('point_group')
+        rows = bundle.array('point_row')
+        return {
+            'id': self._key(row),
+            'label': bundle.string(bundle.array('maninbox_label')[row]),
+            'points': {
+                int(ordinals[p]): {
+                    'group': bundle.string(groups[p]),
+                    'index': int(rows[p])
+                } for p in range(offsets[row], offsets[row+1])
+            }
+        }
+
+class FrozenIdMap(FrozenTable):
+    """
+    A ``Nerves`` ID map, from lookup key to nerve ID.
+    """
+    def __init__(self, bundle:NerveBundle):
+        super().__init__(bundle, 'id_map_key')
+
+    def _value(self, row):
+        bundle = self._bundle
+        return bundle.string(bundle.array('maninbox_id')[bundle.array('id_map_nerve')[row]])
+
+#===============================================================================
@@ -0,0 +1,115 @@
+#===============================================================================
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+#===============================================================================
+
+class PersistentCache:
+    """
+    A key/value cache stored in a SQLite table. Entries older than ``ttl``
+    seconds are treated as missing and, when ``max_entries`` is set, the
+    least recently used entries are evicted to keep the table within size.
+    Reads don't write to the table, the times entries were read are kept in
+    memory and written in one batch when entries are added or the cache is closed.
+
+    The cache can be used from a thread other than the one that opened it, with
+    access serialised by a lock.
+    """
+    def __init__(self, path, table='cache', ttl=None, max_entries=None):
+        self.__path = path
+        self.__table = table
+        self.__ttl = ttl
+        self.__max_entries = max_entries
+        self.__accessed = {}            # key --> time last read, not yet written
+        self.__hits = 0
+        self.__misses = 0
+        if (directory := os.path.dirname(path)) != '':
+            os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.RLock()
+        self.__db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.__db.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB, created REAL, accessed REAL)')
+        self.__db.execute(f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed)')
+        self.__db.commit()
+
+    def __len__(self):
+        with self.__lock:
+            return self.__db.execute(f'SELECT COUNT(*) FROM {self.__table}').fetchone()[0]
+
+    @property
+    def path(self):
+        return self.__path
+
+    @property
+    def stats(self):
+        return {
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'entries': len(self),
+        }
+
+    def get(self, key, default=None):
+        with self.__lock:
+            row = self.__db.execute(f'SELECT value, created FROM {self.__table} WHERE key=?', (key,)).fetchone()
+            now = time.time()
+            if row is None:
+                self.__misses += 1
+                return default
+            if self.__ttl is not None and now - row[1] > self.__ttl:
+                self.delete(key)
+                self.__misses += 1
+                return default
+            self.__accessed[key] = now
+            self.__hits += 1
+            return pickle.loads(row[0])
+
+    def __write_accessed(self):
+        # in the caller's transaction
+        if len(self.__accessed):
+            self.__db.executemany(f'UPDATE {self.__table} SET accessed=? WHERE key=?',
+                                  [(accessed, key) for key, accessed in self.__accessed.items()])
+            self.__accessed = {}
+
+    def put(self, key, value):
+        self.put_many([(key, value)])
+
+    def put_many(self, items):
+        with self.__lock:
+            now = time.time()
+            # read times are written first so that eviction sees them
+            self.__write_accessed()
+            self.__db.executemany(f'INSERT OR REPLACE INTO {self.__table} (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                                  [(key, pickle.dumps(value), now, now) for key, value in items])
+            if self.__max_entries is not None:
+                self.__db.execute(f'DELETE FROM {self.__table} WHERE key IN '
+                                  f'(SELECT key FROM {self.__table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                                  (self.__max_entries,))
+            self.__db.commit()
+
+    def delete(self, key):
+        with self.__lock:
+            self.__accessed.pop(key, None)
+            self.__db.execute(f'DELETE FROM {self.__table} WHERE key=?', (key,))
+            self.__db.commit()
+
+    def delete_prefix(self, prefix):
+        with self.__lock:
+            self.__db.execute(f'DELETE FROM {self.__table} WHERE substr(key, 1, ?)=?', (len(prefix), prefix))
+            self.__db.commit()
+
+    def clear(self):
+        with self.__lock:
+            self.__accessed = {}
+            self.__db.execute(f'DELETE FROM {self.__table}')
+            self.__db.commit()
+
+    def close(self):
+        with self.__lock:
+            self.__write_accessed()
+            self.__db.commit()
+            self.__db.close()
+
+#===============================================================================
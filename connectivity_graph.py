@@ -7,118 +7,12 @@
 #
 #===============================================================================
 
-import ipycytoscape
 import networkx as nx
-import os
 
 #===============================================================================
 
-from mapknowledge import KnowledgeStore
-
-#===============================================================================
-
-LABEL_WIDTH = 16
-SCICRUNCH_API_KEY = os.environ.get('SCICRUNCH_API_KEY', '-')
-
-def wrap_text(text, max_width=LABEL_WIDTH):
-    words = text.strip().split()
-    s = 0
-    while True:
-        l = 0
-        e = s
-        while e < len(words) and l < max_width:
-            l += len(words[e])
-            e += 1
-        if l < max_width:
-            yield ' '.join(words[s:e])
-            return
-        else:
-            if e > (s + 1):
-                e -= 1
-            yield ' '.join(words[s:e])
-            s = e
-
-NPO = 'npo'
-
-#===============================================================================
-
-class ConnectivityKnowledge(KnowledgeStore):
-    def __init__(self, store_directory=None, clean_connectivity=False, 
-                 sckan_version=None, use_npo=True, sckan_provenance=True):
-        super().__init__(store_directory=store_directory,
-                         clean_connectivity=clean_connectivity,
-                         sckan_version=sckan_version,
-                         sckan_provenance=sckan_provenance,
-                         scicrunch_key=SCICRUNCH_API_KEY)
-
-    def formatted_label(self, term):
-        if term is not None:
-            label = self.entity_knowledge(term).get('label', term)
-            return '\n'.join(wrap_text(f'{term}: {label}' if label is not None else term))
-        return ''
-
-    @staticmethod
-    def matched_term(node, layer_region_terms):
-        layer, regions = node
-        for region in regions:
-            if (layer, region) in layer_region_terms:
-                return True
-        return False
-
-    def node_id(self, node):
-        names = [self.formatted_label(node[0])]
-        for term in node[1]:
-            names.append(self.formatted_label(term))
-        return '\n'.join(names)
-
-    def connectivity(self, neuron_population_id):
-        knowledge = self.entity_knowledge(neuron_population_id)
-        return self.connectivity_from_knowledge(knowledge)
-
-    def connectivity_from_knowledge(self, knowledge):
-        axon_nodes = knowledge.get('axons', [])
-        dendrite_nodes = knowledge.get('dendrites', [])
-        def set_node_attributes(G, node):
-            G.nodes[node]['label'] = self.node_id(node)
-            G.nodes[node]['axon'] = node in axon_nodes
-            G.nodes[node]['dendrite'] = node in dendrite_nodes
-        G = nx.Graph()
-        for n, pair in enumerate(knowledge.get('connectivity', [])):
-            node_0 = (pair[0][0], tuple(pair[0][1]))
-            node_1 = (pair[1][0], tuple(pair[1][1]))
-            G.add_edge(node_0, node_1, directed=True, id=n)
-            set_node_attributes(G, node_0)
-            set_node_attributes(G, node_1)
-        return G
-
-#===============================================================================
-
-STYLING = [
-    {
-        'selector': 'node',
-        'style': {
-            'label': 'data(label)',
-            'background-color': '#80F0F0',
-            'text-valign': 'center',
-            'text-wrap': 'wrap',
-            'text-max-width': '80px',
-            'font-size': '10px'
-        }
-    },
-    {'selector': 'node[axon]',
-     'style': {'background-color': 'green',},},
-    {'selector': 'node[dendrite]',
-     'style': {'background-color': 'red',},},
-    {'selector': 'node[both-a-d]',
-     'style': {'background-color': 'gray',},},
-    {
-        'selector': 'edge',
-        'style': {
-            'width': 2,
-            'line-color': '#9dbaea',
-        }
-    }
-]
+from graph_render import DEFAULT_MAX_NODES, STYLING, render_elements
+from knowledge import ConnectivityKnowledge, LABEL_WIDTH, NPO, wrap_text
 
 #===============================================================================
 
@@ -128,7 +22,28 @@ def display_connectivity_for_entity(store, entity):
             knowledge:=store.entity_knowledge(entity)))
     return (knowledge, graph)
 
-def display_connectivity_graph(graph):
+def display_connectivity_graph(graph, single_widget=False, max_nodes=DEFAULT_MAX_NODES):
+    """
+    Display each connected component of ``graph`` in its own widget or, with
+    ``single_widget``, all components in one widget, laid out beforehand and
+    downsampled to ``max_nodes``.
+    """
+    # widgets are only imported when they are displayed
+    import ipycytoscape
+    from IPython.display import display
+
+    if single_widget:
+        elements, dropped = render_elements(graph, max_nodes)
+        if dropped:
+            print(f'{dropped} of {len(graph)} nodes not shown')
+        g = ipycytoscape.CytoscapeWidget()
+        g.layout.height = '600px'
+        g.graph.add_graph_from_json(elements, directed=True)
+        g.set_layout(name='preset')
+        g.set_style(STYLING)
+        display(g)
+        return
+
     connected_nodes = list(nx.connected_components(graph))
     for nodes in connected_nodes:
         G = graph.subgraph(nodes)
@@ -0,0 +1,139 @@
+#===============================================================================
+
+from collections import defaultdict
+import json
+
+#===============================================================================
+
+# human neuron populations (NCBITaxon:9606/human) (NCBITaxon:40674/mammal)
+HUMAN_TAXONS = ['NCBITaxon:9606', 'NCBITaxon:40674']
+
+# given that most of the nerves in the 3D whole body map have laterality, a path
+# is covered when there is at least one edge in both its left and right laterals
+MIN_COVERED_EDGES = 4
+
+def is_human_path(knowledge):
+    return (len(taxons:=knowledge.get('taxons', [])) == 0
+         or any(taxon in taxons for taxon in HUMAN_TAXONS))
+
+def node_key(node):
+    return (node[0], tuple(node[1]))
+
+def edge_key(edge):
+    u, v = node_key(edge[0]), node_key(edge[1])
+    return (u, v) if u <= v else (v, u)
+
+#===============================================================================
+
+class CoverageAggregator:
+    """
+    Accumulates SCKAN and 3D whole body map coverage as paths and their reroute
+    results are added. Nodes and undirected edges are kept in sets so each path
+    is added in time proportional to its size.
+
+    ``is_nerve``, if given, selects which rerouted nodes are counted as nerves in
+    the per-nerve breakdown.
+    """
+    def __init__(self, is_nerve=None):
+        self.__is_nerve = is_nerve if is_nerve is not None else (lambda term: True)
+        self.__paths = {}
+        self.__nodes = set()
+        self.__edges = set()
+        self.__human_paths = set()
+        self.__human_nodes = set()
+        self.__human_edges = set()
+        self.__covered_paths = set()
+        self.__covered_nodes = set()
+        self.__covered_edges = set()
+        self.__nerve_paths = defaultdict(set)
+        self.__failed_paths = {}
+
+    def add_path(self, path, knowledge):
+        nodes = set(node_key(n) for edge in knowledge.get('connectivity', []) for n in edge)
+        edges = set(edge_key(edge) for edge in knowledge.get('connectivity', []))
+        self.__nodes.update(nodes)
+        self.__edges.update(edges)
+        human = is_human_path(knowledge)
+        if human:
+            self.__human_paths.add(path)
+            self.__human_nodes.update(nodes)
+            self.__human_edges.update(edges)
+        self.__paths[path] = {
+            'human': human,
+            'nodes': len(nodes),
+            'edges': len(edges),
+        }
+        return human
+
+    def add_reroute(self, path, reroute_knowledge):
+        covered_nodes = set(node_key(n) for n in reroute_knowledge['covered_nodes'])
+        covered_edges = set(edge_key(edge) for edge in reroute_knowledge['covered_edges'])
+        self.__covered_nodes.update(covered_nodes)
+        self.__covered_edges.update(covered_edges)
+        if (covered := len(reroute_knowledge['connectivity']) >= MIN_COVERED_EDGES):
+            self.__covered_paths.add(path)
+        nerves = sorted(set(node[0] for edge in reroute_knowledge['connectivity'] for node in edge
+                                if self.__is_nerve(node[0])))
+        for nerve in nerves:
+            self.__nerve_paths[nerve].add(path)
+        self.__paths.setdefault(path, {}).update({
+            'covered': covered,
+            'rerouted_edges': len(reroute_knowledge['connectivity']),
+            'covered_nodes': len(covered_nodes),
+            'covered_edges': len(covered_edges),
+            'nerves': nerves,
+        })
+
+    def add_failure(self, path, error):
+        self.__failed_paths[path] = error
+        self.__paths.setdefault(path, {})['error'] = error
+
+    @property
+    def covered_paths(self):
+        return self.__covered_paths
+
+    @property
+    def covered_nodes(self):
+        return self.__covered_nodes
+
+    @property
+    def covered_edges(self):
+        return self.__covered_edges
+
+    @property
+    def failed_paths(self):
+        return self.__failed_paths
+
+    @property
+    def counts(self):
+        return {
+            'paths': len(self.__paths),
+            'edges': len(self.__edges),
+            'nodes': len(self.__nodes),
+            'human_paths': len(self.__human_paths),
+            'human_edges': len(self.__human_edges),
+            'human_nodes': len(self.__human_nodes),
+            'covered_paths': len(self.__covered_paths),
+            'covered_edges': len(self.__covered_edges),
+            'covered_nodes': len(self.__covered_nodes),
+            'failed_paths': len(self.__failed_paths),
+        }
+
+    def report(self):
+        return {
+            'counts': self.counts,
+            'paths': self.__paths,
+            'nerves': {
+                nerve: {
+                    'paths': sorted(paths),
+                    'covered_paths': sorted(paths & self.__covered_paths),
+                } for nerve, paths in sorted(self.__nerve_paths.items())
+            },
+            'failed_paths': self.__failed_paths,
+        }
+
+    def save_report(self, filename, **metadata):
+        with open(filename, 'w') as fp:
+            json.dump(metadata | self.report(), fp, indent=4)
+
+#===============================================================================
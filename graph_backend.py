@@ -0,0 +1,144 @@
+#===============================================================================
+
+import networkx as nx
+
+#===============================================================================
+
+# graphs used by the reroute kernel support the subset of the ``networkx.Graph``
+# interface used there, along with ``replace_node`` and ``to_networkx``. Nodes,
+# neighbours and edges are listed in the same order as ``networkx.Graph`` lists
+# them so reroute results don't depend on the backend.
+
+# networkx is the default as it's the faster on paths of SCKAN's size, where
+# rerouting is dominated by per-node Python work rather than graph algorithms
+DEFAULT_GRAPH_BACKEND = 'networkx'
+
+#===============================================================================
+
+class NetworkxGraph(nx.Graph):
+    """
+    The reference backend, a ``networkx.Graph``.
+    """
+    def replace_node(self, old_node, new_node):
+        if old_node in self and new_node not in self:
+            self.add_node(new_node, **self.nodes[old_node])
+            for neighbor in self.neighbors(old_node):
+                self.add_edge(new_node, neighbor)
+            self.remove_node(old_node)
+
+    def to_networkx(self):
+        return nx.Graph(self)
+
+#===============================================================================
+
+class IgraphGraph:
+    """
+    An undirected graph held by igraph, with nodes mapped to integer vertex IDs.
+
+    Vertices are never deleted, a removed node's edges are deleted and its vertex
+    is left isolated, so vertex IDs are stable and in node insertion order. The
+    neighbours of each vertex are also kept in the order their edges were added,
+    as ``networkx`` keeps them, so neighbour and edge queries don't go to igraph.
+    """
+    def __init__(self, edges=None):
+        # igraph is imported when first used, so that scripts using networkx don't load it
+        import igraph as ig
+        self.__graph = ig.Graph()
+        self.__vertices = {}            # node --> vertex ID, for nodes in the graph
+        self.__nodes = []               # vertex ID --> node
+        self.__adjacency = []           # vertex ID --> {neighbour vertex ID: None}, in edge order
+        if edges is not None:
+            self.add_edges_from(edges)
+
+    def __contains__(self, node):
+        try:
+            return node in self.__vertices
+        except TypeError:
+            return False
+
+    def __len__(self):
+        return len(self.__vertices)
+
+    def __vertex(self, node):
+        if (vertex := self.__vertices.get(node)) is None:
+            vertex = self.__vertices[node] = len(self.__nodes)
+            self.__nodes.append(node)
+            self.__adjacency.append({})
+        return vertex
+
+    def add_node(self, node):
+        self.__vertex(node)
+
+    def add_edge(self, u, v):
+        self.add_edges_from([(u, v)])
+
+    def add_edges_from(self, edges):
+        new_edges = []
+        for u, v in edges:
+            u, v = self.__vertex(u), self.__vertex(v)
+            if v not in self.__adjacency[u]:
+                self.__adjacency[u][v] = None
+                self.__adjacency[v][u] = None
+                new_edges.append((u, v))
+        if len(new_edges):
+            if (missing := len(self.__nodes) - self.__graph.vcount()) > 0:
+                self.__graph.add_vertices(missing)
+            self.__graph.add_edges(new_edges)
+
+    def has_edge(self, u, v):
+        return (u in self.__vertices and v in self.__vertices
+            and self.__vertices[v] in self.__adjacency[self.__vertices[u]])
+
+    def nodes(self):
+        return list(self.__vertices)
+
+    def neighbors(self, node):
+        if (vertex := self.__vertices.get(node)) is None:
+            raise nx.NetworkXError(f'The node {node} is not in the graph.')
+        return [self.__nodes[neighbor] for neighbor in self.__adjacency[vertex]]
+
+    def edges(self):
+        # as ``networkx``, each edge is listed once, from the first of its nodes
+        # in node order
+        seen = set()
+        edges = []
+        for node, vertex in self.__vertices.items():
+            edges.extend((node, self.__nodes[neighbor]) for neighbor in self.__adjacency[vertex] if neighbor not in seen)
+            seen.add(vertex)
+        return edges
+
+    def remove_node(self, node):
+        if (vertex := self.__vertices.pop(node, None)) is None:
+            raise nx.NetworkXError(f'The node {node} is not in the graph.')
+        for neighbor in list(self.__adjacency[vertex]):
+            del self.__adjacency[neighbor][vertex]
+        self.__adjacency[vertex] = {}
+        if vertex < self.__graph.vcount():
+            self.__graph.delete_edges(self.__graph.incident(vertex))
+
+    def replace_node(self, old_node, new_node):
+        if old_node in self and new_node not in self:
+            neighbors = self.neighbors(old_node)
+            self.add_node(new_node)
+            self.add_edges_from((new_node, neighbor) for neighbor in neighbors)
+            self.remove_node(old_node)
+
+    def to_networkx(self):
+        G = nx.Graph()
+        G.add_nodes_from(self.nodes())
+        G.add_edges_from(self.edges())
+        return G
+
+#===============================================================================
+
+GRAPH_BACKENDS = {
+    'networkx': NetworkxGraph,
+    'igraph': IgraphGraph,
+}
+
+def graph_class(backend):
+    if backend not in GRAPH_BACKENDS:
+        raise ValueError(f'Unknown graph backend `{backend}`, use one of {", ".join(GRAPH_BACKENDS)}')
+    return GRAPH_BACKENDS[backend]
+
+#===============================================================================
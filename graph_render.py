@@ -0,0 +1,199 @@
+#===============================================================================
+
+from collections import deque
+import html
+import json
+import math
+
+import igraph as ig
+import networkx as nx
+
+#===============================================================================
+
+# graphs with more nodes than this are downsampled before they are drawn
+DEFAULT_MAX_NODES = 500
+
+# the distance, in pixels, of a unit length in a layout, and the gap between components
+NODE_SPACING = 80
+COMPONENT_GAP = 60
+
+CYTOSCAPE_JS = 'https://cdnjs.cloudflare.com/ajax/libs/cytoscape/3.30.2/cytoscape.min.js'
+
+STYLING = [
+    {
+        'selector': 'node',
+        'style': {
+            'label': 'data(label)',
+            'background-color': '#80F0F0',
+            'text-valign': 'center',
+            'text-wrap': 'wrap',
+            'text-max-width': '80px',
+            'font-size': '10px'
+        }
+    },
+    {'selector': 'node[axon]',
+     'style': {'background-color': 'green',},},
+    {'selector': 'node[dendrite]',
+     'style': {'background-color': 'red',},},
+    {'selector': 'node[both-a-d]',
+     'style': {'background-color': 'gray',},},
+    {
+        'selector': 'edge',
+        'style': {
+            'width': 2,
+            'line-color': '#9dbaea',
+        }
+    }
+]
+
+#===============================================================================
+
+def downsample(graph, max_nodes=DEFAULT_MAX_NODES):
+    """
+    The subgraph of at most ``max_nodes`` nodes to draw. Connected components are
+    kept whole, those with axon or dendrite nodes and then the largest first, and
+    a component that doesn't fit is cut down to the neighbourhood of its axon and
+    dendrite nodes, or of its most connected node, so that kept nodes stay connected.
+    """
+    if len(graph) <= max_nodes:
+        return graph
+    order = {node: n for n, node in enumerate(graph.nodes)}
+    def is_end(node):
+        return bool(graph.nodes[node].get('axon') or graph.nodes[node].get('dendrite'))
+    components = sorted((sorted(nodes, key=order.get) for nodes in nx.connected_components(graph)),
+                        key=lambda nodes: (not any(is_end(node) for node in nodes), -len(nodes), order[nodes[0]]))
+    kept = set()
+    for nodes in components:
+        if (budget := max_nodes - len(kept)) <= 0:
+            break
+        if len(nodes) <= budget:
+            kept.update(nodes)
+            continue
+        # breadth first from the component's axon and dendrite nodes
+        seeds = [node for node in nodes if is_end(node)][:budget]
+        if len(seeds) == 0:
+            seeds = [max(nodes, key=lambda node: (graph.degree(node), -order[node]))]
+        neighbourhood = dict.fromkeys(seeds)
+        queue = deque(seeds)
+        while queue and len(neighbourhood) < budget:
+            for neighbour in sorted(graph.neighbors(queue.popleft()), key=order.get):
+                if neighbour not in neighbourhood:
+                    neighbourhood[neighbour] = None
+                    queue.append(neighbour)
+                    if len(neighbourhood) == budget:
+                        break
+        kept.update(neighbourhood)
+    return graph.subgraph(node for node in graph.nodes if node in kept)
+
+def layout_positions(graph):
+    """
+    Positions for the nodes of ``graph``, with each connected component laid out
+    by igraph's Kamada-Kawai layout and the components packed in rows, largest first.
+    """
+    index = {node: n for n, node in enumerate(graph.nodes)}
+    components = sorted((sorted(nodes, key=index.get) for nodes in nx.connected_components(graph)),
+                        key=lambda nodes: (-len(nodes), index[nodes[0]]))
+    layouts = []
+    for nodes in components:
+        vertices = {node: n for n, node in enumerate(nodes)}
+        g = ig.Graph(n=len(nodes), edges=[(vertices[u], vertices[v]) for u, v in graph.subgraph(nodes).edges if u != v])
+        coords = [(x*NODE_SPACING, y*NODE_SPACING) for x, y in g.layout_kamada_kawai().coords]
+        left, top = min(x for x, _ in coords), min(y for _, y in coords)
+        width, height = max(x for x, _ in coords) - left, max(y for _, y in coords) - top
+        layouts.append((nodes, [(x - left, y - top) for x, y in coords], width, height))
+
+    # pack components into rows about as wide as the whole drawing is high
+    row_width = max([math.sqrt(sum((w + COMPONENT_GAP)*(h + COMPONENT_GAP) for _, _, w, h in layouts))]
+                  + [w for _, _, w, _ in layouts])
+    positions = {}
+    x = y = row_height = 0
+    for nodes, coords, width, height in layouts:
+        if x > 0 and x + width > row_width:
+            x, y, row_height = 0, y + row_height + COMPONENT_GAP, 0
+        for node, (node_x, node_y) in zip(nodes, coords):
+            positions[node] = (x + node_x, y + node_y)
+        x += width + COMPONENT_GAP
+        row_height = max(row_height, height)
+    return positions
+
+def cytoscape_elements(graph, positions):
+    """
+    Cytoscape nodes and edges for ``graph``, at ``positions``. Nodes that are both
+    axons and dendrites are marked ``both-a-d``, and false markers are left out.
+    """
+    ids = {node: str(n) for n, node in enumerate(graph.nodes)}
+    nodes = []
+    for node, data in graph.nodes(data=True):
+        node_data = {key: value for key, value in data.items() if key not in ['axon', 'dendrite']}
+        node_data['id'] = ids[node]
+        node_data.setdefault('label', str(node))
+        if data.get('axon') and data.get('dendrite'):
+            node_data['both-a-d'] = True
+        elif data.get('axon'):
+            node_data['axon'] = True
+        elif data.get('dendrite'):
+            node_data['dendrite'] = True
+        x, y = positions[node]
+        nodes.append({'data': node_data, 'position': {'x': x, 'y': y}})
+    edges = [{
+        'data': {'source': ids[u], 'target': ids[v]},
+        'classes': 'directed',
+    } for u, v in graph.edges]
+    return {'nodes': nodes, 'edges': edges}
+
+def render_elements(graph, max_nodes=DEFAULT_MAX_NODES):
+    """
+    The Cytoscape elements of ``graph``, downsampled to ``max_nodes`` and laid
+    out, along with the number of nodes left out.
+    """
+    drawn = downsample(graph, max_nodes)
+    return (cytoscape_elements(drawn, layout_positions(drawn)), len(graph) - len(drawn))
+
+#===============================================================================
+
+HTML_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="{script}"></script>
+<style>
+  body {{ margin: 0; font-family: sans-serif; }}
+  #graph {{ position: absolute; top: 2em; bottom: 0; left: 0; right: 0; }}
+  #title {{ height: 2em; line-height: 2em; padding: 0 1em; }}
+</style>
+</head>
+<body>
+<div id="title">{heading}</div>
+<div id="graph"></div>
+<script>
+cytoscape({{
+  container: document.getElementById('graph'),
+  elements: {elements},
+  style: {style},
+  layout: {{name: 'preset'}},
+  textureOnViewport: true,
+  hideEdgesOnViewport: true
+}});
+</script>
+</body>
+</html>
+"""
+
+def script_json(data):
+    # JSON that can't end the ``<script>`` element it's in
+    return json.dumps(data).replace('<', '\\u003c')
+
+def write_html(graph, path, title='Connectivity', max_nodes=DEFAULT_MAX_NODES):
+    """
+    Write a standalone HTML page that draws ``graph`` with Cytoscape.js, which
+    is loaded from a CDN. Returns the number of nodes left out.
+    """
+    elements, dropped = render_elements(graph, max_nodes)
+    heading = f'{title} ({dropped} of {len(graph)} nodes not shown)' if dropped else title
+    with open(path, 'w') as fp:
+        fp.write(HTML_TEMPLATE.format(title=html.escape(title), heading=html.escape(heading), script=CYTOSCAPE_JS,
+                                      elements=script_json(elements), style=script_json(STYLING)))
+    return dropped
+
+#===============================================================================
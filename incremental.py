@@ -0,0 +1,197 @@
+#===============================================================================
+
+from collections import defaultdict
+import os
+import pickle
+
+import logging as log
+
+from coverage import CoverageAggregator
+from reroute_cache import knowledge_hash
+
+#===============================================================================
+
+# change when the state file layout changes, older state files are then ignored
+INCREMENTAL_STATE_VERSION = 2
+
+#===============================================================================
+
+def pathway_snapshot(nerve_pathways):
+    """
+    What ``NervePathways`` lookups return for each nerve ID, including the
+    left and right nerves found through its laterals.
+    """
+    return {
+        id[0]: (nerve, dict(nerve_pathways.get_laterals(id)))
+            for id, nerve in nerve_pathways.nerves.items()
+    }
+
+def annotation_snapshot(nerves):
+    """
+    The label and point groups of each man-in-box nerve, along with the
+    nerve that each lookup key maps to.
+    """
+    return {
+        'nerves': {
+            nerve_id: (nerve['label'], {ordinal: point['group'] for ordinal, point in nerve['points'].items()})
+                for nerve_id, nerve in nerves.nerves.items()
+        },
+        'id_map': dict(nerves.id_map),
+    }
+
+def changed_keys(old, new):
+    return set(key for key in old.keys() | new.keys() if old.get(key) != new.get(key))
+
+def changed_annotation_keys(old, new):
+    # lookup keys whose nerve, or the nerve's points, changed
+    changed_nerves = changed_keys(old['nerves'], new['nerves'])
+    return set(key for key in old['id_map'].keys() | new['id_map'].keys()
+                if old['id_map'].get(key) != new['id_map'].get(key)
+                or old['id_map'].get(key) in changed_nerves
+                or new['id_map'].get(key) in changed_nerves)
+
+def path_dependencies(nerve_pathways, knowledge, reroute_knowledge):
+    """
+    The nerve pathway IDs consulted when rerouting a path, and the man-in-box
+    lookup keys used when finding 3D map points for the rerouted path.
+    """
+    terms = set()
+    for edge in knowledge.get('connectivity', []):
+        for node in edge:
+            for term in [node[0]] + list(node[1]):
+                terms.add(term)
+                laterals = nerve_pathways.get_laterals(term)
+                terms.update(laterals['left'])
+                terms.update(laterals['right'])
+    annotation_keys = set()
+    if reroute_knowledge is not None:
+        for edge in reroute_knowledge['connectivity']:
+            for node in edge:
+                terms.add(node[0])
+                annotation_keys.add(node[0].lower())
+                if (name := nerve_pathways.get_nerve(node[0]).get('name')) is not None:
+                    annotation_keys.add(name.lower())
+    return (terms, annotation_keys)
+
+#===============================================================================
+
+class IncrementalCoverage:
+    """
+    Coverage testing that keeps each path's reroute result and what the result
+    depended on in a state file, so that a later run only reroutes paths that
+    are new, whose SCKAN knowledge changed, which failed before or were rerouted
+    while SciCrunch lookups went unanswered, or which consulted a nerve pathway
+    row that changed.
+
+    Reroute results don't depend on the annotation file; paths whose 3D map
+    points depend on changed annotation groups are listed in ``map_changed_paths``.
+    """
+    def __init__(self, state_path):
+        self.__state_path = state_path
+        self.__state = {
+            'version': INCREMENTAL_STATE_VERSION,
+            'pathways': None,
+            'annotations': None,
+            'paths': {},
+        }
+        if os.path.exists(state_path):
+            with open(state_path, 'rb') as fp:
+                state = pickle.load(fp)
+            if state.get('version') == INCREMENTAL_STATE_VERSION:
+                self.__state = state
+            else:
+                log.warning(f'{state_path} is from another version, rerouting all paths')
+        self.__rerouted_paths = []
+        self.__map_changed_paths = []
+
+    @property
+    def rerouted_paths(self):
+        return self.__rerouted_paths
+
+    @property
+    def map_changed_paths(self):
+        return self.__map_changed_paths
+
+    def __dependency_index(self, dependency):
+        index = defaultdict(set)
+        for path, path_state in self.__state['paths'].items():
+            for key in path_state[dependency]:
+                index[key].add(path)
+        return index
+
+    def affected_paths(self, rerouting, knowledge):
+        """
+        The paths, of those in ``knowledge``, a dictionary of path knowledge,
+        that need rerouting.
+        """
+        pathways = pathway_snapshot(rerouting.nerve_pathways)
+        if self.__state['pathways'] is None:
+            return list(knowledge)
+        term_index = self.__dependency_index('terms')
+        affected = set(path for term in changed_keys(self.__state['pathways'], pathways)
+                            for path in term_index.get(term, []))
+        for path, path_knowledge in knowledge.items():
+            if ((path_state := self.__state['paths'].get(path)) is None
+             or path_state['error'] is not None
+             or not path_state['complete']
+             or path_state['knowledge_hash'] != knowledge_hash(path_knowledge)):
+                affected.add(path)
+        return [path for path in knowledge if path in affected]
+
+    def update(self, rerouting, store, paths, workers=1, store_factory=None, is_nerve=None):
+        """
+        Reroute the affected ``paths``, keeping results for the others, and return a
+        ``CoverageAggregator`` with the coverage of all SCKAN paths.
+        """
+        coverage = CoverageAggregator(is_nerve=is_nerve)
+        knowledge = {}
+        for path in paths:
+            path_knowledge = store.entity_knowledge(path)
+            if coverage.add_path(path, path_knowledge):
+                knowledge[path] = path_knowledge
+
+        annotations = annotation_snapshot(rerouting.nerve_maninbox)
+        if self.__state['annotations'] is not None:
+            annotation_index = self.__dependency_index('annotation_keys')
+            map_changed = set(path for key in changed_annotation_keys(self.__state['annotations'], annotations)
+                                for path in annotation_index.get(key, []))
+        else:
+            map_changed = set()
+
+        self.__rerouted_paths = self.affected_paths(rerouting, knowledge)
+        path_states = {path: path_state for path, path_state in self.__state['paths'].items()
+                                if path in knowledge}
+        for path, reroute_knowledge, error in rerouting.reroute_many(self.__rerouted_paths, workers=workers,
+                                                                     store_factory=store_factory):
+            terms, annotation_keys = path_dependencies(rerouting.nerve_pathways, knowledge[path], reroute_knowledge)
+            path_states[path] = {
+                'knowledge_hash': knowledge_hash(knowledge[path]),
+                'reroute_knowledge': reroute_knowledge,
+                'error': error,
+                'complete': path not in rerouting.incomplete_paths,
+                'terms': terms,
+                'annotation_keys': annotation_keys,
+            }
+        self.__map_changed_paths = [path for path in knowledge if path in map_changed]
+
+        for path in knowledge:
+            if (error := path_states[path]['error']) is not None:
+                coverage.add_failure(path, error)
+            else:
+                coverage.add_reroute(path, path_states[path]['reroute_knowledge'])
+
+        self.__state = {
+            'version': INCREMENTAL_STATE_VERSION,
+            'pathways': pathway_snapshot(rerouting.nerve_pathways),
+            'annotations': annotations,
+            'paths': path_states,
+        }
+        return coverage
+
+    def save(self):
+        if (directory := os.path.dirname(self.__state_path)) != '':
+            os.makedirs(directory, exist_ok=True)
+        with open(self.__state_path, 'wb') as fp:
+            pickle.dump(self.__state, fp)
+
+#===============================================================================
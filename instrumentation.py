@@ -0,0 +1,168 @@
+#===============================================================================
+
+from collections import Counter
+import contextlib
+import json
+import threading
+import time
+
+import numpy as np
+
+#===============================================================================
+
+DEFAULT_SLOWEST_PATHS = 10
+
+#===============================================================================
+
+class Profiler:
+    """
+    Records the wall time of named stages, counters, and the latency of network
+    calls, along with the time, stage times and counts of each rerouted path.
+
+    Stages may nest, a stage's time includes that of the stages within it.
+    Latencies may be recorded from any thread.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__reset()
+
+    def __reset(self):
+        self.__stages = {}                  # name --> [calls, seconds]
+        self.__counters = Counter()
+        self.__latencies = {}               # name --> [seconds]
+        self.__paths = {}
+        self.__path = None
+
+    @property
+    def enabled(self):
+        return True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            stage = self.__stages.setdefault(name, [0, 0.0])
+            stage[0] += 1
+            stage[1] += seconds
+            if self.__path is not None:
+                self.__path['stages'][name] = self.__path['stages'].get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.__counters[name] += n
+        if self.__path is not None:
+            self.__path['counts'][name] += n
+
+    def latency(self, name, seconds):
+        with self.__lock:
+            self.__latencies.setdefault(name, []).append(seconds)
+
+    @contextlib.contextmanager
+    def path(self, entity):
+        self.__path = {
+            'stages': {},
+            'counts': Counter(),
+        }
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.__path['seconds'] = time.perf_counter() - start
+            self.__paths[entity] = self.__path
+            self.__path = None
+
+    def take(self):
+        """
+        The data recorded since the last ``take``, for merging into another profiler.
+        """
+        with self.__lock:
+            data = {
+                'stages': self.__stages,
+                'counters': self.__counters,
+                'latencies': self.__latencies,
+                'paths': self.__paths,
+            }
+            self.__reset()
+        return data
+
+    def merge(self, data):
+        for name, (calls, seconds) in data['stages'].items():
+            stage = self.__stages.setdefault(name, [0, 0.0])
+            stage[0] += calls
+            stage[1] += seconds
+        self.__counters.update(data['counters'])
+        with self.__lock:
+            for name, latencies in data['latencies'].items():
+                self.__latencies.setdefault(name, []).extend(latencies)
+        self.__paths.update(data['paths'])
+
+    def summary(self, slowest=DEFAULT_SLOWEST_PATHS):
+        with self.__lock:
+            latencies = {name: np.array(seconds) for name, seconds in self.__latencies.items()}
+        slowest_paths = sorted(self.__paths.items(), key=lambda item: item[1]['seconds'], reverse=True)[:slowest]
+        return {
+            'stages': {
+                name: {
+                    'calls': calls,
+                    'seconds': seconds,
+                    'mean_seconds': seconds/calls,
+                } for name, (calls, seconds) in sorted(self.__stages.items())
+            },
+            'counters': dict(sorted(self.__counters.items())),
+            'network': {
+                name: {
+                    'calls': len(seconds),
+                    'seconds': float(seconds.sum()),
+                    'mean_seconds': float(seconds.mean()),
+                    'p95_seconds': float(np.percentile(seconds, 95)),
+                    'max_seconds': float(seconds.max()),
+                } for name, seconds in sorted(latencies.items()) if len(seconds)
+            },
+            'paths': {
+                'count': len(self.__paths),
+                'seconds': sum(path['seconds'] for path in self.__paths.values()),
+            },
+            'slowest_paths': [{
+                'path': entity,
+                'seconds': path['seconds'],
+                'stages': path['stages'],
+                'counts': dict(path['counts']),
+            } for entity, path in slowest_paths],
+        }
+
+    def save(self, filename, slowest=DEFAULT_SLOWEST_PATHS):
+        with open(filename, 'w') as fp:
+            json.dump(self.summary(slowest), fp, indent=4)
+
+#===============================================================================
+
+class NullProfiler:
+    """
+    A profiler that records nothing, used when profiling is off.
+    """
+    __null_context = contextlib.nullcontext()
+
+    @property
+    def enabled(self):
+        return False
+
+    def stage(self, name):
+        return self.__null_context
+
+    def count(self, name, n=1):
+        pass
+
+    def latency(self, name, seconds):
+        pass
+
+    def path(self, entity):
+        return self.__null_context
+
+    def take(self):
+        return None
+
+NO_PROFILER = NullProfiler()
+
+#===============================================================================
@@ -0,0 +1,61 @@
+#===============================================================================
+
+# reroute graph nodes are ``(term, regions)`` tuples, which are slow to hash and
+# compare. A ``NodeTable`` maps each distinct node to a small integer, in the
+# order nodes are first seen, along with its terms, as a list and frozenset,
+# and a bitmask of the terms it has.
+
+#===============================================================================
+
+class NodeTable:
+    def __init__(self):
+        self.__node_ids = {}
+        self.__nodes = []
+        self.__terms = []
+        self.__term_sets = []
+        self.__masks = []
+        self.__term_bits = {}
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def term_mask(self, terms):
+        mask = 0
+        for term in terms:
+            if (bit := self.__term_bits.get(term)) is None:
+                bit = self.__term_bits[term] = 1 << len(self.__term_bits)
+            mask |= bit
+        return mask
+
+    def intern(self, node):
+        if (id := self.__node_ids.get(node)) is None:
+            id = self.__node_ids[node] = len(self.__nodes)
+            self.__nodes.append(node)
+            terms = [node[0]] + list(node[1])
+            self.__terms.append(terms)
+            self.__term_sets.append(frozenset(terms))
+            self.__masks.append(self.term_mask(terms))
+        return id
+
+    def find(self, node):
+        try:
+            return self.__node_ids.get(node)
+        except TypeError:
+            return None
+
+    def node(self, id):
+        return self.__nodes[id]
+
+    def nodes(self, ids):
+        return [self.__nodes[id] for id in ids]
+
+    def terms(self, id):
+        return self.__terms[id]
+
+    def term_set(self, id):
+        return self.__term_sets[id]
+
+    def mask(self, id):
+        return self.__masks[id]
+
+#===============================================================================
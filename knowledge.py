@@ -0,0 +1,112 @@
+#===============================================================================
+#
+# This code is adopted from:
+#  - Code: https://github.com/AnatomicMaps/map-tools/blob/main/connectivity-graph/connectivity_graph.py
+#  - SHA: 384ef274a77b3995ae4c16d7ad726bd97b57a7fa
+# updates are made to suit this repo's needs
+#
+# The knowledge part of ``connectivity_graph``, without any widget dependencies.
+#
+#===============================================================================
+
+from collections import OrderedDict
+
+import networkx as nx
+
+#===============================================================================
+
+from mapknowledge import KnowledgeStore
+
+from labels import LABEL_WIDTH, format_label, wrap_text
+from scicrunch import SCICRUNCH_API_KEY
+
+#===============================================================================
+
+NPO = 'npo'
+
+DEFAULT_LABEL_CACHE_SIZE = 10000
+
+#===============================================================================
+
+class ConnectivityKnowledge(KnowledgeStore):
+    """
+    Formatted labels of terms are kept in a cache of the ``label_cache_size``
+    most recently used, shared by all graphs made from knowledge. Terms that
+    aren't cached are looked up one at a time, as ``KnowledgeStore`` has no
+    lookup of many entities at once, but each only once per graph.
+    """
+    def __init__(self, store_directory=None, clean_connectivity=False, 
+                 sckan_version=None, use_npo=True, sckan_provenance=True,
+                 label_cache_size=DEFAULT_LABEL_CACHE_SIZE):
+        super().__init__(store_directory=store_directory,
+                         clean_connectivity=clean_connectivity,
+                         sckan_version=sckan_version,
+                         sckan_provenance=sckan_provenance,
+                         scicrunch_key=SCICRUNCH_API_KEY)
+        self.__labels = OrderedDict()           # term --> formatted label, least recently used first
+        self.__label_cache_size = label_cache_size
+
+    def __format_label(self, term):
+        return format_label(term, self.entity_knowledge(term))
+
+    def formatted_labels(self, terms):
+        """
+        The formatted labels of ``terms``, with each term not in the label cache
+        looked up once.
+        """
+        labels = {None: ''}
+        for term in terms:
+            if term in labels:
+                continue
+            if (label := self.__labels.get(term)) is not None:
+                self.__labels.move_to_end(term)
+            else:
+                label = self.__labels[term] = self.__format_label(term)
+                if len(self.__labels) > self.__label_cache_size:
+                    self.__labels.popitem(last=False)
+            labels[term] = label
+        return labels
+
+    def formatted_label(self, term):
+        return self.formatted_labels([term])[term]
+
+    @staticmethod
+    def matched_term(node, layer_region_terms):
+        layer, regions = node
+        for region in regions:
+            if (layer, region) in layer_region_terms:
+                return True
+        return False
+
+    def node_id(self, node, labels=None):
+        if labels is None:
+            labels = self.formatted_labels([node[0]] + list(node[1]))
+        return '\n'.join(labels[term] for term in [node[0]] + list(node[1]))
+
+    def connectivity(self, neuron_population_id):
+        knowledge = self.entity_knowledge(neuron_population_id)
+        return self.connectivity_from_knowledge(knowledge)
+
+    def connectivity_from_knowledge(self, knowledge, labels=True):
+        """
+        The connectivity graph of ``knowledge``. Nodes are labelled with the labels
+        of their terms unless ``labels`` is false, as when only the graph's structure
+        is needed.
+        """
+        axon_nodes = knowledge.get('axons', [])
+        dendrite_nodes = knowledge.get('dendrites', [])
+        G = nx.Graph()
+        for n, pair in enumerate(knowledge.get('connectivity', [])):
+            node_0 = (pair[0][0], tuple(pair[0][1]))
+            node_1 = (pair[1][0], tuple(pair[1][1]))
+            G.add_edge(node_0, node_1, directed=True, id=n)
+        if labels:
+            # the labels of all terms in the graph, in one batch
+            term_labels = self.formatted_labels(term for node in G.nodes for term in [node[0]] + list(node[1]))
+        for node in G.nodes:
+            if labels:
+                G.nodes[node]['label'] = self.node_id(node, term_labels)
+            G.nodes[node]['axon'] = node in axon_nodes
+            G.nodes[node]['dendrite'] = node in dendrite_nodes
+        return G
+
@@ -0,0 +1,35 @@
+#===============================================================================
+#
+# Node labels of connectivity graphs, shared by ``ConnectivityKnowledge`` and
+# ``LocalKnowledgeStore`` and without any dependencies.
+#
+#===============================================================================
+
+LABEL_WIDTH = 16
+
+def wrap_text(text, max_width=LABEL_WIDTH):
+    words = text.strip().split()
+    s = 0
+    while True:
+        l = 0
+        e = s
+        while e < len(words) and l < max_width:
+            l += len(words[e])
+            e += 1
+        if l < max_width:
+            yield ' '.join(words[s:e])
+            return
+        else:
+            if e > (s + 1):
+                e -= 1
+            yield ' '.join(words[s:e])
+            s = e
+
+def format_label(term, knowledge):
+    """
+    The label of ``term``, given its knowledge, wrapped for display.
+    """
+    label = knowledge.get('label', term)
+    return '\n'.join(wrap_text(f'{term}: {label}' if label is not None else term))
+
+#===============================================================================
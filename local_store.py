@@ -0,0 +1,104 @@
+#===============================================================================
+
+import json
+
+import networkx as nx
+
+from coverage import node_key
+from labels import format_label
+
+#===============================================================================
+
+def read_knowledge(path):
+    """
+    Read a JSON file of entity knowledge, keyed by entity, with the nodes of paths
+    made hashable as they are by ``KnowledgeStore``.
+    """
+    with open(path) as fp:
+        knowledge = json.load(fp)
+    for entity_knowledge in knowledge.values():
+        if 'connectivity' in entity_knowledge:
+            entity_knowledge['connectivity'] = [(node_key(edge[0]), node_key(edge[1]))
+                                                    for edge in entity_knowledge['connectivity']]
+            for nodes in ['axons', 'dendrites']:
+                entity_knowledge[nodes] = [node_key(node) for node in entity_knowledge.get(nodes, [])]
+    return knowledge
+
+def snapshot_knowledge(store, labels=True):
+    """
+    The knowledge of all of ``store``'s connectivity paths read in one pass, along
+    with the labels of the terms of their nodes when ``labels`` is set.
+    """
+    knowledge = {}
+    terms = set()
+    for path in store.connectivity_paths():
+        knowledge[path] = path_knowledge = store.entity_knowledge(path)
+        for edge in path_knowledge.get('connectivity', []):
+            for node in edge:
+                terms.add(node[0])
+                terms.update(node[1])
+    if labels:
+        for term in sorted(terms - knowledge.keys()):
+            if (label := store.entity_knowledge(term).get('label')) is not None:
+                knowledge[term] = {'label': label}
+    return knowledge
+
+def write_knowledge(path, knowledge):
+    """
+    Write entity knowledge as JSON, to be read back with ``read_knowledge``.
+    """
+    with open(path, 'w') as fp:
+        json.dump(knowledge, fp)
+
+#===============================================================================
+
+class LocalKnowledgeStore:
+    """
+    An in-memory stand-in for the parts of ``mapknowledge.KnowledgeStore`` and
+    ``ConnectivityKnowledge`` used by ``Rerouting`` and coverage testing, holding
+    the knowledge of a given set of entities.
+
+    A store made from ``snapshot_knowledge(store)`` answers the lookups of a run
+    without going back to the knowledge store and, once saved, can be read back
+    with ``read_knowledge`` for runs that have no knowledge store at all.
+    """
+    def __init__(self, knowledge=None):
+        self.__knowledge = {}
+        for entity, entity_knowledge in (knowledge or {}).items():
+            self.add_knowledge(entity, entity_knowledge)
+
+    def add_knowledge(self, entity, knowledge):
+        self.__knowledge[entity] = knowledge | {'id': entity}
+
+    def save(self, path):
+        write_knowledge(path, self.__knowledge)
+
+    def entity_knowledge(self, entity):
+        return self.__knowledge.get(entity, {'id': entity})
+
+    def connectivity_paths(self):
+        return [entity for entity, knowledge in self.__knowledge.items() if 'connectivity' in knowledge]
+
+    def __node_label(self, node):
+        # as ``ConnectivityKnowledge`` labels nodes
+        return '\n'.join(format_label(term, self.entity_knowledge(term)) for term in [node[0]] + list(node[1]))
+
+    def connectivity_from_knowledge(self, knowledge, labels=True):
+        axon_nodes = knowledge.get('axons', [])
+        dendrite_nodes = knowledge.get('dendrites', [])
+        G = nx.Graph()
+        for n, pair in enumerate(knowledge.get('connectivity', [])):
+            node_0 = (pair[0][0], tuple(pair[0][1]))
+            node_1 = (pair[1][0], tuple(pair[1][1]))
+            G.add_edge(node_0, node_1, directed=True, id=n)
+        for node in G.nodes:
+            if labels:
+                G.nodes[node]['label'] = self.__node_label(node)
+            G.nodes[node]['axon'] = node in axon_nodes
+            G.nodes[node]['dendrite'] = node in dendrite_nodes
+        return G
+
+    def close(self):
+        pass
+
+#===============================================================================
@@ -0,0 +1,699 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import importlib
+import io
+import itertools
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import tracemalloc
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+from annotations import iter_annotations
+from bundle import share_bundle
+from coverage import CoverageAggregator, edge_key, node_key
+from graph_backend import DEFAULT_GRAPH_BACKEND, GRAPH_BACKENDS, graph_class
+from local_store import LocalKnowledgeStore
+from routing import NervePathways, Nerves, Rerouting, PLACEHOLDER_IDS
+import scicrunch
+from scicrunch import SciCrunch, PART_OF_RELATIONSHIP
+
+#===============================================================================
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="nerve-benchmark")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    load_parser = subparsers.add_parser('load', help="Time loading the nerve pathway csv, against the former `iterrows` loader")
+    load_parser.add_argument("pathways", help="The full nerve pathway csv")
+    load_parser.add_argument("--repeat", help="Number of times to repeat each timing", type=int, default=5)
+
+    spatial_parser = subparsers.add_parser('spatial', help="Time spatial queries over the nerve point annotations")
+    spatial_parser.add_argument("points", help="The nerve point annotation file location")
+    spatial_parser.add_argument("--queries", help="Number of random query positions", type=int, default=1000)
+    spatial_parser.add_argument("--radius", help="Radius for `nerves_within` queries", type=float, default=50.0)
+
+    memory_parser = subparsers.add_parser('memory', help="Compare peak memory of parsing the nerve point annotations with `json.load` and streaming")
+    memory_parser.add_argument("points", help="The nerve point annotation file location")
+    memory_parser.add_argument("--method", help=argparse.SUPPRESS, choices=list(PARSING_METHODS))
+
+    parse_parser = subparsers.add_parser('parse', help="Time `nerve-utils` parsing of the nerve point annotations, scaled up to many times their size")
+    parse_parser.add_argument("points", help="The nerve point annotation file location")
+    parse_parser.add_argument("--scales", help="Multiples of the annotation file to time parsing of",
+                              type=int, nargs='+', default=[1, 2, 5, 10])
+
+    workers_parser = subparsers.add_parser('workers', help="Compare the private memory of rerouting workers that load the "
+                                                           "nerve files with that of workers sharing them")
+    workers_parser.add_argument("points", help="The nerve point annotation file location")
+    workers_parser.add_argument("pathways", help="The full nerve pathway csv")
+    workers_parser.add_argument("--workers", help="Numbers of workers to measure", type=int, nargs='+',
+                                default=[1, 2, 4, 8])
+
+    startup_parser = subparsers.add_parser('startup', help="Time command line scripts started with `--help`, and "
+                                                           "what they import, with `python -X importtime`")
+    startup_parser.add_argument("--scripts", help="Scripts to start", nargs='+', default=['nerve-testing.py'])
+    startup_parser.add_argument("--directory", help="The directory the scripts are in, such as a checkout of an "
+                                                    "earlier version, defaults to this script's", default=None)
+    startup_parser.add_argument("--runs", help="Number of times each script is started", type=int, default=10)
+
+    backends_parser = subparsers.add_parser('backends', help="Check that every graph backend reroutes synthetic paths "
+                                                             "as networkx does, offline, and time them")
+    backends_parser.add_argument("points", help="The nerve point annotation file location")
+    backends_parser.add_argument("pathways", help="The full nerve pathway csv")
+    backends_parser.add_argument("--paths", help="Number of synthetic SCKAN paths", type=int, default=500)
+
+    kernel_parser = subparsers.add_parser('kernel', help="Check that rerouting gives the results of the former kernel "
+                                                         "on `(term, regions)` nodes, offline, and time them")
+    kernel_parser.add_argument("points", help="The nerve point annotation file location")
+    kernel_parser.add_argument("pathways", help="The full nerve pathway csv")
+    kernel_parser.add_argument("--paths", help="Number of synthetic SCKAN paths of each size", type=int, default=500)
+
+    scicrunch_parser = subparsers.add_parser('scicrunch', help="Check concurrent, rate limited and cached SciCrunch "
+                                                               "lookups against a local stub server")
+    scicrunch_parser.add_argument("--terms", help="Number of terms SciCrunch knows", type=int, default=40)
+    scicrunch_parser.add_argument("--unknown", help="Number of terms SciCrunch doesn't know", type=int, default=8)
+    scicrunch_parser.add_argument("--delay", help="Seconds the stub server takes to answer", type=float, default=0.05)
+    scicrunch_parser.add_argument("--concurrency", help="Number of lookups made at once", type=int, default=8)
+    scicrunch_parser.add_argument("--rate-limit", help="Requests per second for the rate limited lookups",
+                                  type=float, default=50.0)
+
+    suite_parser = subparsers.add_parser('suite', help="Time loading, rerouting, 3D edges and coverage, offline, "
+                                                       "with the nerve files scaled up")
+    suite_parser.add_argument("points", help="The nerve point annotation file location")
+    suite_parser.add_argument("pathways", help="The full nerve pathway csv")
+    suite_parser.add_argument("--scales", help="Multiples of the nerve files to time with",
+                              type=int, nargs='+', default=[1, 10, 100])
+    suite_parser.add_argument("--paths", help="Number of synthetic SCKAN paths", type=int, default=200)
+    suite_parser.add_argument("--output", help="Write the timings, as JSON, to this file", default=None)
+
+    return parser.parse_args()
+
+#===============================================================================
+
+def _iterrows_nerves(path):
+    """
+    The ``iterrows`` loader that ``NervePathways`` used, as a reference for
+    timing and output.
+    """
+    nerve_df = pd.read_csv(path)
+    nerves = {}
+    def get_bilateral(id):
+        return nerves.get(id, {}).get('bilaterals', [])
+    for _, row in nerve_df.iterrows():
+        # get id
+        if pd.isna(preferred_id := row['Preferred ID for nerve name']):
+            if pd.isna(row['Name']):
+                continue
+            id = (row['Name'].replace('* ', '').splitlines()[0],)
+        elif 'REQUESTED' in preferred_id or 'NEEDS CLARIFICATION' in preferred_id:
+            if preferred_id in ['REQUESTED', 'NEEDS CLARIFICATION']:
+                id = (row['Name'].replace('* ', '').splitlines()[0],)
+            else:
+                if len(k_names:= row['Name'].replace('* ', '').splitlines()) != len(k_ids:=preferred_id.replace('* ', '').splitlines()):
+                    id = (k_names[0],)
+                else:
+                    id = tuple(k_id if k_id not in ['REQUESTED', 'NEEDS CLARIFICATION'] else k_name for k_id, k_name in zip(k_ids, k_names))
+        else:
+            id = tuple(preferred_id.replace('* ', '').splitlines())
+        id = (id[0], )
+        if id not in nerves:
+            nerves[id] = {
+                'id': id,
+                'name': row['Name'].replace('* ', '').splitlines()[0],
+                'in_3d_map': pd.notna(row['In man-in-box?'])
+            }
+            if pd.notna(row['Superclass']):
+                bilateral_id = (tuple(row['Superclass'].splitlines())[0], )
+                nerves[id]['bilaterals'] = bilateral_id
+                nerves[bilateral_id]['laterals'] = nerves[bilateral_id].get('laterals', []) + [id]
+            for key, column in [('origins', 'Preferred ID for Origin/Central connection/Parent nerve'),
+                                ('destinations', 'Preferred ID (of destination)'),
+                                ('landmarks', 'Preferred ID for landmarks')]:
+                if pd.notna(row[column]):
+                    nerves[id][key] = str(row[column]).replace('* ', '').splitlines()
+                elif len(bilateral_id:=get_bilateral(id)) > 0:
+                    nerves[id][key] = nerves.get(bilateral_id, {}).get(key, [])
+                else:
+                    nerves[id][key] = []
+    return nerves
+
+def _benchmark_load(args):
+    iterrows_time = min(timeit.repeat(lambda: _iterrows_nerves(args.pathways), number=1, repeat=args.repeat))
+    loader_time = min(timeit.repeat(lambda: NervePathways(args.pathways), number=1, repeat=args.repeat))
+    return {
+        'pathways': args.pathways,
+        'nerves': len(nerves := NervePathways(args.pathways).nerves),
+        'identical': nerves == _iterrows_nerves(args.pathways),
+        'iterrows_seconds': iterrows_time,
+        'loader_seconds': loader_time,
+        'speedup': iterrows_time/loader_time,
+    }
+
+#===============================================================================
+
+def _benchmark_spatial(args):
+    nerves = Nerves(args.points)
+    rng = np.random.default_rng(0)
+    lower, upper = np.nanmin(nerves.coordinates, axis=0), np.nanmax(nerves.coordinates, axis=0)
+    positions = rng.uniform(lower, upper, size=(args.queries, 3))
+    node_ids = list(nerves.nerves)
+    def mean_time(query, arguments):
+        return timeit.timeit(lambda: [query(*a) for a in arguments], number=1)/len(arguments)
+    return {
+        'points': args.points,
+        'annotated_points': len(nerves.coordinates),
+        'nearest_point_seconds': mean_time(nerves.nearest_point, [(p,) for p in positions]),
+        'nerves_within_seconds': mean_time(nerves.nerves_within, [(p, args.radius) for p in positions]),
+        'bounding_box_seconds': mean_time(nerves.get_bounding_box, [(n,) for n in node_ids]),
+    }
+
+#===============================================================================
+
+def _json_load_annotations(path):
+    with open(path) as fp:
+        return sum(1 for _ in json.load(fp))
+
+def _stream_annotations(path):
+    return sum(1 for _ in iter_annotations(path))
+
+PARSING_METHODS = {
+    'none': lambda path: 0,
+    'json.load': _json_load_annotations,
+    'stream': _stream_annotations,
+}
+
+def _benchmark_memory(args):
+    if args.method is not None:
+        # measure a single method, in a fresh process
+        tracemalloc.start()
+        records = PARSING_METHODS[args.method](args.points)
+        traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {
+            'records': records,
+            'traced_peak_bytes': traced_peak,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    results = {}
+    for method in PARSING_METHODS:
+        process = subprocess.run([sys.executable, __file__, 'memory', args.points, '--method', method],
+                                 capture_output=True, text=True, check=True)
+        results[method] = json.loads(process.stdout)
+    # RSS above that of a process which does no parsing
+    for method in PARSING_METHODS:
+        results[method]['parsing_rss_kb'] = results[method]['peak_rss_kb'] - results['none']['peak_rss_kb']
+    return {
+        'points': args.points,
+    } | results
+
+#===============================================================================
+
+def _scaled_annotations(records, scale):
+    # copies of the annotations, each with its own markers, groups and coordinates
+    rng = np.random.default_rng(scale)
+    scaled = []
+    for copy in range(scale):
+        for record in records:
+            record = json.loads(json.dumps(record))
+            if copy > 0:
+                name, bracket, tag = record['group'].partition('(')
+                record['group'] = f'{name.rstrip()} {copy}{" " if bracket else ""}{bracket}{tag}'
+                record['region'] = f'{record["region"]} {copy}'
+                if (coordinates := record.get('feature', {}).get('geometry', {}).get('coordinates')):
+                    coordinates[0] = (np.asarray(coordinates[0]) + rng.normal(size=3)).tolist()
+            scaled.append(record)
+    return scaled
+
+def _benchmark_parse(args):
+    nerve_utils = importlib.import_module('nerve-utils')
+    with open(args.points) as fp:
+        records = json.load(fp)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            path = os.path.join(directory, f'points_{scale}.json')
+            with open(path, 'w') as fp:
+                fp.write(json.dumps(_scaled_annotations(records, scale)))
+            # parsing prints progress and warnings
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = timeit.default_timer()
+                nerve_points = nerve_utils.parse_nerve_point_file(path, None)
+                seconds = timeit.default_timer() - start
+            results.append({
+                'scale': scale,
+                'annotations': scale*len(records),
+                'nodes': len(nerve_points['nodes']),
+                'edges': len(nerve_points['edges']),
+                'seconds': seconds,
+                'seconds_per_annotation': seconds/(scale*len(records)),
+            })
+    return {
+        'points': args.points,
+        'scales': results,
+    }
+
+#===============================================================================
+
+# nerve pathway columns with IDs, each line of which is made unique to a copy
+ID_COLUMNS = ['Preferred ID for nerve name', 'Superclass',
+              'Preferred ID for Origin/Central connection/Parent nerve',
+              'Preferred ID for landmarks', 'Preferred ID (of destination)']
+
+def _copied_term(term, copy):
+    # nerves without an ID are referred to by name, which copies suffix with a space
+    if term.strip() == '' or any(placeholder in term for placeholder in PLACEHOLDER_IDS):
+        return term
+    elif ':' in (term := term.rstrip()) and ' ' not in term.replace('* ', ''):
+        return f'{term}-{copy}'
+    return f'{term} {copy}'
+
+def _scaled_pathways(path, scale):
+    # copies of the nerve pathway rows, each copy with its own names and IDs
+    df = pd.read_csv(path, dtype=str)
+    copies = [df]
+    for copy in range(1, scale):
+        df_copy = df.copy()
+        df_copy['Name'] = df['Name'].map(lambda names: '\n'.join(f'{name.rstrip()} {copy}' for name in names.splitlines()),
+                                         na_action='ignore')
+        for column in ID_COLUMNS:
+            df_copy[column] = df[column].map(lambda terms: '\n'.join(_copied_term(term, copy) for term in terms.splitlines()),
+                                             na_action='ignore')
+        copies.append(df_copy)
+    return pd.concat(copies, ignore_index=True)
+
+def _synthetic_paths(nerve_pathways, count, seed=0, path_nodes=(2, 10)):
+    # paths of ``path_nodes[0]`` up to ``path_nodes[1]`` nodes, through nerves of the pathway
+    # table and the terms they refer to
+    rng = np.random.default_rng(seed)
+    terms = sorted(set(term for nerve in nerve_pathways.nerves.values()
+                            for term in [nerve['id'][0]] + nerve['origins'] + nerve['destinations'] + nerve['landmarks']))
+    paths = {}
+    for n in range(count):
+        nodes = list(dict.fromkeys((terms[rng.integers(len(terms))],
+                                    tuple(terms[t] for t in rng.integers(len(terms), size=rng.choice([0, 0, 1, 2]))))
+                                        for _ in range(rng.integers(*path_nodes))))
+        connectivity = [(nodes[int(rng.integers(i))], nodes[i]) for i in range(1, len(nodes))]
+        paths[f'ilxtr:synthetic-path-{n}'] = {
+            'label': f'synthetic path {n}',
+            'connectivity': connectivity,
+            'dendrites': nodes[:1],
+            'axons': nodes[-1:],
+            'taxons': ['NCBITaxon:9606'],
+        }
+    return paths
+
+def _stub_request_json(endpoint, session=None, **kwds):
+    # a SciCrunch response, with 0 to 2 partOf terms chosen by the term's hash
+    curie = endpoint.split('/curie/')[-1]
+    digest = hashlib.sha256(curie.encode()).digest()
+    return {
+        'data': {
+            'existing_ids': [{'curie': curie}],
+            'relationships': [{
+                'relationship_term_ilx': PART_OF_RELATIONSHIP,
+                'term2_curie': f'UBERON:{int.from_bytes(digest[4*n:4*n+4]) % 10000:07d}'
+            } for n in range(digest[0] % 3)]
+        }
+    }
+
+def _benchmark_scale(points, pathways, paths):
+    results = {}
+    start = timeit.default_timer()
+    nerve_pathways = NervePathways(pathways)
+    results['load_pathways_seconds'] = timeit.default_timer() - start
+    start = timeit.default_timer()
+    Nerves(points)
+    results['load_points_seconds'] = timeit.default_timer() - start
+
+    store = LocalKnowledgeStore(_synthetic_paths(nerve_pathways, paths))
+    rerouting = Rerouting(pathways, points, store, SciCrunch())
+    rerouted = []
+    start = timeit.default_timer()
+    for path in store.connectivity_paths():
+        rerouted.append(rerouting.reroute_for_3d_map(path))
+    results['reroute_seconds_per_path'] = (timeit.default_timer() - start)/paths
+
+    graphs = [store.connectivity_from_knowledge(knowledge, labels=False) for knowledge in rerouted]
+    start = timeit.default_timer()
+    results['3d_edges'] = sum(len(rerouting.get_3d_edges(G)) for G in graphs)
+    results['3d_edges_seconds_per_path'] = (timeit.default_timer() - start)/paths
+
+    # as ``nerve-testing.py`` with a warm SciCrunch cache
+    start = timeit.default_timer()
+    coverage = CoverageAggregator(is_nerve=rerouting.nerve_pathways.is_nerve_available)
+    human_paths = [path for path in store.connectivity_paths()
+                        if coverage.add_path(path, store.entity_knowledge(path))]
+    for path, reroute_knowledge, error in rerouting.reroute_many(human_paths):
+        if error is not None:
+            coverage.add_failure(path, error)
+        else:
+            coverage.add_reroute(path, reroute_knowledge)
+    results['coverage_seconds'] = timeit.default_timer() - start
+    results['coverage'] = coverage.counts
+    return results
+
+def _benchmark_suite(args):
+    scicrunch.request_json = _stub_request_json
+    with open(args.points) as fp:
+        records = json.load(fp)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scale in args.scales:
+            points = os.path.join(directory, f'points_{scale}.json')
+            with open(points, 'w') as fp:
+                fp.write(json.dumps(_scaled_annotations(records, scale)))
+            pathways = os.path.join(directory, f'pathways_{scale}.csv')
+            _scaled_pathways(args.pathways, scale).to_csv(pathways, index=False)
+            results.append({
+                'scale': scale,
+                'paths': args.paths,
+            } | _benchmark_scale(points, pathways, args.paths))
+    timings = {
+        'points': args.points,
+        'pathways': args.pathways,
+        'scales': results,
+    }
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(timings, fp, indent=4)
+    return timings
+
+#===============================================================================
+
+class _StubSciCrunchServer(ThreadingHTTPServer):
+    """
+    Answers SciCrunch curie searches, after ``delay`` seconds, as ``_stub_request_json``
+    does, with terms prefixed ``UNKNOWN:`` having no IDs. Counts requests and the
+    most that were made at once.
+    """
+    def __init__(self, delay):
+        super().__init__(('127.0.0.1', 0), _StubSciCrunchHandler)
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    @property
+    def endpoint(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+class _StubSciCrunchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            server.active += 1
+            server.max_active = max(server.max_active, server.active)
+        time.sleep(server.delay)
+        path = urlsplit(self.path).path
+        if path.split('/curie/')[-1].startswith('UNKNOWN:'):
+            response = {'data': {'existing_ids': []}}
+        else:
+            response = _stub_request_json(path)
+        body = json.dumps(response).encode()
+        with server.lock:
+            server.active -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def _timed_resolve(server, terms, cache_path, **kwds):
+    # seconds taken to resolve ``terms`` and the number of requests made
+    requests = server.requests
+    lookups = SciCrunch(cache_path=cache_path, endpoint=server.endpoint, **kwds)
+    start = timeit.default_timer()
+    lookups.resolve(terms)
+    seconds = timeit.default_timer() - start
+    unknown = [lookups.lookup(term) for term in terms if term.startswith('UNKNOWN:')]
+    lookups.close()
+    return (seconds, server.requests - requests, all(data == {} for data in unknown))
+
+def _benchmark_scicrunch(args):
+    terms = [f'ILX:{n:07d}' for n in range(args.terms)] + [f'UNKNOWN:{n}' for n in range(args.unknown)]
+    server = _StubSciCrunchServer(args.delay)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    with tempfile.TemporaryDirectory() as directory:
+        serial_seconds, _, _ = _timed_resolve(server, terms, os.path.join(directory, 'serial.db'), concurrency=1)
+        server.max_active = 0
+        cache_path = os.path.join(directory, 'scicrunch.db')
+        seconds, requests, unknown_empty = _timed_resolve(server, terms, cache_path, concurrency=args.concurrency)
+        max_active = server.max_active
+        cached_seconds, cached_requests, _ = _timed_resolve(server, terms, cache_path, concurrency=args.concurrency)
+        limited_seconds, _, _ = _timed_resolve(server, terms, os.path.join(directory, 'limited.db'),
+                                               concurrency=args.concurrency, rate_limit=args.rate_limit)
+    server.shutdown()
+    server.server_close()
+    # the first request isn't delayed by the rate limiter
+    min_limited_seconds = (len(terms) - 1)/args.rate_limit
+    return {
+        'terms': len(terms),
+        'unknown_terms': args.unknown,
+        'requests': requests,
+        'most_requests_at_once': max_active,
+        'cached_requests': cached_requests,
+        'checks': {
+            'concurrent': 1 < max_active <= args.concurrency,
+            'one_request_per_term': requests == len(terms),
+            'unknown_terms_cached': unknown_empty and cached_requests == 0,
+            'rate_limited': limited_seconds >= min_limited_seconds,
+        },
+        'serial_seconds': serial_seconds,
+        'concurrent_seconds': seconds,
+        'cached_seconds': cached_seconds,
+        'rate_limited_seconds': limited_seconds,
+        'min_rate_limited_seconds': min_limited_seconds,
+    }
+
+#===============================================================================
+
+def _comparable(reroute_knowledge):
+    # rerouted edges, axons and dendrites in order, covered nodes and edges as sets
+    return (reroute_knowledge['connectivity'], reroute_knowledge['dendrites'], reroute_knowledge['axons'],
+            set(node_key(node) for node in reroute_knowledge['covered_nodes']),
+            set(edge_key(edge) for edge in reroute_knowledge['covered_edges']))
+
+def _timed_reroutes(rerouting, paths):
+    # SciCrunch lookups are made on a first pass, so that only rerouting is timed
+    for path in paths:
+        rerouting.reroute_for_3d_map(path)
+    start = timeit.default_timer()
+    results = {path: rerouting.reroute_for_3d_map(path) for path in paths}
+    return (results, (timeit.default_timer() - start)/len(paths))
+
+# the smallest and one more than the largest number of nodes of the synthetic
+# paths the kernels are timed with
+KERNEL_PATH_NODES = [(2, 10), (10, 30), (30, 100)]
+
+def _tuple_reroute(rerouting, knowledge, backend=DEFAULT_GRAPH_BACKEND):
+    """
+    The rerouting kernel as it was before nodes were interned, on graphs of
+    ``(term, regions)`` tuples, as a reference for timing and output.
+    """
+    nerve_pathways = rerouting.nerve_pathways
+    entity_knowledge = dict(knowledge)
+    G = graph_class(backend)()
+    G.add_edges_from(entity_knowledge['connectivity'])
+    G_reconstructed = graph_class(backend)()
+    if len(lateral_map := rerouting.check_laterality(G)) > 0:
+        for u, v in G.edges():
+            rerouting.add_lateralised_edge(G_reconstructed, u, v, lateral_map)
+    retained_nodes = []
+    availabel_origs_dests = []
+    for lateral_nodes in lateral_map.values():
+        for nodes in lateral_nodes.values():
+            for n in nodes:
+                availabel_origs_dests += nerve_pathways.get_origins(n)
+                availabel_origs_dests += nerve_pathways.get_destinations(n)
+                availabel_origs_dests += nerve_pathways.get_landmarks(n)
+                retained_nodes += [(n, ())]
+    candidate_terms = set()
+    for node in G_reconstructed.nodes():
+        if node not in retained_nodes and (flat_node:=set([node[0]] + list(node[1]))).isdisjoint(availabel_origs_dests):
+            candidate_terms.update(flat_node)
+    nerve_pathways.prefetch_broader_concepts(candidate_terms)
+    for node in list(G_reconstructed.nodes()):
+        if len(flat_node:=set([node[0]] + list(node[1]))-set(availabel_origs_dests)) == len(set([node[0]] + list(node[1]))) and node not in retained_nodes:
+            super_container = set([spr for fn in flat_node for spr in nerve_pathways.get_broader_concepts(fn)])
+            if len(containers := list(super_container & set(availabel_origs_dests))) > 0:
+                rerouting.replace_node(G_reconstructed, node, (containers[0], ()))
+            else:
+                neighbors = list(G_reconstructed.neighbors(node))
+                G_reconstructed.add_edges_from([(neighbor1, neighbor2)
+                    for neighbor1, neighbor2 in itertools.combinations(neighbors, 2)
+                        if neighbor1 not in retained_nodes or neighbor2 not in retained_nodes])
+                G_reconstructed.remove_node(node)
+        elif len(selected_layer:=set([node[0]] + list(node[1])) & set(availabel_origs_dests)) < len(set([node[0]] + list(node[1]))) and len(selected_layer) > 0:
+            rerouting.replace_node(G_reconstructed, node, (list(selected_layer)[0], ()))
+    entity_knowledge['connectivity'] = list(G_reconstructed.edges())
+    entity_knowledge['dendrites'] = [d for d in entity_knowledge['dendrites'] if d in G_reconstructed]
+    entity_knowledge['axons'] = [a for a in entity_knowledge['axons'] if a in G_reconstructed]
+    covered_nodes = set(G.nodes()) & set(list(lateral_map.keys()) + list(G_reconstructed.nodes()))
+    entity_knowledge['covered_nodes'] = list(covered_nodes)
+    entity_knowledge['covered_edges'] = list(edge for edge in itertools.combinations(covered_nodes, 2) if G.has_edge(*edge))
+    return entity_knowledge
+
+def _benchmark_kernel(args):
+    scicrunch.request_json = _stub_request_json
+    nerve_pathways = NervePathways(args.pathways)
+    results = {}
+    differing = []
+    for path_nodes in KERNEL_PATH_NODES:
+        store = LocalKnowledgeStore(_synthetic_paths(nerve_pathways, args.paths, path_nodes=path_nodes))
+        paths = store.connectivity_paths()
+        for backend in GRAPH_BACKENDS:
+            rerouting = Rerouting(args.pathways, args.points, store, SciCrunch(), graph_backend=backend)
+            rerouted, seconds = _timed_reroutes(rerouting, paths)
+            start = timeit.default_timer()
+            reference = {path: _tuple_reroute(rerouting, store.entity_knowledge(path), backend) for path in paths}
+            reference_seconds = (timeit.default_timer() - start)/len(paths)
+            # results must be the same, in the same order
+            backend_differing = [path for path in paths if rerouted[path] != reference[path]]
+            differing += backend_differing
+            results.setdefault(f"{path_nodes[0]}-{path_nodes[1] - 1} nodes", {})[backend] = {
+                'identical': len(backend_differing) == 0,
+                'differing_paths': backend_differing,
+                'reference_seconds_per_path': reference_seconds,
+                'seconds_per_path': seconds,
+                'speedup': reference_seconds/seconds,
+            }
+    return {
+        'paths': args.paths,
+        'identical': len(differing) == 0,
+        'path_sizes': results,
+    }
+
+def _benchmark_backends(args):
+    scicrunch.request_json = _stub_request_json
+    store = LocalKnowledgeStore(_synthetic_paths(NervePathways(args.pathways), args.paths))
+    paths = store.connectivity_paths()
+    results = {}
+    timings = {}
+    for backend in GRAPH_BACKENDS:
+        rerouting = Rerouting(args.pathways, args.points, store, SciCrunch(), graph_backend=backend)
+        results[backend], timings[backend] = _timed_reroutes(rerouting, paths)
+    reference = results[DEFAULT_GRAPH_BACKEND]
+    differing = {backend: [path for path in paths if _comparable(backend_results[path]) != _comparable(reference[path])]
+                    for backend, backend_results in results.items() if backend != DEFAULT_GRAPH_BACKEND}
+    return {
+        'paths': len(paths),
+        'rerouted_paths': sum(len(reference[path]['connectivity']) > 0 for path in paths),
+        'identical': all(len(backend_paths) == 0 for backend_paths in differing.values()),
+        'differing_paths': differing,
+        'seconds_per_path': timings,
+    }
+
+#===============================================================================
+
+def _private_memory():
+    # resident memory not shared with other processes, Linux only
+    with open('/proc/self/smaps_rollup') as fp:
+        return sum(int(line.split()[1]) for line in fp if line.startswith(('Private_Clean:', 'Private_Dirty:')))
+
+def _worker_memory(points, pathways, shared_bundle):
+    # the private memory, in KB, used by a worker's Rerouting, after looking up every nerve
+    before = _private_memory()
+    rerouting = Rerouting(pathways, points, LocalKnowledgeStore(), SciCrunch(offline=True),
+                          shared_bundle=shared_bundle)
+    for id in rerouting.nerve_pathways.nerves:
+        rerouting.nerve_pathways.get_nerve(id)
+        rerouting.nerve_pathways.get_laterals(id)
+    for key in rerouting.nerve_maninbox.id_map:
+        rerouting.nerve_maninbox.get_nerve(key)
+    return _private_memory() - before
+
+def _benchmark_workers(args):
+    nerve_pathways = NervePathways(args.pathways, SciCrunch(offline=True))
+    nerves = Nerves(args.points)
+    shared_memory = share_bundle(nerve_pathways, nerves)
+    results = {
+        'shared_bundle_kb': shared_memory.size//1024,
+    }
+    try:
+        for workers in args.workers:
+            for mode, shared_bundle in [('files', None), ('shared', shared_memory.name)]:
+                # each worker process measures one Rerouting
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    memory = list(executor.map(_worker_memory, [args.points]*workers, [args.pathways]*workers,
+                                               [shared_bundle]*workers))
+                results.setdefault(mode, {})[workers] = {
+                    'total_private_kb': sum(memory),
+                    'mean_private_kb': sum(memory)/workers,
+                }
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+    return results
+
+#===============================================================================
+
+# modules that make up the notebook widget stack, and the SCKAN knowledge store
+WIDGET_MODULES = ['ipycytoscape', 'ipywidgets', 'IPython']
+KNOWLEDGE_MODULES = ['mapknowledge']
+
+def _benchmark_startup(args):
+    directory = args.directory if args.directory is not None else os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for script in args.scripts:
+        seconds = []
+        for _ in range(args.runs):
+            start = timeit.default_timer()
+            subprocess.run([sys.executable, script, '--help'], cwd=directory, capture_output=True, check=True)
+            seconds.append(timeit.default_timer() - start)
+        process = subprocess.run([sys.executable, '-X', 'importtime', script, '--help'], cwd=directory,
+                                 capture_output=True, text=True, check=True)
+        # ``import time: self [us] | cumulative | imported package``, nested imports indented
+        imports = {}
+        import_us = 0
+        for line in process.stderr.splitlines():
+            if line.startswith('import time:') and not line.endswith('imported package'):
+                _, cumulative, name = line[len('import time:'):].split('|')
+                imports[name.strip()] = int(cumulative)
+                if not name[1:].startswith(' '):
+                    import_us += int(cumulative)
+        results[script] = {
+            'median_seconds': statistics.median(seconds),
+            'min_seconds': min(seconds),
+            'import_seconds': import_us/1e6,
+            'imported_modules': len(imports),
+            'widget_modules': [name for name in WIDGET_MODULES if name in imports],
+            'knowledge_modules': [name for name in KNOWLEDGE_MODULES if name in imports],
+        }
+    return results
+
+#===============================================================================
+
+BENCHMARKS = {
+    'load': _benchmark_load,
+    'spatial': _benchmark_spatial,
+    'memory': _benchmark_memory,
+    'parse': _benchmark_parse,
+    'startup': _benchmark_startup,
+    'workers': _benchmark_workers,
+    'suite': _benchmark_suite,
+    'backends': _benchmark_backends,
+    'kernel': _benchmark_kernel,
+    'scicrunch': _benchmark_scicrunch,
+}
+
+if __name__ == "__main__":
+    args = _parse_args()
+    print(json.dumps(BENCHMARKS[args.benchmark](args), indent='  '))
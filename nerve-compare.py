@@ -0,0 +1,100 @@
+import argparse
+from functools import partial
+import logging
+import os
+
+from graph_backend import DEFAULT_GRAPH_BACKEND, GRAPH_BACKENDS
+from knowledge import ConnectivityKnowledge
+from reroute_cache import RerouteCache, DEFAULT_REROUTE_CACHE_SIZE
+from routing import Rerouting
+from scicrunch import SciCrunch, DEFAULT_CACHE_TTL, DEFAULT_CACHE_SIZE, DEFAULT_CONCURRENCY
+from version_compare import VersionComparison
+
+STORE_DIRECTORY = 'production'
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s [%(levelname)-9s] %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="nerve-compare")
+    parser.add_argument("old_version", help="The earlier version of SCKAN, e.g. sckan-2024-09-21")
+    parser.add_argument("new_version", help="The later version of SCKAN")
+    parser.add_argument("points", help="The nerve point annotation file location")
+    parser.add_argument("pathways", help="The full nerve pathway csv")
+    parser.add_argument("--output", help="The JSON coverage diff file to create", default='coverage_diff.json')
+    parser.add_argument("--bundle", help="A bundle compiled from the points and pathways by nerve-compile.py, "
+                                         "used when it is up to date", default=None)
+    parser.add_argument("--scicrunch-cache", help="The SciCrunch lookup cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'scicrunch_cache.db'))
+    parser.add_argument("--cache-ttl", help="Days before a cached SciCrunch lookup expires",
+                        type=float, default=DEFAULT_CACHE_TTL/(24*60*60))
+    parser.add_argument("--cache-size", help="Maximum number of cached SciCrunch lookups",
+                        type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--offline", help="Only use cached SciCrunch lookups", action='store_true')
+    parser.add_argument("--concurrency", help="Number of SciCrunch lookups made at once",
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", help="Maximum number of SciCrunch requests per second, shared "
+                                             "equally by the --jobs processes",
+                        type=float, default=None)
+    parser.add_argument("--result-cache", help="The reroute result cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'reroute_cache.db'))
+    parser.add_argument("--no-result-cache", help="Reroute all paths, without using or updating the result cache",
+                        action='store_true')
+    parser.add_argument("--jobs", help="Number of processes used to reroute paths",
+                        type=int, default=1)
+    parser.add_argument("--graph-backend", help="The graph library used to reroute paths",
+                        choices=list(GRAPH_BACKENDS), default=DEFAULT_GRAPH_BACKEND)
+
+    return parser.parse_args()
+
+def _compare(args):
+    old_store_factory = partial(ConnectivityKnowledge, store_directory=STORE_DIRECTORY,
+                                sckan_version=args.old_version, clean_connectivity=True)
+    new_store_factory = partial(ConnectivityKnowledge, store_directory=STORE_DIRECTORY,
+                                sckan_version=args.new_version, clean_connectivity=True)
+    old_store = old_store_factory()
+    new_store = new_store_factory()
+    scicrunch = SciCrunch(cache_path=args.scicrunch_cache, ttl=args.cache_ttl*24*60*60,
+                          cache_size=args.cache_size, offline=args.offline,
+                          concurrency=args.concurrency, rate_limit=args.rate_limit)
+    # results are cached by path knowledge, so both versions share the cache
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = RerouteCache(args.result_cache, max_entries=DEFAULT_REROUTE_CACHE_SIZE)
+    try:
+        old_rerouting = Rerouting(args.pathways, args.points, old_store, scicrunch, args.bundle,
+                                  args.graph_backend, result_cache)
+        new_rerouting = Rerouting(args.pathways, args.points, new_store, scicrunch, args.bundle,
+                                  args.graph_backend, result_cache)
+        comparison = VersionComparison(args.old_version, args.new_version)
+        diff = comparison.compare(old_rerouting, old_store, new_rerouting, new_store, workers=args.jobs,
+                                  old_store_factory=old_store_factory, new_store_factory=new_store_factory,
+                                  is_nerve=new_rerouting.nerve_pathways.is_nerve_available)
+
+        logger.info(f'Human paths added: {len(diff["paths"]["added"])}, removed: {len(diff["paths"]["removed"])}, '
+                    f'changed: {len(diff["paths"]["changed"])}, unchanged: {diff["paths"]["unchanged"]}')
+        logger.info(f'Number of paths rerouted for {args.new_version}: {len(comparison.rerouted_paths)}')
+        for name in ['covered_paths', 'covered_nodes', 'covered_edges']:
+            logger.info(f'{name.replace("_", " ").capitalize()} in 3D whole body map: '
+                        f'{diff["counts"]["old"][name]} --> {diff["counts"]["new"][name]} '
+                        f'(+{len(diff[name]["added"])}, -{len(diff[name]["removed"])})')
+        if len(diff['failed_paths']['added']) > 0:
+            logger.warning(f'Number of paths that now fail rerouting: {len(diff["failed_paths"]["added"])}')
+        comparison.save_diff(args.output, points=args.points, pathways=args.pathways)
+        logger.info(f'Coverage diff: {args.output}')
+
+    except Exception as e:
+        logger.error(e)
+
+    if result_cache is not None:
+        result_cache.close()
+    scicrunch.close()
+    new_store.close()
+    old_store.close()
+
+if __name__ == "__main__":
+    args = _parse_args()
+    _compare(args)
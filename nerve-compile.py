@@ -0,0 +1,29 @@
+import argparse
+import logging
+
+from bundle import write_bundle
+from routing import NervePathways, Nerves
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s [%(levelname)-9s] %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="nerve-compile")
+    parser.add_argument("points", help="The nerve point annotation file location")
+    parser.add_argument("pathways", help="The full nerve pathway csv")
+    parser.add_argument("--output", help="The bundle file to create", default='nerves.bundle')
+
+    return parser.parse_args()
+
+def _compile(args):
+    nerve_pathways = NervePathways(args.pathways)
+    nerves = Nerves(args.points)
+    write_bundle(args.output, nerve_pathways, nerves)
+    logger.info(f'Compiled {args.pathways} and {args.points} into {args.output}')
+
+if __name__ == "__main__":
+    args = _parse_args()
+    _compile(args)
@@ -0,0 +1,87 @@
+import argparse
+from functools import partial
+import logging
+import os
+
+from coverage import is_human_path
+from graph_backend import DEFAULT_GRAPH_BACKEND, GRAPH_BACKENDS
+from knowledge import ConnectivityKnowledge
+from reroute_cache import RerouteCache, DEFAULT_REROUTE_CACHE_SIZE
+from routing import Rerouting
+from scicrunch import SciCrunch, DEFAULT_CACHE_TTL, DEFAULT_CACHE_SIZE, DEFAULT_CONCURRENCY
+from waypoint_export import WaypointExporter
+
+STORE_DIRECTORY = 'production'
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s [%(levelname)-9s] %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="nerve-export")
+    parser.add_argument("sckan_version", help="The version of SKAN, e.g. sckan-2024-09-21")
+    parser.add_argument("points", help="The nerve point annotation file location")
+    parser.add_argument("pathways", help="The full nerve pathway csv")
+    parser.add_argument("--output", help="The GeoJSON text sequence file to create", default='waypoints.geojsons')
+    parser.add_argument("--bundle", help="A bundle compiled from the points and pathways by nerve-compile.py, "
+                                         "used when it is up to date", default=None)
+    parser.add_argument("--scicrunch-cache", help="The SciCrunch lookup cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'scicrunch_cache.db'))
+    parser.add_argument("--cache-ttl", help="Days before a cached SciCrunch lookup expires",
+                        type=float, default=DEFAULT_CACHE_TTL/(24*60*60))
+    parser.add_argument("--cache-size", help="Maximum number of cached SciCrunch lookups",
+                        type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--offline", help="Only use cached SciCrunch lookups", action='store_true')
+    parser.add_argument("--concurrency", help="Number of SciCrunch lookups made at once",
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", help="Maximum number of SciCrunch requests per second, shared "
+                                             "equally by the --jobs processes",
+                        type=float, default=None)
+    parser.add_argument("--result-cache", help="The reroute result cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'reroute_cache.db'))
+    parser.add_argument("--no-result-cache", help="Reroute all paths, without using or updating the result cache",
+                        action='store_true')
+    parser.add_argument("--jobs", help="Number of processes used to reroute paths",
+                        type=int, default=1)
+    parser.add_argument("--graph-backend", help="The graph library used to reroute paths",
+                        choices=list(GRAPH_BACKENDS), default=DEFAULT_GRAPH_BACKEND)
+
+    return parser.parse_args()
+
+def _export(args):
+    store_factory = partial(ConnectivityKnowledge, store_directory=STORE_DIRECTORY,
+                            sckan_version=args.sckan_version, clean_connectivity=True)
+    store = store_factory()
+    scicrunch = SciCrunch(cache_path=args.scicrunch_cache, ttl=args.cache_ttl*24*60*60,
+                          cache_size=args.cache_size, offline=args.offline,
+                          concurrency=args.concurrency, rate_limit=args.rate_limit)
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = RerouteCache(args.result_cache, max_entries=DEFAULT_REROUTE_CACHE_SIZE)
+    try:
+        rerouting = Rerouting(args.pathways, args.points, store, scicrunch, args.bundle,
+                              args.graph_backend, result_cache)
+        human_paths = [path for path in store.connectivity_paths()
+                            if is_human_path(store.entity_knowledge(path))]
+        exporter = WaypointExporter(rerouting, store)
+        stats = exporter.export(args.output, human_paths, workers=args.jobs, store_factory=store_factory)
+        logger.info(f'Exported {stats["paths"]} paths with {stats["segments"]} segments, '
+                    f'referred to {stats["segment_references"]} times, to {args.output}')
+        if stats['unresolved_segments'] > 0:
+            logger.warning(f'Number of segments without 3D map coordinates: {stats["unresolved_segments"]}')
+        if stats['failed_paths'] > 0:
+            logger.warning(f'Number of paths that failed rerouting or export: {stats["failed_paths"]}')
+
+    except Exception as e:
+        logger.error(e)
+
+    if result_cache is not None:
+        result_cache.close()
+    scicrunch.close()
+    store.close()
+
+if __name__ == "__main__":
+    args = _parse_args()
+    _export(args)
@@ -0,0 +1,76 @@
+import argparse
+import asyncio
+from functools import partial
+import logging
+import os
+import signal
+
+from graph_backend import DEFAULT_GRAPH_BACKEND, GRAPH_BACKENDS
+from reroute_service import RerouteService, local_store, DEFAULT_HOST, DEFAULT_PORT, DEFAULT_WORKERS
+from scicrunch import SciCrunch, DEFAULT_CACHE_TTL, DEFAULT_CACHE_SIZE, DEFAULT_CONCURRENCY
+
+STORE_DIRECTORY = 'production'
+
+logger = logging.getLogger()
+logging.basicConfig(
+    format='%(asctime)s [%(levelname)-9s] %(message)s',
+    level=logging.INFO,
+    datefmt='%Y-%m-%d %H:%M:%S')
+
+def _parse_args():
+    parser = argparse.ArgumentParser(prog="nerve-service")
+    parser.add_argument("points", help="The nerve point annotation file location")
+    parser.add_argument("pathways", help="The full nerve pathway csv")
+    parser.add_argument("--sckan-version", help="The version of SKAN, e.g. sckan-2024-09-21", default=None)
+    parser.add_argument("--knowledge", help="A JSON file of entity knowledge used instead of the SCKAN knowledge store",
+                        default=None)
+    parser.add_argument("--bundle", help="A bundle compiled from the points and pathways by nerve-compile.py, "
+                                         "used when it is up to date", default=None)
+    parser.add_argument("--scicrunch-cache", help="The SciCrunch lookup cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'scicrunch_cache.db'))
+    parser.add_argument("--cache-ttl", help="Days before a cached SciCrunch lookup expires",
+                        type=float, default=DEFAULT_CACHE_TTL/(24*60*60))
+    parser.add_argument("--cache-size", help="Maximum number of cached SciCrunch lookups",
+                        type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--offline", help="Only use cached SciCrunch lookups", action='store_true')
+    parser.add_argument("--concurrency", help="Number of SciCrunch lookups made at once",
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", help="Maximum number of SciCrunch requests per second, shared "
+                                             "equally by the --workers processes",
+                        type=float, default=None)
+    parser.add_argument("--graph-backend", help="The graph library used to reroute paths",
+                        choices=list(GRAPH_BACKENDS), default=DEFAULT_GRAPH_BACKEND)
+    parser.add_argument("--workers", help="Number of processes computing results, 0 to compute them in the service's process",
+                        type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--host", help="The address to listen on", default=DEFAULT_HOST)
+    parser.add_argument("--port", help="The port to listen on", type=int, default=DEFAULT_PORT)
+
+    args = parser.parse_args()
+    if (args.sckan_version is None) == (args.knowledge is None):
+        parser.error('one of --sckan-version or --knowledge is required')
+    return args
+
+def _serve(args):
+    if args.knowledge is not None:
+        store_factory = partial(local_store, args.knowledge)
+    else:
+        from knowledge import ConnectivityKnowledge
+        store_factory = partial(ConnectivityKnowledge, store_directory=STORE_DIRECTORY,
+                                sckan_version=args.sckan_version, clean_connectivity=True)
+    scicrunch = SciCrunch(cache_path=args.scicrunch_cache, ttl=args.cache_ttl*24*60*60,
+                          cache_size=args.cache_size, offline=args.offline,
+                          concurrency=args.concurrency, rate_limit=args.rate_limit)
+    service = RerouteService(args.pathways, args.points, store_factory, scicrunch, args.bundle,
+                             args.graph_backend, args.workers)
+    # stop cleanly when terminated, as when interrupted
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    service.close()
+    scicrunch.close()
+
+if __name__ == "__main__":
+    args = _parse_args()
+    _serve(args)
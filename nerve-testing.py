@@ -1,9 +1,19 @@
 import argparse
+from functools import partial
 import logging
+import os
 from tqdm import tqdm
 
-from mapknowledge import KnowledgeStore
+from coverage import CoverageAggregator
+from graph_backend import DEFAULT_GRAPH_BACKEND, GRAPH_BACKENDS
+from incremental import IncrementalCoverage
+from instrumentation import Profiler, DEFAULT_SLOWEST_PATHS
+from local_store import LocalKnowledgeStore, read_knowledge, snapshot_knowledge
+from reroute_cache import RerouteCache, DEFAULT_REROUTE_CACHE_SIZE
 from routing import Rerouting, SCICRUNCH_API_KEY
+from scicrunch import SciCrunch, DEFAULT_CACHE_TTL, DEFAULT_CACHE_SIZE, DEFAULT_CONCURRENCY
+
+STORE_DIRECTORY = 'production'
 
 logger = logging.getLogger()
 # logger.setLevel(logging.INFO)
@@ -20,60 +30,147 @@ def _parse_args():
     # Later this must refer to a standard repo and SHA
     parser.add_argument("points", help="The nerve point annotation file location")
     parser.add_argument("pathways", help="The full nerve pathway csv")
+    parser.add_argument("--bundle", help="A bundle compiled from the points and pathways by nerve-compile.py, "
+                                         "used when it is up to date", default=None)
+
+    # SciCrunch lookups are cached so that repeated runs don't query SciCrunch again
+    parser.add_argument("--scicrunch-cache", help="The SciCrunch lookup cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'scicrunch_cache.db'))
+    parser.add_argument("--cache-ttl", help="Days before a cached SciCrunch lookup expires",
+                        type=float, default=DEFAULT_CACHE_TTL/(24*60*60))
+    parser.add_argument("--cache-size", help="Maximum number of cached SciCrunch lookups",
+                        type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--offline", help="Only use cached SciCrunch lookups", action='store_true')
+    parser.add_argument("--concurrency", help="Number of SciCrunch lookups made at once",
+                        type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--rate-limit", help="Maximum number of SciCrunch requests per second, shared "
+                                             "equally by the --jobs processes",
+                        type=float, default=None)
+
+    # so are reroute results, for the SCKAN version and nerve files they were rerouted with
+    parser.add_argument("--result-cache", help="The reroute result cache, defaults to a file in the store directory",
+                        default=os.path.join(STORE_DIRECTORY, 'reroute_cache.db'))
+    parser.add_argument("--result-cache-size", help="Maximum number of cached reroute results",
+                        type=int, default=DEFAULT_REROUTE_CACHE_SIZE)
+    parser.add_argument("--no-result-cache", help="Reroute all paths, without using or updating the result cache",
+                        action='store_true')
+    parser.add_argument("--clear-result-cache", help="Remove all cached reroute results before rerouting",
+                        action='store_true')
+
+    parser.add_argument("--jobs", help="Number of processes used to reroute paths",
+                        type=int, default=1)
+    parser.add_argument("--graph-backend", help="The graph library used to reroute paths",
+                        choices=list(GRAPH_BACKENDS), default=DEFAULT_GRAPH_BACKEND)
+    parser.add_argument("--incremental", help="Keep reroute results and their dependencies in this state file "
+                                              "and only reroute paths affected by changes since it was saved",
+                        default=None)
+    parser.add_argument("--profile", help="Write a summary of the time taken by each rerouting stage, SciCrunch "
+                                          "requests and the slowest paths to this JSON file",
+                        default=None)
+    parser.add_argument("--slowest", help="Number of the slowest paths in the profile summary",
+                        type=int, default=DEFAULT_SLOWEST_PATHS)
+    parser.add_argument("--knowledge", help="A knowledge snapshot, saved with --save-knowledge, used instead of "
+                                            "the SCKAN knowledge store", default=None)
+    parser.add_argument("--save-knowledge", help="Save a snapshot of the knowledge of all paths, and the labels "
+                                                 "of their terms, to this JSON file", default=None)
+    parser.add_argument("--report", help="Write a JSON coverage report, with per-path and per-nerve breakdowns, to this file",
+                        default=None)
 
     return parser.parse_args()
 
 def _coverage_testing(args):
-    store = KnowledgeStore(store_directory='production', sckan_version=args.sckan_version, clean_connectivity=True)
+    # all knowledge lookups are answered from a snapshot, read from the knowledge
+    # store in one pass unless a saved snapshot is given
+    if args.knowledge is not None:
+        knowledge = read_knowledge(args.knowledge)
+    else:
+        from mapknowledge import KnowledgeStore
+        knowledge_store = KnowledgeStore(store_directory=STORE_DIRECTORY,
+                                         sckan_version=args.sckan_version, clean_connectivity=True)
+        knowledge = snapshot_knowledge(knowledge_store, labels=args.save_knowledge is not None)
+        knowledge_store.close()
+    store_factory = partial(LocalKnowledgeStore, knowledge)
+    store = store_factory()
+    if args.save_knowledge is not None:
+        store.save(args.save_knowledge)
+        logger.info(f'Knowledge snapshot: {args.save_knowledge}')
+    scicrunch = SciCrunch(cache_path=args.scicrunch_cache, ttl=args.cache_ttl*24*60*60,
+                          cache_size=args.cache_size, offline=args.offline,
+                          concurrency=args.concurrency, rate_limit=args.rate_limit)
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = RerouteCache(args.result_cache, max_entries=args.result_cache_size)
+        if args.clear_result_cache:
+            result_cache.invalidate()
     try:
-        rerouting = Rerouting(args.pathways, args.points, store)
+        rerouting = Rerouting(args.pathways, args.points, store, scicrunch, args.bundle,
+                              args.graph_backend, result_cache,
+                              Profiler() if args.profile is not None else None)
         
-        # get paths, edges and nodes
-        all_edges = []
-        all_nodes = []
-        human_paths = {}
-        human_edges = []
-        human_nodes = []
-        for path in store.connectivity_paths():
-            path_kn = store.entity_knowledge(path)
-            all_edges += [(edge[0], edge[1]) for edge in path_kn['connectivity'] if (edge[0], edge[1]) not in all_edges and (edge[1], edge[0]) not in all_edges]
-            all_nodes += [n for edge in path_kn['connectivity'] for n in edge if n not in all_nodes]
-
-            # filter for human neuron population only (NCBITaxon:9606/human) (NCBITaxon:40674/mammal)
-            if len(taxons:=path_kn.get('taxons', [])) == 0 \
-                or 'NCBITaxon:9606' in taxons \
-                or 'NCBITaxon:40674' in taxons:
-                human_paths[path] = path_kn
-                human_edges += [(edge[0], edge[1]) for edge in path_kn['connectivity'] if (edge[0], edge[1]) not in human_edges and (edge[1], edge[0]) not in human_edges]
-                human_nodes += [n for edge in path_kn['connectivity'] for n in edge if n not in human_nodes]
+        report_metadata = {}
+        if args.incremental is not None:
+            # only reroute paths affected by changes since the last run
+            incremental = IncrementalCoverage(args.incremental)
+            coverage = incremental.update(rerouting, store, store.connectivity_paths(), workers=args.jobs,
+                                          store_factory=store_factory,
+                                          is_nerve=rerouting.nerve_pathways.is_nerve_available)
+            for path, error in coverage.report()['failed_paths'].items():
+                logger.error(f"Couldn't reroute {path}: {error}")
+            incremental.save()
+            logger.info(f'Number of paths rerouted: {len(incremental.rerouted_paths)}')
+            if len(incremental.map_changed_paths) > 0:
+                logger.info(f'Number of paths with changed 3D map points: {len(incremental.map_changed_paths)}')
+            report_metadata = {
+                'rerouted_paths': incremental.rerouted_paths,
+                'map_changed_paths': incremental.map_changed_paths,
+            }
+        else:
+            # get paths, edges and nodes
+            coverage = CoverageAggregator(is_nerve=rerouting.nerve_pathways.is_nerve_available)
+            human_paths = [path for path in store.connectivity_paths()
+                                if coverage.add_path(path, store.entity_knowledge(path))]
 
-        # rerouting to 3d whole body map test
-        covered_paths = set()
-        covered_nodes = set()
-        covered_edges = set()
-        for path in human_paths:
-            reroute_knowledge = rerouting.reroute_for_3d_map(path)
-            covered_nodes.update(reroute_knowledge['covered_nodes'])
-            covered_edges.update([c_e for c_e in reroute_knowledge['covered_edges'] if c_e not in covered_edges and (c_e[1], c_e[0]) not in covered_edges])
-            if len(reroute_knowledge['connectivity']) >= 4:
-                covered_paths.add(path)
+            # rerouting to 3d whole body map test
+            for path, reroute_knowledge, error in rerouting.reroute_many(human_paths, workers=args.jobs,
+                                                                         store_factory=store_factory):
+                if error is not None:
+                    logger.error(f"Couldn't reroute {path}: {error}")
+                    coverage.add_failure(path, error)
+                else:
+                    coverage.add_reroute(path, reroute_knowledge)
 
         # log testing results
+        counts = coverage.counts
         logger.info(f'Nerve point annotation file: {args.points}')
         logger.info(f'Full nerve pathway file: {args.pathways}')
-        logger.info(f'Number of paths in SCKAN: {len(store.connectivity_paths())}')
-        logger.info(f'Number of edges in SCKAN: {len(all_edges)}')
-        logger.info(f'Number of nodes in SCKAN: {len(all_nodes)}')
-        logger.info(f'Number of human paths in SCKAN: {len(human_paths)}')
-        logger.info(f'Number of human edges in SCKAN: {len(human_edges)}')
-        logger.info(f'Number of human nodes in SCKAN: {len(human_nodes)}')
-        logger.info(f'Number of paths in 3D whole body map: {len(covered_paths)}')
-        logger.info(f'Number of edges in 3D whole body map: {len(covered_edges)}')
-        logger.info(f'Number of nodes in 3D whole body map: {len(covered_nodes)}')
+        logger.info(f'Number of paths in SCKAN: {counts["paths"]}')
+        logger.info(f'Number of edges in SCKAN: {counts["edges"]}')
+        logger.info(f'Number of nodes in SCKAN: {counts["nodes"]}')
+        logger.info(f'Number of human paths in SCKAN: {counts["human_paths"]}')
+        logger.info(f'Number of human edges in SCKAN: {counts["human_edges"]}')
+        logger.info(f'Number of human nodes in SCKAN: {counts["human_nodes"]}')
+        logger.info(f'Number of paths in 3D whole body map: {counts["covered_paths"]}')
+        logger.info(f'Number of edges in 3D whole body map: {counts["covered_edges"]}')
+        logger.info(f'Number of nodes in 3D whole body map: {counts["covered_nodes"]}')
+        if counts['failed_paths'] > 0:
+            logger.warning(f'Number of paths that failed rerouting: {counts["failed_paths"]}')
+        if result_cache is not None:
+            stats = result_cache.stats
+            logger.info(f'Reroute result cache: {stats["hits"]} hits, {stats["misses"]} misses, {stats["entries"]} entries')
+        if args.profile is not None:
+            rerouting.profiler.save(args.profile, args.slowest)
+            logger.info(f'Profile summary: {args.profile}')
+        if args.report is not None:
+            coverage.save_report(args.report, sckan_version=args.sckan_version,
+                                 points=args.points, pathways=args.pathways, **report_metadata)
+            logger.info(f'Coverage report: {args.report}')
 
     except Exception as e:
         logger.error(e)
 
+    if result_cache is not None:
+        result_cache.close()
+    scicrunch.close()
     store.close()
 
 if __name__ == "__main__":
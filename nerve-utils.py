@@ -1,7 +1,10 @@
 import argparse
 import json
+import math
 import pandas as pd
 
+from annotations import iter_annotations
+
 
 def _parse_args():
     parser = argparse.ArgumentParser(prog="nerve-utils")
@@ -12,6 +15,11 @@ def _parse_args():
     parser.add_argument("--visualise-graph", help="Generate visualisation of nerve connectivity graph "
                                                   "in the specified file.",
                         default=None)
+    parser.add_argument("--graph", help="Write the nerve point graph, with edge lengths, to this GraphML file "
+                                        "instead of printing nodes and edges as JSON",
+                        default=None)
+    parser.add_argument("--graph-library", help="The graph library used to build the graph",
+                        choices=['networkx', 'igraph'], default='networkx')
 
     # other requirements:
     # extract list of nerves into a new file
@@ -23,67 +31,47 @@ def _parse_args():
 
 def parse_nerve_point_file(filename, pathways_dataframe):
 
-    with open(filename) as json_data:
-        jd = json.load(json_data)
-        json_data.close()
-
     marker_data = {}
     marker_data_group = {}
-    markerCount = 0
-    for feature in jd:
+    for feature in iter_annotations(filename):
         marker_name = feature['group']
-        marker_point = feature['feature']['geometry']['coordinates'][0]
+        marker_point = feature['coordinates']
         marker_group = feature['region'].replace('__annotation/', '')
 
-        if marker_group in marker_data_group.keys():
-            marker_data_group[marker_group].append(marker_name)
-        else:
-            marker_data_group[marker_group] = [marker_name]
+        marker_data_group.setdefault(marker_group, []).append(marker_name)
 
-        if marker_name in marker_data.keys():
-            pass
-            # print(marker_name, marker_group)
-        else:
+        # the first point of a marker is used
+        if marker_name not in marker_data:
             marker_data[marker_name] = marker_point
-            markerCount += 1
-            # print('New marker in', marker_group, ': ', marker_name)
-
-    # marker coordinates
-    cleanGroupList = []
-    cleanMarkerList = []
-    cleanMarkerNodeList = []
-    cleanMarkerCoordList = []
-    allAnnotationGroups = []
+    markerCount = len(marker_data)
+
+    # marker name to node identifier
+    markerNodeIds = {}
     all_nodes = []
     all_edges = []
-    elementIdsList = [[] for n in range(markerCount)]
-    xiList = [[] for n in range(markerCount)]
 
     print('Number of branches = ', len(marker_data_group.keys()))
     print('Number of markers = ', markerCount)
 
     nodeIdentifier = 1
     elementIdentifier = 1
+
+    def add_edge(marker_group, nIds):
+        nonlocal elementIdentifier
+        edge = {
+            'id': elementIdentifier,
+            'name': marker_group,
+            'nodes': nIds,
+        }
+        all_edges.append(edge)
+        elementIdentifier = elementIdentifier + 1
+
     for marker_group in marker_data_group.keys():
         origins = []
         waypoints = []
         waypointsOrder = []
         destinations = []
 
-        # Create annotation group
-        branchGroup = {}
-
-        # Check for duplicate groups
-        groupNotInList = 1
-        for group in cleanGroupList:
-            if marker_group == group:
-                print('Duplicate groups', marker_group)
-                groupNotInList = 0
-                break
-        if groupNotInList:
-            cleanGroupList.append(marker_group)
-
-        # if marker_group in ["Left obturator nerve"]:
         # Discover markers in each group (duplicate included)
         for name in marker_data_group[marker_group]:
             # Separate names and tags for origin/destination/waypoint
@@ -96,19 +84,8 @@ def parse_nerve_point_file(filename, pathways_dataframe):
 
             xyz = marker_data[name]  # Get coordinates
 
-            # check if point exists before
-            markerNotInList = 1
-            for i in range(len(cleanMarkerList)):
-                marker = cleanMarkerList[i]
-                if currentMarkerName == marker:
-                    markerNotInList = 0
-                    currentNodeId = cleanMarkerNodeList[i]
-                    break
-            if markerNotInList:  # if new point, create a node
-                cleanMarkerList.append(currentMarkerName)
-                cleanMarkerNodeList.append(nodeIdentifier)
-                cleanMarkerCoordList.append(xyz)
-
+            # check if point exists before, if new point, create a node
+            if (currentNodeId := markerNodeIds.get(currentMarkerName)) is None:
                 node = {
                     'id': nodeIdentifier,
                     'name': currentMarkerName,
@@ -116,9 +93,7 @@ def parse_nerve_point_file(filename, pathways_dataframe):
                 }
                 all_nodes.append(node)
 
-                # print('Node', nodeIdentifier, name)
-                # if marker_group == 'Left radial nerve':
-                #     print('Node', nodeIdentifier, name)
+                markerNodeIds[currentMarkerName] = nodeIdentifier
                 currentNodeId = nodeIdentifier
                 nodeIdentifier += 1
 
@@ -138,108 +113,33 @@ def parse_nerve_point_file(filename, pathways_dataframe):
 
         waypointsClean = []
         waypointsOrderClean = []
-        for i in range(len(waypoints)):
-            if waypoints[i] not in waypointsClean:
-                waypointsClean.append(waypoints[i])
-                waypointsOrderClean.append(waypointsOrder[i])
+        seenWaypoints = set()
+        for waypoint, order in zip(waypoints, waypointsOrder):
+            if waypoint not in seenWaypoints:
+                seenWaypoints.add(waypoint)
+                waypointsClean.append(waypoint)
+                waypointsOrderClean.append(order)
 
         destinations = list(set(destinations))
 
-        # print('Branch', marker_group)
-        # print('Origins', origins)
-        # print('Waypoints', waypoints)
-        # print('Destinations', destinations)
-
         # Re-arrange points in each tag from cranial to caudal
         if len(waypoints) > 1:
-            #     if marker_group == 'Left radial nerve':
-            #         debug = 1
             waypoints = sortPointsUsingTag(waypointsClean, waypointsOrderClean)
 
         # create elements to connect points up when all points are processed in the group
         if len(waypoints) == 0 and len(origins) == 1 and len(destinations) > 0:
-            allAnnotationGroups.append(branchGroup)
             for d in range(len(destinations)):
-                #element = mesh.createElement(elementIdentifier, elementtemplate)
-                nIds = [origins[0], destinations[d]]
-                #element.setNodesByIdentifier(eft, nIds)
-                #elementIdsList, xiList = findElementAndXi(nIds, elementIdentifier, elementIdsList, xiList)
-                #meshGroup = branchGroup.getMeshGroup(mesh)
-                #meshGroup.addElement(element)
-                edge = {
-                    'id': elementIdentifier,
-                    'name': marker_group,
-                    'nodes': nIds,
-                }
-                all_edges.append(edge)
-                elementIdentifier = elementIdentifier + 1
+                add_edge(marker_group, [origins[0], destinations[d]])
         elif len(waypoints) == 0 and len(origins) > 1 and len(destinations) == 1:
-            allAnnotationGroups.append(branchGroup)
             for o in range(len(origins)):
-                #element = mesh.createElement(elementIdentifier, elementtemplate)
-                nIds = [origins[o], destinations[0]]
-                #element.setNodesByIdentifier(eft, nIds)
-                #elementIdsList, xiList = findElementAndXi(nIds, elementIdentifier, elementIdsList, xiList)
-                #meshGroup = branchGroup.getMeshGroup(mesh)
-                #meshGroup.addElement(element)
-                edge = {
-                    'id': elementIdentifier,
-                    'name': marker_group,
-                    'nodes': nIds,
-                }
-                all_edges.append(edge)
-                elementIdentifier = elementIdentifier + 1
+                add_edge(marker_group, [origins[o], destinations[0]])
         elif len(waypoints) > 0:
-            allAnnotationGroups.append(branchGroup)
-            if len(origins) > 0:
-                for o in range(len(origins)):
-                    #element = mesh.createElement(elementIdentifier, elementtemplate)
-                    nIds = [origins[o], waypoints[0]]
-                    #element.setNodesByIdentifier(eft, nIds)
-                    #elementIdsList, xiList = findElementAndXi(nIds, elementIdentifier, elementIdsList, xiList)
-                    # if marker_group == 'Left radial nerve':
-                    #     print("A", elementIdentifier, nIds)
-                    #meshGroup = branchGroup.getMeshGroup(mesh)
-                    #meshGroup.addElement(element)
-                    edge = {
-                        'id': elementIdentifier,
-                        'name': marker_group,
-                        'nodes': nIds,
-                    }
-                    all_edges.append(edge)
-                    elementIdentifier = elementIdentifier + 1
+            for o in range(len(origins)):
+                add_edge(marker_group, [origins[o], waypoints[0]])
             for w in range(len(waypoints) - 1):
-                #element = mesh.createElement(elementIdentifier, elementtemplate)
-                nIds = [waypoints[w], waypoints[w + 1]]
-                #element.setNodesByIdentifier(eft, nIds)
-                #elementIdsList, xiList = findElementAndXi(nIds, elementIdentifier, elementIdsList, xiList)
-                # if marker_group == 'Left radial nerve':
-                #     print("B", elementIdentifier, nIds)
-                #meshGroup = branchGroup.getMeshGroup(mesh)
-                #meshGroup.addElement(element)
-                edge = {
-                    'id': elementIdentifier,
-                    'name': marker_group,
-                    'nodes': nIds,
-                }
-                all_edges.append(edge)
-                elementIdentifier = elementIdentifier + 1
-            if len(destinations) > 0:
-                for d in range(len(destinations)):
-                    #element = mesh.createElement(elementIdentifier, elementtemplate)
-                    nIds = [waypoints[-1], destinations[d]]
-                    #element.setNodesByIdentifier(eft, nIds)
-                    #elementIdsList, xiList = findElementAndXi(nIds, elementIdentifier, elementIdsList, xiList)
-                    # print("C", elementIdentifier, nIds)
-                    #meshGroup = branchGroup.getMeshGroup(mesh)
-                    #meshGroup.addElement(element)
-                    edge = {
-                        'id': elementIdentifier,
-                        'name': marker_group,
-                        'nodes': nIds,
-                    }
-                    all_edges.append(edge)
-                    elementIdentifier = elementIdentifier + 1
+                add_edge(marker_group, [waypoints[w], waypoints[w + 1]])
+            for d in range(len(destinations)):
+                add_edge(marker_group, [waypoints[-1], destinations[d]])
         elif len(origins) > 0 and len(waypoints) < 1 and len(destinations) < 1:
             print('Invalid nerve with only origin -', marker_group, len(origins), len(waypoints),
                   len(destinations))
@@ -253,29 +153,6 @@ def parse_nerve_point_file(filename, pathways_dataframe):
             print('Code could not deal with this -', marker_group, len(origins), len(waypoints),
                   len(destinations))
 
-    # Make markers
-    #markerGroup = findOrCreateFieldGroup(fieldmodule, "marker")
-    #markerName = findOrCreateFieldStoredString(fieldmodule, name="marker_name")
-    #markerLocation = findOrCreateFieldStoredMeshLocation(fieldmodule, mesh, name="marker_location")
-    #markerCoordinates = findOrCreateFieldCoordinates(fieldmodule, name="marker coordinates").castFiniteElement()
-
-    # markerPoints = markerGroup.getOrCreateNodesetGroup(nodes)
-    # markerTemplateInternal = nodes.createNodetemplate()
-    # markerTemplateInternal.defineField(markerCoordinates)
-    # markerTemplateInternal.defineField(markerName)
-    # markerTemplateInternal.defineField(markerLocation)
-
-    for i in range(len(cleanMarkerList)):
-        # markerPoint = markerPoints.createNode(nodeIdentifier, markerTemplateInternal)
-        nodeIdentifier += 1
-        # cache.setNode(markerPoint)
-        # markerCoordinates.setNodeParameters(cache, -1, Node.VALUE_LABEL_VALUE, 1, cleanMarkerCoordList[i])
-        # markerName.assignString(cache, cleanMarkerList[i])
-        # elementID = elementIdsList[i + 1]
-        # xi = xiList[i + 1]
-        # element = mesh.findElementByIdentifier(elementID)
-        # markerLocation.assignMeshLocation(cache, element, xi)
-
     # # add groups in argon viewer graphics settings
     # argonSettingsFile = "C:\\Users\\mlin865\\map\\workflows\\datasets\\manInBox-Nerves\\Argon_Viewer-previous-docs\\document-dc3a2848.json"
     # modFile = "C:\\Users\\mlin865\\map\\workflows\\datasets\\manInBox-Nerves\\Argon_Viewer-previous-docs\\document-dc3a2848_modified.json"
@@ -312,13 +189,48 @@ def parse_nerve_point_file(filename, pathways_dataframe):
     # with open(reducedFile, 'w') as f:
     #     json.dump(reducedList, f)
 
-    # print('Number of annotated branches', len(allAnnotationGroups))
-
     return {
         'nodes': all_nodes,
         'edges': all_edges
     }
 
+def edge_length(nodes, edge):
+    u, v = (nodes[node_id]['coords'] for node_id in edge['nodes'])
+    return math.dist(u, v)
+
+def nerve_point_networkx_graph(nerve_points):
+    """
+    The parsed nerve points as a networkx multigraph, keyed by edge identifier,
+    with Euclidean edge lengths.
+    """
+    import networkx as nx
+    nodes = {node['id']: node for node in nerve_points['nodes']}
+    G = nx.MultiGraph()
+    for node in nerve_points['nodes']:
+        G.add_node(node['id'], name=node['name'], x=node['coords'][0], y=node['coords'][1], z=node['coords'][2])
+    for edge in nerve_points['edges']:
+        G.add_edge(*edge['nodes'], key=edge['id'], id=edge['id'], name=edge['name'], length=edge_length(nodes, edge))
+    return G
+
+def nerve_point_igraph_graph(nerve_points):
+    """
+    The parsed nerve points as an igraph graph, with Euclidean edge lengths.
+    Vertex ``node_id`` attributes are the node identifiers.
+    """
+    import igraph as ig
+    nodes = {node['id']: node for node in nerve_points['nodes']}
+    vertices = {node_id: n for n, node_id in enumerate(nodes)}
+    coords = [node['coords'] for node in nerve_points['nodes']]
+    G = ig.Graph(n=len(vertices),
+                 edges=[[vertices[node_id] for node_id in edge['nodes']] for edge in nerve_points['edges']])
+    G.vs['node_id'] = list(nodes)
+    G.vs['name'] = [node['name'] for node in nerve_points['nodes']]
+    G.vs['x'], G.vs['y'], G.vs['z'] = ([c[n] for c in coords] for n in range(3))
+    G.es['id'] = [edge['id'] for edge in nerve_points['edges']]
+    G.es['name'] = [edge['name'] for edge in nerve_points['edges']]
+    G.es['length'] = [edge_length(nodes, edge) for edge in nerve_points['edges']]
+    return G
+
 def sortPointsUsingTag(inputTag, tagOrder, debug=0):
     """
     Sorts origins, waypoints and destinations in ascending order based on the number appended to the tag.
@@ -357,4 +269,10 @@ if __name__ == "__main__":
 
     df = pd.read_excel(args.pathways, sheet_name='Sheet1')
     nerve_points = parse_nerve_point_file(args.points, df)
-    print(json.dumps(nerve_points, indent='  '))
+    if args.graph is None:
+        print(json.dumps(nerve_points, indent='  '))
+    elif args.graph_library == 'igraph':
+        nerve_point_igraph_graph(nerve_points).write_graphml(args.graph)
+    else:
+        import networkx as nx
+        nx.write_graphml(nerve_point_networkx_graph(nerve_points), args.graph)
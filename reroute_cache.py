@@ -0,0 +1,67 @@
+#===============================================================================
+
+import hashlib
+import json
+
+from cache import PersistentCache
+
+#===============================================================================
+
+# change when a change to rerouting changes its results, so that cached
+# results are no longer used
+REROUTE_CACHE_VERSION = 2
+
+DEFAULT_REROUTE_CACHE_SIZE = 100000
+
+# separates the fields of a cache key, the entity coming first
+KEY_SEPARATOR = '\t'
+
+def knowledge_hash(knowledge):
+    return hashlib.sha256(json.dumps(knowledge, sort_keys=True, default=str).encode()).hexdigest()
+
+#===============================================================================
+
+class RerouteCache:
+    """
+    A persistent cache of ``Rerouting.reroute_for_3d_map`` results. Results are
+    keyed by entity, a hash of the entity's knowledge and the hashes of the nerve
+    pathway and annotation files, so a change to any of them is a miss. The SCKAN
+    version isn't part of the key, paths whose knowledge is the same in another
+    version share their results.
+
+    Beyond ``max_entries`` the least recently used results are evicted.
+    """
+    def __init__(self, path, max_entries=DEFAULT_REROUTE_CACHE_SIZE):
+        self.__cache = PersistentCache(path, table='reroute', max_entries=max_entries)
+
+    @property
+    def path(self):
+        return self.__cache.path
+
+    @property
+    def stats(self):
+        return self.__cache.stats
+
+    def key(self, entity, knowledge, pathways_hash, points_hash):
+        return KEY_SEPARATOR.join([entity, knowledge_hash(knowledge), pathways_hash, points_hash,
+                                   str(REROUTE_CACHE_VERSION)])
+
+    def get(self, key):
+        return self.__cache.get(key)
+
+    def put(self, key, reroute_knowledge):
+        self.__cache.put(key, reroute_knowledge)
+
+    def invalidate(self, entity=None):
+        """
+        Remove the cached results for ``entity``, or all cached results.
+        """
+        if entity is None:
+            self.__cache.clear()
+        else:
+            self.__cache.delete_prefix(f'{entity}{KEY_SEPARATOR}')
+
+    def close(self):
+        self.__cache.close()
+
+#===============================================================================
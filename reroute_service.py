@@ -0,0 +1,199 @@
+#===============================================================================
+
+import asyncio
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+import json
+from urllib.parse import unquote, urlsplit
+
+import logging as log
+import networkx as nx
+
+from bundle import NerveBundle, share_bundle
+from graph_backend import DEFAULT_GRAPH_BACKEND
+from local_store import LocalKnowledgeStore, read_knowledge
+from routing import NervePathways, Nerves, Rerouting
+
+#===============================================================================
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8800
+DEFAULT_WORKERS = 4
+
+# request lines and headers longer than this are rejected
+MAX_LINE_LENGTH = 65536
+
+def local_store(knowledge_path):
+    return LocalKnowledgeStore(read_knowledge(knowledge_path))
+
+#===============================================================================
+
+class UnknownPathError(Exception):
+    pass
+
+#===============================================================================
+
+# each worker, or the service itself when it has no worker processes,
+# has its own store and Rerouting instance, created once when the worker starts
+
+_worker_store = None
+_worker_rerouting = None
+
+def _init_service_worker(path_hierarchy, path_maninbox, store_factory, scicrunch, bundle_path, graph_backend,
+                         shared_bundle=None):
+    global _worker_store, _worker_rerouting
+    _worker_store = store_factory()
+    _worker_rerouting = Rerouting(path_hierarchy, path_maninbox, _worker_store, scicrunch, bundle_path,
+                                  graph_backend, shared_bundle=shared_bundle)
+
+def _ready():
+    return _worker_rerouting is not None
+
+def _check_path(entity):
+    if 'connectivity' not in _worker_store.entity_knowledge(entity):
+        raise UnknownPathError(f'{entity} is not a connectivity path')
+
+def _reroute(entity):
+    _check_path(entity)
+    return _worker_rerouting.reroute_for_3d_map(entity)
+
+def _pathways_graph(entity):
+    _check_path(entity)
+    return nx.node_link_data(_worker_rerouting.get_3d_pathways_graph(entity), edges='edges')
+
+def _3d_edges(entity):
+    _check_path(entity)
+    return _worker_rerouting.get_3d_edges(_worker_rerouting.get_3d_pathways_graph(entity))
+
+# the queries served, each at ``/<query>/<entity>``
+QUERIES = {
+    'reroute': _reroute,
+    'graph': _pathways_graph,
+    'edges': _3d_edges,
+}
+
+#===============================================================================
+
+class RerouteService:
+    """
+    Serves reroute results over HTTP as JSON, computing them in a pool of worker
+    processes that each open the store once. The service loads the nerve files
+    and puts their tables in shared memory for the workers to use.
+
+    Concurrent requests for the same query and entity share a single computation.
+    With no ``workers``, queries are run one at a time in a thread of the service's
+    process, for stores that can't be opened in another process.
+    """
+    def __init__(self, path_hierarchy, path_maninbox, store_factory, scicrunch=None, bundle_path=None,
+                 graph_backend=DEFAULT_GRAPH_BACKEND, workers=DEFAULT_WORKERS):
+        self.__shared_memory = None
+        self.__worker_scicrunch = None
+        if workers > 0:
+            bundle = NerveBundle(bundle_path) if bundle_path is not None else None
+            self.__shared_memory = share_bundle(NervePathways(path_hierarchy, scicrunch, bundle),
+                                                Nerves(path_maninbox, bundle))
+            # workers share the rate limit rather than each keeping to all of it
+            if scicrunch is not None:
+                self.__worker_scicrunch = scicrunch.shared_by(workers)
+            initargs = (path_hierarchy, path_maninbox, store_factory, self.__worker_scicrunch, bundle_path,
+                        graph_backend, self.__shared_memory.name)
+            self.__executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_service_worker,
+                                                  initargs=initargs)
+        else:
+            # the store is opened in the thread that uses it
+            initargs = (path_hierarchy, path_maninbox, store_factory, scicrunch, bundle_path, graph_backend)
+            self.__executor = ThreadPoolExecutor(max_workers=1, initializer=_init_service_worker,
+                                                 initargs=initargs)
+        self.__workers = max(workers, 1)
+        self.__in_flight = {}           # (query, entity) --> future
+        self.__stats = Counter()
+
+    @property
+    def stats(self):
+        return dict(self.__stats) | {'in_flight': len(self.__in_flight)}
+
+    async def start_workers(self):
+        # start worker processes now rather than on the first requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(self.__executor, _ready) for _ in range(self.__workers)])
+
+    async def query(self, name, entity):
+        key = (name, entity)
+        if (future := self.__in_flight.get(key)) is None:
+            future = asyncio.get_running_loop().run_in_executor(self.__executor, QUERIES[name], entity)
+            self.__in_flight[key] = future
+            future.add_done_callback(lambda _: self.__in_flight.pop(key, None))
+        else:
+            self.__stats['coalesced'] += 1
+        # a client going away doesn't cancel a query that others may be waiting on
+        return await asyncio.shield(future)
+
+    async def __respond(self, method, target):
+        parts = unquote(urlsplit(target).path).lstrip('/').split('/', 1)
+        if method != 'GET':
+            return (HTTPStatus.METHOD_NOT_ALLOWED, {'error': f'{method} not supported'})
+        if parts == ['health']:
+            return (HTTPStatus.OK, {'status': 'ok'} | self.stats)
+        if len(parts) != 2 or parts[0] not in QUERIES or parts[1] == '':
+            return (HTTPStatus.NOT_FOUND, {'error': f'Use /<{"|".join(QUERIES)}>/<entity> or /health'})
+        self.__stats['queries'] += 1
+        try:
+            return (HTTPStatus.OK, await self.query(parts[0], parts[1]))
+        except UnknownPathError as exception:
+            self.__stats['not_found'] += 1
+            return (HTTPStatus.NOT_FOUND, {'error': str(exception)})
+        except Exception as exception:
+            self.__stats['errors'] += 1
+            log.error(f"Couldn't {parts[0]} {parts[1]}: {exception}")
+            return (HTTPStatus.INTERNAL_SERVER_ERROR, {'error': f'{type(exception).__name__}: {exception}'})
+
+    async def handle_connection(self, reader, writer):
+        request_line = ''
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            # headers are ignored
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            if len(request := request_line.split()) != 3:
+                status, result = (HTTPStatus.BAD_REQUEST, {'error': 'Malformed request'})
+            else:
+                status, result = await self.__respond(request[0], request[1])
+        except (ValueError, asyncio.LimitOverrunError):
+            status, result = (HTTPStatus.BAD_REQUEST, {'error': 'Request line or header too long'})
+        except ConnectionError:
+            writer.close()
+            return
+        try:
+            body = json.dumps(result).encode()
+        except Exception as exception:
+            self.__stats['errors'] += 1
+            log.error(f"Couldn't encode the response to {request_line.strip()}: {exception}")
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = json.dumps({'error': f'{type(exception).__name__}: {exception}'}).encode()
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     'Connection: close\r\n\r\n'.encode('latin-1') + body)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        await self.start_workers()
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_LINE_LENGTH)
+        log.info(f'Serving reroute results on http://{host}:{port}/')
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.__executor.shutdown(cancel_futures=True)
+        if self.__worker_scicrunch is not None:
+            self.__worker_scicrunch.close()
+        if self.__shared_memory is not None:
+            self.__shared_memory.close()
+            self.__shared_memory.unlink()
+
+#===============================================================================
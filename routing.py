@@ -1,133 +1,166 @@
 #===============================================================================
 
+import numpy as np
 import pandas as pd
 import networkx as nx
 import itertools
-from connectivity_graph import display_connectivity_graph, display_connectivity_for_entity
-from mapknowledge import KnowledgeStore
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 import logging as log
-import requests
-from json import JSONDecodeError
-import os
-import json
+from types import MappingProxyType
+from typing import TYPE_CHECKING
+
+from annotations import iter_annotations
+from bundle import FrozenIdMap, FrozenLaterals, FrozenManinbox, FrozenNervePathways, NerveBundle, \
+                   attach_bundle, file_hash, share_bundle
+from graph_backend import DEFAULT_GRAPH_BACKEND, graph_class
+from instrumentation import NO_PROFILER, Profiler
+from interning import NodeTable
+from reroute_cache import RerouteCache
+from scicrunch import SciCrunch, SCICRUNCH_API_KEY
+from spatial import PointIndex
+
+# the knowledge store is only needed for type checking, and the widgets
+# that display graphs are only imported when drawing
+if TYPE_CHECKING:
+    from mapknowledge import KnowledgeStore
 
 #===============================================================================
 
-LOOKUP_TIMEOUT = 30
-SCICRUNCH_API_KEY = os.environ.get('SCICRUNCH_API_KEY', '-')
-
-def request_json(endpoint, **kwds):
-    try:
-        response = requests.get(endpoint,
-                                headers={'Accept': 'application/json'},
-                                timeout=LOOKUP_TIMEOUT,
-                                **kwds)
-        if response.status_code == requests.codes.ok:
-            try:
-                return response.json()
-            except JSONDecodeError:
-                error = 'Invalid JSON returned'
-        else:
-            error = response.reason
-    except requests.exceptions.RequestException as exception:
-        error = f'Exception: {exception}'
-    log.warning(f"Couldn't access {endpoint}: {error}")
-    return None
+# the M2.6 columns that are used and what they are called in the nerve table
+NERVE_COLUMNS = {
+    'In man-in-box?': 'in_3d_map',
+    'Name': 'name',
+    'Preferred ID for nerve name': 'preferred_id',
+    'Superclass': 'superclass',
+    'Preferred ID for Origin/Central connection/Parent nerve': 'origins',
+    'Preferred ID (of destination)': 'destinations',
+    'Preferred ID for landmarks': 'landmarks',
+}
+
+# nerves without an ID yet are identified by their name
+PLACEHOLDER_IDS = ['REQUESTED', 'NEEDS CLARIFICATION']
+
+NO_LATERALS = MappingProxyType({'right': (), 'left': ()})
+
+def split_lines(column):
+    return column.str.replace('* ', '', regex=False).map(str.splitlines, na_action='ignore')
+
+def load_nerve_table(path):
+    df = pd.read_csv(path, usecols=list(NERVE_COLUMNS), dtype=str).rename(columns=NERVE_COLUMNS)
+
+    # get id
+    names = split_lines(df['name'])
+    preferred_ids = df['preferred_id']
+    preferred_lines = split_lines(preferred_ids)
+    has_placeholder = (preferred_ids.str.contains(PLACEHOLDER_IDS[0], regex=False, na=False)
+                     | preferred_ids.str.contains(PLACEHOLDER_IDS[1], regex=False, na=False))
+    use_name = (preferred_ids.isna()
+              | preferred_ids.isin(PLACEHOLDER_IDS)
+              | (has_placeholder & ((names.str.len() != preferred_lines.str.len())
+                                  | preferred_lines.str[0].isin(PLACEHOLDER_IDS))))
+
+    ## temporarily get one id only
+    nerve_table = pd.DataFrame({
+        'id': names.str[0].where(use_name, preferred_lines.str[0]),
+        'name': names.str[0],
+        'in_3d_map': df['in_3d_map'].notna(),
+        'bilateral': df['superclass'].map(str.splitlines, na_action='ignore').str[0],
+        'origins': split_lines(df['origins']),
+        'destinations': split_lines(df['destinations']),
+        'landmarks': split_lines(df['landmarks']),
+    })
+
+    # the first row for a nerve is the one that is used
+    return nerve_table[nerve_table['id'].notna()].drop_duplicates(subset='id', keep='first')
 
 #===============================================================================
 
 class NervePathways:
     """
     This class is to load knowledge from M2.6 files
+
+    Without a ``path``, the tables are read-only views of the ``bundle``.
     """
-    def __init__(self, path):
-        self.__nerve_df = pd.read_csv(path)
+    def __init__(self, path, scicrunch:SciCrunch=None, bundle:NerveBundle=None, profiler=NO_PROFILER):
+        self.__scicrunch = scicrunch if scicrunch is not None else SciCrunch()
+        self.__profiler = profiler
+
+        if path is None:
+            self.__source_hash = bundle.source_hash('pathways')
+            self.__nerves = FrozenNervePathways(bundle)
+            self.__laterals = FrozenLaterals(bundle)
+        else:
+            self.__source_hash = file_hash(path)
+            if bundle is not None and bundle.source_hash('pathways') == self.__source_hash:
+                self.__nerves = bundle.nerve_pathways()
+            else:
+                if bundle is not None:
+                    log.warning(f'{bundle.path} is out of date for {path}, loading {path}')
+                self.__extract_kowledge(load_nerve_table(path))
+            self.__laterals = self.__index_laterals()
 
-        self.__extract_kowledge()
+    @property
+    def source_hash(self):
+        return self.__source_hash
 
-    def __extract_kowledge(self):
+    def __extract_kowledge(self, nerve_table):
         self.__nerves = {}
-        
-        # extract laterality
-        ### filter by removing all lines with 'In man-in-box?' having NaN value
-        # df_3d_nerves = self.__nerve_df[self.__nerve_df['In man-in-box?'].notna()]
-
-        for _, row in self.__nerve_df.iterrows():
-            # get id
-            if pd.isna(preferred_id := row['Preferred ID for nerve name']):
-                if pd.isna(row['Name']):
-                    continue
-                id = (row['Name'].replace('* ', '').splitlines()[0],)
-            elif 'REQUESTED' in preferred_id or 'NEEDS CLARIFICATION' in preferred_id:
-                if preferred_id in ['REQUESTED', 'NEEDS CLARIFICATION']:
-                    id = (row['Name'].replace('* ', '').splitlines()[0],)
-                else:
-                    if len(k_names:= row['Name'].replace('* ', '').splitlines()) != len(k_ids:=preferred_id.replace('* ', '').splitlines()):
-                        id = (k_names[0],)
-                    else:
-                        id = tuple(k_id if k_id not in ['REQUESTED', 'NEEDS CLARIFICATION'] else k_name for k_id, k_name in zip(k_ids, k_names))
-
-            else:
-                id = tuple(preferred_id.replace('* ', '').splitlines())
 
-            ## temporarily get one id only
-            id = (id[0], )
-
-            if id not in self.__nerves:
-                self.__nerves[id] = {
-                    'id': id,
-                    'name': row['Name'].replace('* ', '').splitlines()[0],
-                    'in_3d_map': pd.notna(row['In man-in-box?'])
-                }
-                # check lateral and bilateral
-                if pd.notna(row['Superclass']):
-                    bilateral_id = tuple(row['Superclass'].splitlines())
-
-                    ## temporarily get one id only
-                    bilateral_id = (bilateral_id[0], )
-
-                    self.__nerves[id]['bilaterals'] = bilateral_id
-                    self.__nerves[bilateral_id]['laterals'] = self.__nerves[bilateral_id].get('laterals', []) + [id]
-                # check origin 
-                if pd.notna(row['Preferred ID for Origin/Central connection/Parent nerve']):
-                    origins = str(row['Preferred ID for Origin/Central connection/Parent nerve']).replace('* ', '').splitlines()
-                elif len(bilateral_id:=self.get_bilateral(id)) > 0:
-                    origins = self.get_origins(bilateral_id)
-                else:
-                    origins = []
-                self.__nerves[id]['origins'] = origins
-                # check destination
-                if pd.notna(row['Preferred ID (of destination)']):
-                    destinations = str(row['Preferred ID (of destination)']).replace('* ', '').splitlines()
-                elif len(bilateral_id:=self.get_bilateral(id)) > 0:
-                    destinations = self.get_destinations(bilateral_id)
-                else:
-                    destinations = []
-                self.__nerves[id]['destinations'] = destinations
-                # check landmarks
-                if pd.notna(row['Preferred ID for landmarks']):
-                    landmarks = str(row['Preferred ID for landmarks']).replace('* ', '').splitlines()
-                elif len(bilateral_id:=self.get_bilateral(id)) > 0:
-                    landmarks = self.get_landmarks(bilateral_id)
+        for id, name, in_3d_map, bilateral, *terms in zip(*(nerve_table[column].tolist() for column in
+                ['id', 'name', 'in_3d_map', 'bilateral', 'origins', 'destinations', 'landmarks'])):
+            id = (id, )
+            self.__nerves[id] = {
+                'id': id,
+                'name': name,
+                'in_3d_map': in_3d_map
+            }
+            # check lateral and bilateral
+            if isinstance(bilateral, str):
+                bilateral_id = (bilateral, )
+                self.__nerves[id]['bilaterals'] = bilateral_id
+                self.__nerves[bilateral_id]['laterals'] = self.__nerves[bilateral_id].get('laterals', []) + [id]
+            # check origin, destination and landmarks, using those of the bilateral nerve if not given
+            for key, values, get_values in zip(['origins', 'destinations', 'landmarks'], terms,
+                                               [self.get_origins, self.get_destinations, self.get_landmarks]):
+                if not isinstance(values, list):
+                    if len(bilateral_id:=self.get_bilateral(id)) > 0:
+                        values = get_values(bilateral_id)
+                    else:
+                        values = []
+                self.__nerves[id][key] = values
+
+    def __index_laterals(self):
+        # the left and right leaf nerves of every bilateral nerve, found by following
+        # laterals that are neither left nor right down the Superclass hierarchy
+        index = {}
+        def index_laterals(id, ancestors):
+            if (laterals := index.get(id)) is not None:
+                return laterals
+            ancestors.add(id)
+            left, right = [], []
+            for lateral_id in self.__nerves.get(id, {}).get('laterals', []):
+                if 'left' in (name := self.__nerves.get(lateral_id, {}).get('name', '').lower()):
+                    left.append(lateral_id[0])
+                elif 'right' in name:
+                    right.append(lateral_id[0])
+                elif lateral_id in ancestors:
+                    log.warning(f'Superclass cycle between {id[0]} and {lateral_id[0]}, ignoring {lateral_id[0]}')
                 else:
-                    landmarks = []
-                self.__nerves[id]['landmarks'] = landmarks
+                    nested_laterals = index_laterals(lateral_id, ancestors)
+                    left += nested_laterals['left']
+                    right += nested_laterals['right']
+            ancestors.discard(id)
+            index[id] = MappingProxyType({'right': tuple(right), 'left': tuple(left)})
+            return index[id]
+        for id, nerve in self.__nerves.items():
+            if 'laterals' in nerve:
+                index_laterals(id, set())
+        return MappingProxyType(index)
 
     def get_laterals(self, id):
         id = id if isinstance(id, tuple) else (id,)
-        laterals = {'right':[], 'left':[]}
-        for lateral_id in self.__nerves.get(id, {}).get('laterals', []):
-            if 'left' in self.__nerves.get(lateral_id, {}).get('name', '').lower():
-                laterals['left'] += [lateral_id[0]]
-            elif 'right' in self.__nerves.get(lateral_id, {}).get('name', '').lower():
-                laterals['right'] += [lateral_id[0]]
-            else:
-                nested_laterals = self.get_laterals(lateral_id)
-                laterals['left'] += nested_laterals['left']
-                laterals['right'] += nested_laterals['right']
-
-        return laterals
+        return self.__laterals.get(id, NO_LATERALS)
         
     def get_bilateral(self, id):
         id = id if isinstance(id, tuple) else (id,)
@@ -158,36 +191,37 @@ class NervePathways:
         return id in self.__nerves
     
     def __get_data_from_scicrunch(self, id):
-        params = {
-                'api_key': SCICRUNCH_API_KEY,
-                'limit': 9999,
-            }
-        SCICRUNCH_API_ENDPOINT = 'https://scicrunch.org/api/1'
-        query = f'{SCICRUNCH_API_ENDPOINT}/ilx/search/curie/{id}'
-        data = request_json(query, params=params)
-
-        result = {}
-        if data is not None:    
-            idxs = [concept['curie'] for concept in data.get('data', {}).get('existing_ids')]
-            if idxs is None or len(idxs)==0:
-                return {}
-            result['idxs'] = idxs
-            part_of = [r.get('term2_curie') for r in data['data'].get('relationships', {}) if r.get('relationship_term_ilx','') == 'ilx_0112785']
-            if not any('UBERON' in po  for po in part_of):
-                new_part_of = []
-                for part in part_of:
-                    query_part = f'{SCICRUNCH_API_ENDPOINT}/ilx/search/curie/{part}'
-                    data_part = request_json(query_part, params=params)
-                    new_part_of += [concept['curie'] for concept in data_part.get('data', {}).get('existing_ids')]
-                part_of = list(set(new_part_of))
-
-            result['partOf'] = part_of
-    
+        data = self.__scicrunch.lookup(id)
+        if len(idxs := data.get('idxs', [])) == 0:
+            return {}
+
+        result = {'idxs': idxs}
+        part_of = data.get('partOf', [])
+        if not any('UBERON' in po  for po in part_of):
+            new_part_of = []
+            for part in part_of:
+                new_part_of += self.__scicrunch.lookup(part).get('idxs', [])
+            part_of = list(set(new_part_of))
+        result['partOf'] = part_of
+
         return result
     
     def get_broader_concepts(self, id):
-        data = self.__get_data_from_scicrunch(id)
+        with self.__profiler.stage('scicrunch lookup'):
+            data = self.__get_data_from_scicrunch(id)
         return data.get('partOf', [])
+
+    def prefetch_broader_concepts(self, ids):
+        # resolve terms and then the partOf terms they need, each level as one concurrent batch
+        with self.__profiler.stage('scicrunch prefetch'):
+            ids = list(ids)
+            self.__scicrunch.resolve(ids)
+            parts = []
+            for id in ids:
+                part_of = self.__scicrunch.lookup(id).get('partOf', [])
+                if not any('UBERON' in po for po in part_of):
+                    parts += part_of
+            self.__scicrunch.resolve(parts)
     
     def get_label(self, id):
         id = id if isinstance(id, tuple) else (id,)
@@ -196,19 +230,42 @@ class NervePathways:
     def get_nerve(self, id):
         id = id if isinstance(id, tuple) else (id,)
         return self.__nerves.get(id, {'id':id})
+
+    @property
+    def nerves(self):
+        return self.__nerves
     
 #===============================================================================
 
-class Nerves:
-    def __init__(self, path):
-        with open(path, 'r') as f:
-            nerve_data = json.load(f)
+MISSING_COORDINATES = [np.nan, np.nan, np.nan]
 
+class Nerves:
+    """
+    The nerves and points of the man-in-box annotations. Without a ``path``,
+    the tables are read-only views of the ``bundle``.
+    """
+    def __init__(self, path, bundle:NerveBundle=None):
+        if path is None:
+            self.__source_hash = bundle.source_hash('points')
+            self.__nerves = FrozenManinbox(bundle)
+            self.__id_map = FrozenIdMap(bundle)
+            self.__coordinates = bundle.array('coordinates')
+        else:
+            self.__source_hash = file_hash(path)
+            if bundle is not None and bundle.source_hash('points') == self.__source_hash:
+                self.__nerves, self.__id_map, self.__coordinates = bundle.nerves()
+            else:
+                if bundle is not None:
+                    log.warning(f'{bundle.path} is out of date for {path}, loading {path}')
+                self.__load_annotations(path)
+        # points are indexed when first queried by position
+        self.__point_index = None
 
+    def __load_annotations(self, path):
         # get nerves from man in box
         self.__nerves = {}
         self.__id_map = {}
-        for nerve_point in nerve_data:
+        for nerve_point in iter_annotations(path):
             nerve_id = (nerve_point.get('region', '').split('/')[-1].lower()) if (nerve_id:=nerve_point.get('model')) is None else nerve_id
             nerve_id = nerve_id.lower()
             if nerve_id not in self.__nerves:
@@ -217,9 +274,11 @@ class Nerves:
                     'label': nerve_point.get('region', '').split('/')[-1].lower(), 
                     'points': {}
                 }
+            coordinates = nerve_point.get('coordinates', MISSING_COORDINATES)
             if '(origin)' in (group:=nerve_point.get('group', '').lower()):
                 self.__nerves[nerve_id]['points'][0] = {
-                    'group': group
+                    'group': group,
+                    'coordinates': coordinates
                 }
             elif '(waypoint' in group:
                 if '(waypoint)' in group:
@@ -227,11 +286,13 @@ class Nerves:
                 else:
                     point_id = int(group.split('(waypoint ')[-1].split(')')[0])
                 self.__nerves[nerve_id]['points'][point_id] = {
-                    'group': group
+                    'group': group,
+                    'coordinates': coordinates
                 }
             elif '(destination)' in group:
                 self.__nerves[nerve_id]['points']['destination'] = {
-                    'group': group
+                    'group': group,
+                    'coordinates': coordinates
                 }
             
             # s
@@ -243,11 +304,86 @@ class Nerves:
             if 'destination' in nerve['points']:
                 nerve['points'][len(nerve['points'])-1] = nerve['points']['destination']
                 del nerve['points']['destination']
-    
+
+        # move coordinates into one array, ordered by nerve and point ordinal,
+        # with each point keeping its row in the array
+        coordinates = []
+        for nerve in self.__nerves.values():
+            for ordinal in sorted(nerve['points']):
+                point = nerve['points'][ordinal]
+                point['index'] = len(coordinates)
+                coordinates.append(point.pop('coordinates'))
+        self.__coordinates = np.array(coordinates, dtype=np.float64).reshape(-1, 3)
+
+    def __index_points(self):
+        # the nerve and ordinal of each row of coordinates
+        if self.__point_index is not None:
+            return
+        self.__nerve_ids = list(self.__nerves.keys())
+        self.__nerve_rows = {}
+        self.__point_nerves = np.zeros(len(self.__coordinates), dtype=np.int32)
+        self.__point_ordinals = np.zeros(len(self.__coordinates), dtype=np.int32)
+        for nerve_index, (nerve_id, nerve) in enumerate(self.__nerves.items()):
+            rows = [point['index'] for point in nerve['points'].values()]
+            self.__nerve_rows[nerve_id] = (min(rows), max(rows)+1) if len(rows) else (0, 0)
+            self.__point_nerves[rows] = nerve_index
+            self.__point_ordinals[rows] = list(nerve['points'].keys())
+        self.__point_index = PointIndex(self.__coordinates)
+
     def get_nerve(self, node):
         nerve_id = self.__id_map.get(node.lower())
         return self.__nerves.get(nerve_id)
 
+    @property
+    def source_hash(self):
+        return self.__source_hash
+
+    @property
+    def coordinates(self):
+        return self.__coordinates
+
+    @property
+    def id_map(self):
+        return self.__id_map
+
+    def get_point_coordinates(self, node, ordinal):
+        if (nerve := self.get_nerve(node)) is None or (point := nerve['points'].get(ordinal)) is None:
+            return None
+        return self.__coordinates[point['index']]
+
+    def get_bounding_box(self, node):
+        if (nerve := self.get_nerve(node)) is None:
+            return None
+        self.__index_points()
+        start, end = self.__nerve_rows[nerve['id']]
+        if not np.isfinite(coordinates := self.__coordinates[start:end]).any():
+            return None
+        return (np.nanmin(coordinates, axis=0), np.nanmax(coordinates, axis=0))
+
+    def __point_at(self, row, distance):
+        nerve = self.__nerves[self.__nerve_ids[self.__point_nerves[row]]]
+        ordinal = int(self.__point_ordinals[row])
+        return {
+            'id': nerve['id'],
+            'label': nerve['label'],
+            'point': (ordinal, nerve['points'][ordinal]['group']),
+            'coordinates': self.__coordinates[row],
+            'distance': float(distance)
+        }
+
+    def nearest_points(self, xyz, k=1):
+        self.__index_points()
+        return [self.__point_at(row, distance) for row, distance in zip(*self.__point_index.nearest(xyz, k))]
+
+    def nearest_point(self, xyz):
+        return points[0] if len(points := self.nearest_points(xyz)) else None
+
+    def nerves_within(self, xyz, radius):
+        # nerve ids ordered by the distance of their nearest point
+        self.__index_points()
+        rows, _ = self.__point_index.within(xyz, radius)
+        return [self.__nerve_ids[nerve_index] for nerve_index in dict.fromkeys(self.__point_nerves[rows].tolist())]
+
     def __get_point(self, nerve, edge_terms):
         if nerve is not None:
             point_weight = {}
@@ -296,131 +432,369 @@ class Nerves:
 #===============================================================================
 
 class Rerouting:
-    def __init__(self, path_hierarchy, path_maninbox, store:KnowledgeStore):
-        self.__nerve_pathways = NervePathways(path_hierarchy)
-        self.__nerve_maninbox = Nerves(path_maninbox)
+    """
+    Reroutes SCKAN paths onto the nerves of the 3D whole body map.
+
+    When a ``profiler`` is given, the time taken by each rerouting stage, and by
+    each path, is recorded along with the number of nodes pruned, replaced and
+    contracted. The profiler is also given to ``scicrunch``, to record its
+    request latencies.
+
+    ``shared_bundle`` names a block of shared memory, from ``share_bundle``,
+    whose nerve tables are used instead of loading the nerve files.
+    """
+    def __init__(self, path_hierarchy, path_maninbox, store:'KnowledgeStore', scicrunch:SciCrunch=None,
+                 bundle_path=None, graph_backend=DEFAULT_GRAPH_BACKEND, result_cache:RerouteCache=None,
+                 profiler:Profiler=None, shared_bundle:str=None):
+        self.__path_hierarchy = path_hierarchy
+        self.__path_maninbox = path_maninbox
+        self.__scicrunch = scicrunch if scicrunch is not None else SciCrunch()
+        self.__graph_backend = graph_backend
+        self.__graph_class = graph_class(graph_backend)
+        self.__profiler = profiler if profiler is not None else NO_PROFILER
+        self.__scicrunch.profiler = self.__profiler
+        if shared_bundle is not None:
+            bundle = attach_bundle(shared_bundle)
+            self.__nerve_pathways = NervePathways(None, self.__scicrunch, bundle, self.__profiler)
+            self.__nerve_maninbox = Nerves(None, bundle)
+        else:
+            bundle = NerveBundle(bundle_path) if bundle_path is not None else None
+            self.__nerve_pathways = NervePathways(path_hierarchy, self.__scicrunch, bundle, self.__profiler)
+            self.__nerve_maninbox = Nerves(path_maninbox, bundle)
         self.__store = store
+        self.__result_cache = result_cache
+        self.__incomplete_paths = set()
 
-    def check_laterality(self, G):
+    # when given a ``NodeTable``, graph nodes are the integers it has interned them as
+
+    def check_laterality(self, G, nodes:NodeTable=None):
         lateral_map = {}
         for node in G.nodes():
-            for n in [node[0]] + list(node[1]):
+            for n in (nodes.terms(node) if nodes is not None else [node[0]] + list(node[1])):
                 if len((laterals:=self.__nerve_pathways.get_laterals(n))['left']) > 0:
                     lateral_map[node] = laterals
                     break
         return lateral_map
 
-    def add_lateralised_edge(self, G_reconstructed, u, v, laterality_mapping):
+    def add_lateralised_edge(self, G_reconstructed, u, v, laterality_mapping, nodes:NodeTable=None):
+        lateral_node = (lambda term: nodes.intern((term, ()))) if nodes is not None else (lambda term: (term, ()))
         for laterality in ['left', 'right']:
-            u_laterals = [(ul, ()) for ul in laterality_mapping[u][laterality]] if u in laterality_mapping else [u]
-            v_laterals = [(vl, ()) for vl in laterality_mapping[v][laterality]] if v in laterality_mapping else [v]
+            u_laterals = [lateral_node(ul) for ul in laterality_mapping[u][laterality]] if u in laterality_mapping else [u]
+            v_laterals = [lateral_node(vl) for vl in laterality_mapping[v][laterality]] if v in laterality_mapping else [v]
 
             for ul, vl in itertools.product(u_laterals, v_laterals):
                 G_reconstructed.add_edge(ul, vl)
 
     def replace_node(self, G, old_node, new_node):
-        if old_node in G and new_node not in G:
-            G.add_node(new_node, **G.nodes[old_node])
-            for neighbor in G.neighbors(old_node):
-                G.add_edge(new_node, neighbor)
-            G.remove_node(old_node)
+        G.replace_node(old_node, new_node)
+
+    def __result_key(self, entity, knowledge):
+        return self.__result_cache.key(entity, knowledge, self.__nerve_pathways.source_hash,
+                                       self.__nerve_maninbox.source_hash)
+
+    def __cached_reroute(self, entity):
+        # the cached result of rerouting ``entity`` and its cache key
+        if self.__result_cache is None:
+            return (None, None)
+        try:
+            key = self.__result_key(entity, self.__store.entity_knowledge(entity))
+        except Exception:
+            # left for rerouting to report
+            return (None, None)
+        return (self.__result_cache.get(key), key)
+
+    def __rerouted(self, entity, knowledge):
+        # paths rerouted while SciCrunch lookups went unanswered are noted, their
+        # results may differ once the lookups are answered so aren't kept
+        unresolved = self.__scicrunch.unresolved
+        reroute_knowledge = self.__reroute_knowledge(knowledge)
+        if self.__scicrunch.unresolved > unresolved:
+            self.__incomplete_paths.add(entity)
+        else:
+            self.__incomplete_paths.discard(entity)
+        return reroute_knowledge
 
     def reroute_for_3d_map(self, entity):
-        import copy
-        entity_knowledge = copy.deepcopy(self.__store.entity_knowledge(entity))
-        
-        G = nx.Graph()
-        G.add_edges_from(entity_knowledge['connectivity'])
-        G_reconstructed = nx.Graph()
-        
-        # create G_reconstructed and add laterality
-        if len(lateral_map := self.check_laterality(G)) > 0:
-            for u, v in G.edges():
-                # Add to right path
-                self.add_lateralised_edge(G_reconstructed, u, v, lateral_map)
-
-        # update G_reconstructed based on origin
-        retained_nodes = []
-        availabel_origs_dests = []
-        for lateral_nodes in lateral_map.values():
-            for nodes in lateral_nodes.values():
-                for n in nodes:
-                    availabel_origs_dests += self.__nerve_pathways.get_origins(n)
-                    availabel_origs_dests += self.__nerve_pathways.get_destinations(n)
-                    availabel_origs_dests += self.__nerve_pathways.get_landmarks(n)
-                    retained_nodes += [(n, ())]
-        
-        # remove nodes not in origins, destinations and retained_nodes
-        for node in list(G_reconstructed.nodes):
-            if len(flat_node:=set([node[0]] + list(node[1]))-set(availabel_origs_dests)) == len(set([node[0]] + list(node[1]))) and node not in retained_nodes:
-                # check in scicrunch
-                super_container = set([spr for fn in flat_node for spr in self.__nerve_pathways.get_broader_concepts(fn)])
-                if len(containers := list(super_container & set(availabel_origs_dests))) > 0:
-                    self.replace_node(G_reconstructed, node, (containers[0], ()))
-                else:
-                    neighbors = list(G_reconstructed.neighbors(node))
-                    for neighbor1, neighbor2 in itertools.combinations(neighbors, 2):
-                        if neighbor1 in retained_nodes and neighbor2 in retained_nodes:
-                            continue
-                        G_reconstructed.add_edge(neighbor1, neighbor2)
-                    G_reconstructed.remove_node(node)
-            elif len(selected_layer:=set([node[0]] + list(node[1])) & set(availabel_origs_dests)) < len(set([node[0]] + list(node[1]))) and len(selected_layer) > 0:
-                self.replace_node(G_reconstructed, node, (list(selected_layer)[0], ()))
-            
-
-        entity_knowledge['connectivity'] = list(G_reconstructed.edges())    
-        entity_knowledge['dendrites'] = [d for d in entity_knowledge['dendrites'] if d in list(G_reconstructed.nodes)]
-        entity_knowledge['axons'] = [a for a in entity_knowledge['axons'] if a in list(G_reconstructed.nodes)]
+        with self.__profiler.path(entity):
+            with self.__profiler.stage('store'):
+                knowledge = self.__store.entity_knowledge(entity)
+            if self.__result_cache is None:
+                return self.__rerouted(entity, knowledge)
+            with self.__profiler.stage('result cache'):
+                key = self.__result_key(entity, knowledge)
+                reroute_knowledge = self.__result_cache.get(key)
+            if reroute_knowledge is None:
+                reroute_knowledge = self.__rerouted(entity, knowledge)
+                if entity not in self.__incomplete_paths:
+                    with self.__profiler.stage('result cache'):
+                        self.__result_cache.put(key, reroute_knowledge)
+            else:
+                self.__profiler.count('result cache hits')
+                self.__incomplete_paths.discard(entity)
+            return reroute_knowledge
+
+    def __reroute_knowledge(self, knowledge):
+        # rerouting replaces the knowledge's connectivity, axons and dendrites rather
+        # than changing them, so a shallow copy leaves the store's knowledge as it was
+        entity_knowledge = dict(knowledge)
+
+        # the graphs are of interned nodes, translated back to ``(term, regions)``
+        # tuples for the result
+        nodes = NodeTable()
+        G = self.__graph_class()
+        G.add_edges_from((nodes.intern(u), nodes.intern(v)) for u, v in entity_knowledge['connectivity'])
+        G_reconstructed = self.__graph_class()
+        self.__profiler.count('nodes', len(G))
+
+        with self.__profiler.stage('laterality'):
+            # create G_reconstructed and add laterality
+            if len(lateral_map := self.check_laterality(G, nodes)) > 0:
+                for u, v in G.edges():
+                    # Add to right path
+                    self.add_lateralised_edge(G_reconstructed, u, v, lateral_map, nodes)
+
+            # update G_reconstructed based on origin
+            retained_nodes = set()
+            availabel_origs_dests = []
+            for lateral_nodes in lateral_map.values():
+                for lateral_terms in lateral_nodes.values():
+                    for n in lateral_terms:
+                        availabel_origs_dests += self.__nerve_pathways.get_origins(n)
+                        availabel_origs_dests += self.__nerve_pathways.get_destinations(n)
+                        availabel_origs_dests += self.__nerve_pathways.get_landmarks(n)
+                        retained_nodes.add(nodes.intern((n, ())))
+        # which terms are origins, destinations or landmarks is tested with bitmasks,
+        # the set of terms gives the term a node is replaced by
+        available_mask = nodes.term_mask(availabel_origs_dests)
+        available_terms = set(availabel_origs_dests)
+
+        # look up the terms of all nodes that may be pruned in one batch
+        candidate_terms = set()
+        for node in G_reconstructed.nodes():
+            if node not in retained_nodes and nodes.mask(node) & available_mask == 0:
+                candidate_terms.update(nodes.term_set(node))
+        self.__nerve_pathways.prefetch_broader_concepts(candidate_terms)
 
-        covered_nodes = set(G.nodes) & set(list(lateral_map.keys()) + list(G_reconstructed.nodes))
+        # remove nodes not in origins, destinations and retained_nodes
+        with self.__profiler.stage('pruning'):
+            for node in list(G_reconstructed.nodes()):
+                node_mask = nodes.mask(node)
+                if (selected_mask := node_mask & available_mask) == 0 and node not in retained_nodes:
+                    # check in scicrunch
+                    flat_node = nodes.term_set(node) - available_terms
+                    super_container = set([spr for fn in flat_node for spr in self.__nerve_pathways.get_broader_concepts(fn)])
+                    if len(containers := list(super_container & available_terms)) > 0:
+                        self.replace_node(G_reconstructed, node, nodes.intern((containers[0], ())))
+                        self.__profiler.count('replaced', node not in G_reconstructed)
+                    else:
+                        neighbors = list(G_reconstructed.neighbors(node))
+                        joining_edges = [(neighbor1, neighbor2)
+                            for neighbor1, neighbor2 in itertools.combinations(neighbors, 2)
+                                if neighbor1 not in retained_nodes or neighbor2 not in retained_nodes]
+                        G_reconstructed.add_edges_from(joining_edges)
+                        G_reconstructed.remove_node(node)
+                        self.__profiler.count('pruned')
+                        self.__profiler.count('contracted', len(joining_edges))
+                elif selected_mask != 0 and selected_mask != node_mask:
+                    selected_layer = nodes.term_set(node) & available_terms
+                    self.replace_node(G_reconstructed, node, nodes.intern((list(selected_layer)[0], ())))
+                    self.__profiler.count('replaced', node not in G_reconstructed)
+
+        def in_reconstructed(node):
+            return (id := nodes.find(node)) is not None and id in G_reconstructed
+
+        entity_knowledge['connectivity'] = [(nodes.node(u), nodes.node(v)) for u, v in G_reconstructed.edges()]
+        entity_knowledge['dendrites'] = [d for d in entity_knowledge['dendrites'] if in_reconstructed(d)]
+        entity_knowledge['axons'] = [a for a in entity_knowledge['axons'] if in_reconstructed(a)]
+
+        covered_nodes = set(nodes.nodes(G.nodes())) & set(nodes.nodes(list(lateral_map.keys()) + list(G_reconstructed.nodes())))
         entity_knowledge['covered_nodes'] = list(covered_nodes)
-        entity_knowledge['covered_edges'] = list(edge for edge in itertools.combinations(covered_nodes, 2) if edge in G.edges)
+        entity_knowledge['covered_edges'] = list(edge for edge in itertools.combinations(covered_nodes, 2)
+                                                    if G.has_edge(nodes.find(edge[0]), nodes.find(edge[1])))
 
         return entity_knowledge
     
+    def reroute_capturing_errors(self, entity):
+        try:
+            return (entity, self.reroute_for_3d_map(entity), None)
+        except Exception as exception:
+            return (entity, None, f'{type(exception).__name__}: {exception}')
+
+    def reroute_many(self, entities, workers=1, store_factory=None):
+        """
+        Reroute each of ``entities``, yielding ``(entity, knowledge, error)`` tuples
+        in completion order. ``knowledge`` is ``None`` and ``error`` describes the
+        exception if the entity couldn't be rerouted.
+
+        With more than one worker, entities are rerouted in a process pool where each
+        worker calls ``store_factory()`` to open its own knowledge store once, when it
+        starts. Workers share the nerve tables, which are put in shared memory rather
+        than each worker loading the nerve files. Results found in the result cache
+        are yielded before the others are rerouted.
+        """
+        if workers <= 1:
+            for entity in entities:
+                yield self.reroute_capturing_errors(entity)
+            return
+        if store_factory is None:
+            raise ValueError('A `store_factory` is needed to open the knowledge store in worker processes')
+        keys = {}
+        for entity in entities:
+            reroute_knowledge, keys[entity] = self.__cached_reroute(entity)
+            if reroute_knowledge is not None:
+                del keys[entity]
+                yield (entity, reroute_knowledge, None)
+        if len(keys) == 0:
+            return
+        shared_memory = share_bundle(self.__nerve_pathways, self.__nerve_maninbox)
+        # workers share the rate limit rather than each keeping to all of it
+        worker_scicrunch = self.__scicrunch.shared_by(workers)
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_reroute_worker,
+                                     initargs=(self.__path_hierarchy, self.__path_maninbox, store_factory,
+                                               worker_scicrunch, shared_memory.name, self.__graph_backend,
+                                               self.__profiler.enabled)) as executor:
+                futures = {executor.submit(_reroute_in_worker, entity): entity for entity in keys}
+                for future in as_completed(futures):
+                    try:
+                        result, complete, profile = future.result()
+                        if profile is not None:
+                            self.__profiler.merge(profile)
+                    except Exception as exception:
+                        result = (futures[future], None, f'{type(exception).__name__}: {exception}')
+                        complete = True
+                    if complete:
+                        self.__incomplete_paths.discard(result[0])
+                    else:
+                        self.__incomplete_paths.add(result[0])
+                    if result[1] is not None and complete and (key := keys[result[0]]) is not None:
+                        self.__result_cache.put(key, result[1])
+                    yield result
+        finally:
+            worker_scicrunch.close()
+            shared_memory.close()
+            shared_memory.unlink()
+
     def get_3d_pathways_graph(self, entity):
         G =  self.__store.connectivity_from_knowledge(knowledge=self.reroute_for_3d_map(entity))
         return G
 
+    @property
+    def graph_backend(self):
+        return self.__graph_backend
+
+    @property
+    def profiler(self):
+        return self.__profiler
+
+    @property
+    def result_cache(self):
+        return self.__result_cache
+
+    @property
+    def incomplete_paths(self):
+        """
+        The paths last rerouted while SciCrunch lookups went unanswered, whose
+        results aren't kept in the result cache.
+        """
+        return self.__incomplete_paths
+
     @property
     def nerve_pathways(self):
         return self.__nerve_pathways
+
+    @property
+    def nerve_maninbox(self):
+        return self.__nerve_maninbox
     
-    def get_3d_edges(self, G:nx.Graph):
-        points = []
-        
-        #  get points in 3d map for the identified edges
-        for e in G.edges:
+    def iter_3d_edges(self, G:nx.Graph):
+        """
+        Generate the pairs of 3D map points for the edges of ``G``, followed by
+        the segments between consecutive waypoints needed to join up points on
+        the same nerve. Each pair of points is generated once.
+        """
+        emitted = set()
+        def new_segment(points):
+            if len(points) == 2 and (key := frozenset((p['id'], p['point'][0]) for p in points)) not in emitted:
+                emitted.add(key)
+                return True
+            return False
+
+        #  get points in 3d map for the identified edges, noting the range
+        #  of point ordinals used on each nerve
+        ordinal_ranges = {}
+        for e in G.edges():
             n_0 = self.__nerve_pathways.get_nerve(e[0][0])
             n_1 = self.__nerve_pathways.get_nerve(e[1][0])
-            points += [self.__nerve_maninbox.get_points(n_0, n_1)]
+            points = self.__nerve_maninbox.get_points(n_0, n_1)
+            for p in points:
+                if (ordinal := p['point'][0]) >= 0:
+                    low, high = ordinal_ranges.get(p['id'], (ordinal, ordinal))
+                    ordinal_ranges[p['id']] = (min(low, ordinal), max(high, ordinal))
+            if new_segment(points):
+                yield points
 
         # points should be reconstruct to get full coverage
         # as an example the is edge of A0-B4 and A2-C1. 
         # There should be edge of A0-A1 and abd A1-A2 to make the connectivity complete
-        new_points = []
-        for pair in list(itertools.combinations([px for p in points for px in p], 2)):
-            if pair[0]['id'] == pair[1]['id']:
-                p0 = pair[0] if pair[0]['point'][0] < pair[1]['point'][0] else pair[1]
-                p1 = pair[0] if pair[0]['point'][0] > pair[1]['point'][0] else pair[1]
-                for group_num in range(p0['point'][0], p1['point'][0]):
-                    new_points += [[
-                        {
-                            'id': p0['id'],
-                            'label': p0['label'],
-                            'point': (group_num, (nerve_points:=self.__nerve_maninbox.get_nerve(p0['id'])['points'])[group_num]['group'])
-                        },
-                        {
-                            'id': p1['id'],
-                            'label': p1['label'],
-                            'point': (group_num+1, nerve_points[group_num+1]['group'])
-                        }
-                    ]]
-        return [p for p in points + new_points if len(p)==2]
+        for nerve_id, (low, high) in ordinal_ranges.items():
+            nerve = self.__nerve_maninbox.get_nerve(nerve_id)
+            nerve_points = nerve['points']
+            for group_num in range(low, high):
+                if group_num not in nerve_points or group_num+1 not in nerve_points:
+                    continue
+                points = [
+                    {
+                        'id': nerve['id'],
+                        'label': nerve['label'],
+                        'point': (group_num, nerve_points[group_num]['group'])
+                    },
+                    {
+                        'id': nerve['id'],
+                        'label': nerve['label'],
+                        'point': (group_num+1, nerve_points[group_num+1]['group'])
+                    }
+                ]
+                if new_segment(points):
+                    yield points
+
+    def get_3d_edges(self, G:nx.Graph):
+        with self.__profiler.stage('waypoints'):
+            return list(self.iter_3d_edges(G))
+
+    def get_3d_waypoint_graph(self, G:nx.Graph):
+        """
+        The graph of 3D map points joined by the edges from ``get_3d_edges``, built
+        with the graph backend. Nodes are point groups.
+        """
+        G_3d = self.__graph_class()
+        with self.__profiler.stage('waypoints'):
+            G_3d.add_edges_from((edge[0]['point'][1], edge[1]['point'][1]) for edge in self.iter_3d_edges(G))
+        return G_3d
+
+#===============================================================================
+
+# each process pool worker has its own Rerouting instance
+
+_worker_rerouting = None
+
+def _init_reroute_worker(path_hierarchy, path_maninbox, store_factory, scicrunch, shared_bundle, graph_backend,
+                         profiling):
+    global _worker_rerouting
+    _worker_rerouting = Rerouting(path_hierarchy, path_maninbox, store_factory(), scicrunch,
+                                  graph_backend=graph_backend, profiler=Profiler() if profiling else None,
+                                  shared_bundle=shared_bundle)
+
+def _reroute_in_worker(entity):
+    # along with whether its SciCrunch lookups were all answered and what
+    # the worker's profiler recorded while rerouting
+    result = _worker_rerouting.reroute_capturing_errors(entity)
+    return (result, entity not in _worker_rerouting.incomplete_paths, _worker_rerouting.profiler.take())
 
 #===============================================================================
 
 def draw_entity(store, rerouting, entity):
+    from connectivity_graph import display_connectivity_graph, display_connectivity_for_entity
     print(entity)
     print('SCKAN:')
     display_connectivity_for_entity(store, entity)
@@ -431,8 +805,8 @@ def draw_entity(store, rerouting, entity):
     return graph
 
 def draw_waypoints(rerouting, g):
-    edges_3d = rerouting.get_3d_edges(g)
-    g_3d = nx.Graph([(edge[0]['point'][1], edge[1]['point'][1]) for edge in edges_3d])
+    from connectivity_graph import display_connectivity_graph
+    g_3d = rerouting.get_3d_waypoint_graph(g).to_networkx()
     for n in g_3d.nodes:
         g_3d.nodes[n]['label'] = n
         g_3d.nodes[n]['dendrite'] = []
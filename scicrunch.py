@@ -0,0 +1,235 @@
+#===============================================================================
+
+from concurrent.futures import ThreadPoolExecutor
+import logging as log
+import requests
+from json import JSONDecodeError
+import os
+import threading
+import time
+
+from cache import PersistentCache
+from instrumentation import NO_PROFILER
+
+#===============================================================================
+
+LOOKUP_TIMEOUT = 30
+SCICRUNCH_API_KEY = os.environ.get('SCICRUNCH_API_KEY', '-')
+SCICRUNCH_API_ENDPOINT = 'https://scicrunch.org/api/1'
+
+# ILX relationship used for partOf
+PART_OF_RELATIONSHIP = 'ilx_0112785'
+
+# cached lookups expire after 30 days, and at most this many are kept
+DEFAULT_CACHE_TTL = 30*24*60*60
+DEFAULT_CACHE_SIZE = 100000
+
+# number of lookups that run at once when resolving a batch of terms
+DEFAULT_CONCURRENCY = 8
+
+def request_json(endpoint, session=None, **kwds):
+    try:
+        response = (session if session is not None else requests).get(endpoint,
+                                headers={'Accept': 'application/json'},
+                                timeout=LOOKUP_TIMEOUT,
+                                **kwds)
+        if response.status_code == requests.codes.ok:
+            try:
+                return response.json()
+            except JSONDecodeError:
+                error = 'Invalid JSON returned'
+        else:
+            error = response.reason
+    except requests.exceptions.RequestException as exception:
+        error = f'Exception: {exception}'
+    log.warning(f"Couldn't access {endpoint}: {error}")
+    return None
+
+#===============================================================================
+
+class RateLimiter:
+    """
+    Spaces out calls to ``wait()``, across threads, so that no more than
+    ``rate`` are made per second. A ``rate`` of ``None`` disables limiting.
+    """
+    def __init__(self, rate=None):
+        self.__interval = 1.0/rate if rate else 0.0
+        self.__next_time = 0.0
+        self.__lock = threading.Lock()
+
+    def wait(self):
+        if self.__interval == 0.0:
+            return
+        with self.__lock:
+            now = time.monotonic()
+            delay = self.__next_time - now
+            self.__next_time = max(now, self.__next_time) + self.__interval
+        if delay > 0:
+            time.sleep(delay)
+
+#===============================================================================
+
+class SciCrunch:
+    """
+    Looks up ILX/UBERON terms in SciCrunch, keeping their ``existing_ids`` and
+    ``partOf`` relationships in memory and, if ``cache_path`` is given, in a
+    persistent cache. Terms that SciCrunch doesn't know are cached as ``{}``.
+    In ``offline`` mode only cached lookups are used. Lookups that get no answer,
+    when SciCrunch can't be reached or, offline, the term isn't cached, return
+    ``{}`` and are counted in ``unresolved``.
+
+    Batches of terms are resolved concurrently by ``resolve()``, using up to
+    ``concurrency`` pooled connections and at most ``rate_limit`` requests
+    per second. The rate limit is kept by each process, so worker processes
+    are given a copy from ``shared_by()``.
+
+    Request latencies and rate limit waits are recorded by ``profiler``.
+    """
+    def __init__(self, cache_path=None, ttl=DEFAULT_CACHE_TTL, cache_size=DEFAULT_CACHE_SIZE,
+                 offline=False, api_key=SCICRUNCH_API_KEY, endpoint=SCICRUNCH_API_ENDPOINT,
+                 concurrency=DEFAULT_CONCURRENCY, rate_limit=None):
+        self.__settings = {
+            'cache_path': cache_path,
+            'ttl': ttl,
+            'cache_size': cache_size,
+            'offline': offline,
+            'api_key': api_key,
+            'endpoint': endpoint,
+            'concurrency': concurrency,
+            'rate_limit': rate_limit,
+        }
+        self.__cache = (PersistentCache(cache_path, table='scicrunch', ttl=ttl, max_entries=cache_size)
+                            if cache_path is not None else None)
+        self.__offline = offline
+        self.__api_key = api_key
+        self.__endpoint = endpoint
+        self.__concurrency = max(1, concurrency)
+        self.__rate_limiter = RateLimiter(rate_limit)
+        self.__session = None
+        self.__executor = None
+        self.__lookups = {}
+        self.__unresolved = 0
+        self.__profiler = NO_PROFILER
+
+    # pickle only the settings, so that worker processes open their own
+    # cache connection and session
+    def __getstate__(self):
+        return self.__settings
+
+    def __setstate__(self, settings):
+        self.__init__(**settings)
+
+    def shared_by(self, processes):
+        """
+        A copy for each of ``processes`` worker processes, with an equal share
+        of the rate limit so that together they keep to it.
+        """
+        rate_limit = self.__settings['rate_limit']
+        return SciCrunch(**(self.__settings | {
+            'rate_limit': rate_limit/max(1, processes) if rate_limit else None
+        }))
+
+    @property
+    def cache(self):
+        return self.__cache
+
+    @property
+    def offline(self):
+        return self.__offline
+
+    @property
+    def unresolved(self):
+        return self.__unresolved
+
+    @property
+    def profiler(self):
+        return self.__profiler
+
+    @profiler.setter
+    def profiler(self, profiler):
+        self.__profiler = profiler
+
+    def __session_for_requests(self):
+        if self.__session is None:
+            self.__session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.__concurrency,
+                                                    pool_maxsize=self.__concurrency)
+            self.__session.mount('http://', adapter)
+            self.__session.mount('https://', adapter)
+        return self.__session
+
+    def __fetch(self, curie):
+        # runs in worker threads so mustn't touch the cache
+        start = time.perf_counter()
+        self.__rate_limiter.wait()
+        requested = time.perf_counter()
+        params = {
+                'api_key': self.__api_key,
+                'limit': 9999,
+            }
+        response = request_json(f'{self.__endpoint}/ilx/search/curie/{curie}',
+                                session=self.__session_for_requests(), params=params)
+        if self.__profiler.enabled:
+            self.__profiler.latency('scicrunch rate limit wait', requested - start)
+            self.__profiler.latency('scicrunch request', time.perf_counter() - requested)
+        # failed requests return None and aren't remembered so are retried
+        return self.__parse_response(response) if response is not None else None
+
+    def __known(self, curie):
+        if (data := self.__lookups.get(curie)) is not None:
+            return data
+        if self.__cache is not None and (data := self.__cache.get(curie)) is not None:
+            self.__lookups[curie] = data
+            return data
+        return None
+
+    def __remember(self, lookups):
+        self.__lookups.update(lookups)
+        if self.__cache is not None:
+            self.__cache.put_many(lookups.items())
+
+    def lookup(self, curie):
+        if (data := self.__known(curie)) is not None:
+            return data
+        if self.__offline or (data := self.__fetch(curie)) is None:
+            self.__unresolved += 1
+            return {}
+        self.__remember({curie: data})
+        return data
+
+    def resolve(self, curies):
+        pending = [curie for curie in dict.fromkeys(curies) if self.__known(curie) is None]
+        if self.__offline or len(pending) == 0:
+            return
+        if len(pending) == 1:
+            self.lookup(pending[0])
+            return
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__concurrency)
+        # create the shared session before any worker thread needs it
+        self.__session_for_requests()
+        self.__remember({curie: data for curie, data in zip(pending, self.__executor.map(self.__fetch, pending))
+                            if data is not None})
+
+    @staticmethod
+    def __parse_response(response):
+        idxs = [concept['curie'] for concept in (response.get('data', {}).get('existing_ids') or [])]
+        if len(idxs) == 0:
+            return {}
+        return {
+            'idxs': idxs,
+            'partOf': [r.get('term2_curie') for r in (response['data'].get('relationships') or [])
+                            if r.get('relationship_term_ilx', '') == PART_OF_RELATIONSHIP]
+        }
+
+    def close(self):
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+        if self.__session is not None:
+            self.__session.close()
+            self.__session = None
+        if self.__cache is not None:
+            self.__cache.close()
+
+#===============================================================================
@@ -0,0 +1,52 @@
+#===============================================================================
+
+import numpy as np
+
+#===============================================================================
+
+class PointIndex:
+    """
+    Nearest neighbour and radius queries over a fixed set of 3D points. Points
+    with missing (non-finite) coordinates are never returned.
+
+    Queries are vectorised scans over a contiguous copy of the coordinates;
+    at the size of the man-in-box annotations (a few thousand points) a scan
+    takes tens of microseconds, less than walking a tree built in Python.
+    """
+    def __init__(self, coordinates):
+        coordinates = np.asarray(coordinates, dtype=np.float64).reshape(-1, 3)
+        self.__rows = np.flatnonzero(np.isfinite(coordinates).all(axis=1))
+        self.__points = np.ascontiguousarray(coordinates[self.__rows])
+
+    def __len__(self):
+        return len(self.__rows)
+
+    def __squared_distances(self, xyz):
+        delta = self.__points - np.asarray(xyz, dtype=np.float64)
+        return np.einsum('ij,ij->i', delta, delta)
+
+    def __ordered(self, selected, squared_distances):
+        selected = selected[np.argsort(squared_distances[selected], kind='stable')]
+        return (self.__rows[selected], np.sqrt(squared_distances[selected]))
+
+    def nearest(self, xyz, k=1):
+        """
+        The rows of the ``k`` points nearest to ``xyz`` and their distances,
+        nearest first.
+        """
+        squared_distances = self.__squared_distances(xyz)
+        if (k := min(k, len(squared_distances))) < len(squared_distances):
+            selected = np.argpartition(squared_distances, k-1)[:k]
+        else:
+            selected = np.arange(len(squared_distances))
+        return self.__ordered(selected, squared_distances)
+
+    def within(self, xyz, radius):
+        """
+        The rows of all points within ``radius`` of ``xyz`` and their distances,
+        nearest first.
+        """
+        squared_distances = self.__squared_distances(xyz)
+        return self.__ordered(np.flatnonzero(squared_distances <= radius*radius), squared_distances)
+
+#===============================================================================
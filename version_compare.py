@@ -0,0 +1,135 @@
+#===============================================================================
+
+import json
+
+from coverage import CoverageAggregator
+from reroute_cache import knowledge_hash
+
+#===============================================================================
+
+def set_diff(old, new):
+    return {
+        'added': sorted(new - old),
+        'removed': sorted(old - new),
+    }
+
+#===============================================================================
+
+class VersionComparison:
+    """
+    Compares the 3D whole body map coverage of two SCKAN versions. The paths of
+    the new version whose knowledge is identical in the old version aren't rerouted
+    again, their old results are used, so only new and changed paths are rerouted
+    for the new version. Result caches are keyed by path knowledge rather than
+    SCKAN version, so a cache given to both ``Rerouting`` instances holds the
+    results of both versions for the next comparison.
+    """
+    def __init__(self, old_version, new_version):
+        self.__old_version = old_version
+        self.__new_version = new_version
+        self.__old_coverage = None
+        self.__new_coverage = None
+        self.__paths = {}
+
+    @property
+    def old_coverage(self):
+        return self.__old_coverage
+
+    @property
+    def new_coverage(self):
+        return self.__new_coverage
+
+    @property
+    def rerouted_paths(self):
+        return self.__paths.get('rerouted', [])
+
+    @property
+    def reused_paths(self):
+        return self.__paths.get('unchanged', [])
+
+    @staticmethod
+    def __human_knowledge(coverage, store, paths):
+        knowledge = {}
+        for path in paths:
+            path_knowledge = store.entity_knowledge(path)
+            if coverage.add_path(path, path_knowledge):
+                knowledge[path] = path_knowledge
+        return knowledge
+
+    @staticmethod
+    def __reroute(rerouting, paths, workers, store_factory):
+        return {path: (reroute_knowledge, error)
+                    for path, reroute_knowledge, error in rerouting.reroute_many(paths, workers=workers,
+                                                                                 store_factory=store_factory)}
+
+    @staticmethod
+    def __add_results(coverage, paths, results):
+        # in path order, so that reports don't depend on completion order
+        for path in paths:
+            reroute_knowledge, error = results[path]
+            if error is not None:
+                coverage.add_failure(path, error)
+            else:
+                coverage.add_reroute(path, reroute_knowledge)
+
+    def compare(self, old_rerouting, old_store, new_rerouting, new_store, workers=1,
+                old_store_factory=None, new_store_factory=None, is_nerve=None):
+        """
+        Reroute the human paths of both versions, each with the ``Rerouting`` of
+        its own knowledge store, and return the differences between them.
+        """
+        self.__old_coverage = CoverageAggregator(is_nerve=is_nerve)
+        self.__new_coverage = CoverageAggregator(is_nerve=is_nerve)
+        old_knowledge = self.__human_knowledge(self.__old_coverage, old_store, old_store.connectivity_paths())
+        new_knowledge = self.__human_knowledge(self.__new_coverage, new_store, new_store.connectivity_paths())
+
+        old_hashes = {path: knowledge_hash(knowledge) for path, knowledge in old_knowledge.items()}
+        new_hashes = {path: knowledge_hash(knowledge) for path, knowledge in new_knowledge.items()}
+        unchanged = [path for path in new_knowledge if old_hashes.get(path) == new_hashes[path]]
+        unchanged_paths = set(unchanged)
+        self.__paths = {
+            'added': [path for path in new_knowledge if path not in old_knowledge],
+            'removed': [path for path in old_knowledge if path not in new_knowledge],
+            'changed': [path for path in new_knowledge
+                            if path in old_knowledge and path not in unchanged_paths],
+            'unchanged': unchanged,
+            'rerouted': [path for path in new_knowledge if path not in unchanged_paths],
+        }
+
+        old_results = self.__reroute(old_rerouting, list(old_knowledge), workers, old_store_factory)
+        new_results = self.__reroute(new_rerouting, self.__paths['rerouted'], workers, new_store_factory)
+        new_results.update((path, old_results[path]) for path in unchanged)
+        self.__add_results(self.__old_coverage, old_knowledge, old_results)
+        self.__add_results(self.__new_coverage, new_knowledge, new_results)
+        return self.diff()
+
+    def diff(self):
+        old, new = self.__old_coverage, self.__new_coverage
+        old_failed, new_failed = old.failed_paths, new.failed_paths
+        return {
+            'old_version': self.__old_version,
+            'new_version': self.__new_version,
+            'counts': {
+                'old': old.counts,
+                'new': new.counts,
+            },
+            'paths': {
+                'added': self.__paths['added'],
+                'removed': self.__paths['removed'],
+                'changed': self.__paths['changed'],
+                'unchanged': len(self.__paths['unchanged']),
+            },
+            'covered_paths': set_diff(old.covered_paths, new.covered_paths),
+            'covered_nodes': set_diff(old.covered_nodes, new.covered_nodes),
+            'covered_edges': set_diff(old.covered_edges, new.covered_edges),
+            'failed_paths': {
+                'added': {path: error for path, error in new_failed.items() if path not in old_failed},
+                'removed': sorted(path for path in old_failed if path not in new_failed),
+            },
+        }
+
+    def save_diff(self, filename, **metadata):
+        with open(filename, 'w') as fp:
+            json.dump(metadata | self.diff(), fp, indent=4)
+
+#===============================================================================
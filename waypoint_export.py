@@ -0,0 +1,135 @@
+#===============================================================================
+
+import json
+
+import logging as log
+import numpy as np
+
+#===============================================================================
+
+# an export is a GeoJSON text sequence (RFC 8142), each feature is written as
+# RS, the feature's JSON and a newline. Segments, the lines between pairs of 3D
+# map points, are written once, the first time a path uses them, and paths then
+# refer to them by index, so a reader loads the file in a single pass.
+
+RECORD_SEPARATOR = '\x1e'
+
+SEGMENT_FEATURE = 'segment'
+PATH_FEATURE = 'path'
+
+def point_key(point):
+    return (point['id'], point['point'][0])
+
+def segment_key(points):
+    u, v = point_key(points[0]), point_key(points[1])
+    return (u, v) if u <= v else (v, u)
+
+#===============================================================================
+
+class WaypointExporter:
+    """
+    Writes the 3D map segments of rerouted paths, resolved to annotation
+    coordinates, with segments shared between paths stored once.
+    """
+    def __init__(self, rerouting, store):
+        self.__rerouting = rerouting
+        self.__store = store
+        self.__segments = {}            # segment key --> index
+        self.__stats = {
+            'paths': 0,
+            'failed_paths': 0,
+            'segments': 0,
+            'segment_references': 0,
+            'unresolved_segments': 0,
+        }
+
+    @property
+    def stats(self):
+        return self.__stats
+
+    def __coordinates(self, key):
+        nerve_id, ordinal = key
+        if ordinal < 0:
+            return None
+        coordinates = self.__rerouting.nerve_maninbox.get_point_coordinates(nerve_id, ordinal)
+        if coordinates is None or not np.isfinite(coordinates).all():
+            return None
+        return coordinates.tolist()
+
+    def __write(self, fp, feature):
+        fp.write(RECORD_SEPARATOR)
+        fp.write(json.dumps(feature, separators=(',', ':')))
+        fp.write('\n')
+
+    def __segment_index(self, fp, points):
+        # a new segment is written when first seen, segments without coordinates
+        # for both points, or which join a point to itself, have no index
+        key = segment_key(points)
+        if (index := self.__segments.get(key)) is not None:
+            return index
+        if key[0] == key[1] or None in (coordinates := [self.__coordinates(k) for k in key]):
+            return None
+        index = self.__segments[key] = len(self.__segments)
+        groups = {point_key(point): point['point'][1] for point in points}
+        self.__write(fp, {
+            'type': 'Feature',
+            'id': index,
+            'geometry': {
+                'type': 'LineString',
+                'coordinates': coordinates,
+            },
+            'properties': {
+                'feature': SEGMENT_FEATURE,
+                'nerves': [k[0] for k in key],
+                'groups': [groups[k] for k in key],
+            }
+        })
+        self.__stats['segments'] += 1
+        return index
+
+    def add_path(self, fp, path, reroute_knowledge):
+        # the path's 3D edges are all found before any of its segments are written
+        G = self.__store.connectivity_from_knowledge(reroute_knowledge, labels=False)
+        edges = list(self.__rerouting.iter_3d_edges(G))
+        segments = []
+        unresolved = 0
+        for points in edges:
+            if (index := self.__segment_index(fp, points)) is None:
+                unresolved += 1
+            else:
+                segments.append(index)
+        self.__write(fp, {
+            'type': 'Feature',
+            'id': path,
+            'geometry': None,
+            'properties': {
+                'feature': PATH_FEATURE,
+                'label': reroute_knowledge.get('label'),
+                'segments': segments,
+                'unresolved': unresolved,
+            }
+        })
+        self.__stats['paths'] += 1
+        self.__stats['segment_references'] += len(segments)
+        self.__stats['unresolved_segments'] += unresolved
+
+    def export(self, filename, paths, workers=1, store_factory=None):
+        """
+        Reroute ``paths`` and write their segments to ``filename``. Paths that
+        fail rerouting, or whose 3D edges can't be found, are logged and left out.
+        """
+        with open(filename, 'w') as fp:
+            for path, reroute_knowledge, error in self.__rerouting.reroute_many(paths, workers=workers,
+                                                                                store_factory=store_factory):
+                if error is not None:
+                    log.error(f"Couldn't reroute {path}: {error}")
+                    self.__stats['failed_paths'] += 1
+                    continue
+                try:
+                    self.add_path(fp, path, reroute_knowledge)
+                except Exception as exception:
+                    log.error(f"Couldn't export {path}: {type(exception).__name__}: {exception}")
+                    self.__stats['failed_paths'] += 1
+        return self.__stats
+
+#===============================================================================